@@ -0,0 +1,99 @@
+"""Compares archive and content-addressed cache entries of similar outputs
+
+Saves the outputs of several runs, each changing a few of the files of the
+previous one, to a local cache of archives and to a content-addressed one.
+Archives are measured compressed with zstd, like the actions cache stores them.
+Then restores every run on a fresh runner with a local blob directory and
+reports the bytes stored and transferred by each. Needs the zstd CLI.
+
+    PYTHONPATH=src python benchmarks/content_addressed.py --files 200 --runs 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import subprocess
+import tempfile
+from pathlib import Path
+
+from cixx._cas import ContentAddressedStore
+from cixx._local_cache import LocalCache
+
+
+def _size(directory: Path) -> int:
+    return sum(path.stat().st_size for path in directory.rglob("*") if path.is_file())
+
+
+def _zstd_size(directory: Path) -> int:
+    """The size of the files once compressed with zstd, like actions/cache does"""
+    return sum(
+        len(
+            subprocess.run(
+                ["zstd", "-q", "-c", "-T0", str(path)], capture_output=True, check=True
+            ).stdout
+        )
+        for path in directory.rglob("*")
+        if path.is_file()
+    )
+
+
+def _write_outputs(workspace: Path, files: int, size: int, changed: list[int]):
+    (workspace / "dist").mkdir(parents=True, exist_ok=True)
+    for i in changed:
+        # Half random, half repeated so both stores have something to compress
+        data = os.urandom(size // 2) + bytes(size - size // 2)
+        (workspace / "dist" / f"f{i:04}.bin").write_bytes(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--size", type=int, default=50_000, help="Bytes per file")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--changed", type=float, default=0.05, help="Fraction of files changed per run"
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as temp:
+        workspace = Path(temp) / "workspace"
+        home = Path(temp) / "home"
+        tar = LocalCache(Path(temp) / "tar")
+        cas = LocalCache(Path(temp) / "cas", content_addressed=True)
+
+        keys = list[str]()
+        changed = list(range(args.files))
+        for run in range(args.runs):
+            _write_outputs(workspace, args.files, args.size, changed)
+            keys.append(f"outputs-{run}")
+            tar.save(keys[-1], ["dist/"], workspace, home)
+            cas.save(keys[-1], ["dist/"], workspace, home)
+            changed = rng.sample(
+                range(args.files), max(1, round(args.files * args.changed))
+            )
+
+        store = ContentAddressedStore(cas.directory, local=Path(temp) / "local")
+        for key in keys:
+            store.restore(key, Path(temp) / "restored" / key, home)
+
+        output = args.files * args.size * args.runs
+        print(
+            f"Outputs: {args.runs} runs of {args.files} files,"
+            f" {args.changed:.0%} changed per run, {output / 1e6:.1f} MB in total"
+        )
+        tar_bytes = _zstd_size(tar.directory)
+        for name, stored, transferred in (
+            ("tar.zst", tar_bytes, tar_bytes),
+            ("content", _size(cas.directory), store.stats.fetched),
+        ):
+            print(
+                f"{name:<8} stored {stored / 1e6:8.1f} MB,"
+                f" transferred {transferred / 1e6:8.1f} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Compares the bytes fetched by cone and precise sparse checkouts
+
+Creates a repository of incompressible files, then runs a job needing a few
+of them in each mode like `ci++ run` and reports the size of the git objects
+each clone fetched.
+
+    PYTHONPATH=src python benchmarks/sparse_checkout.py --dirs 20 --files 50
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+
+from cixx.__main__ import _preprocess, _process
+from cixx._local_cache import LocalCache
+from cixx._local_run import LocalRunner
+
+_WORKFLOW = """\
+on:
+  push:
+
+jobs:
+  cone:
+    runs-on: ubuntu-20.04
+    paths: &paths
+      - d00/f000.bin
+      - d01/f000.bin
+      - d02/f000.bin
+    steps:
+      - ls -R
+  precise:
+    runs-on: ubuntu-20.04
+    paths: *paths
+    sparse-checkout: precise
+    steps:
+      - ls -R
+"""
+
+
+def _create_repository(root: Path, dirs: int, files: int, size: int):
+    root.mkdir()
+    for i in range(dirs):
+        (root / f"d{i:02}").mkdir()
+        for j in range(files):
+            (root / f"d{i:02}" / f"f{j:03}.bin").write_bytes(os.urandom(size))
+    (root / "main.yml").write_text(_WORKFLOW)
+    for args in (
+        ["init", "-q"],
+        ["add", "."],
+        ["-c", "user.name=x", "-c", "user.email=x", "commit", "-qm", "x"],
+    ):
+        subprocess.run(["git", *args], cwd=root, check=True)
+
+
+def _size(directory: Path) -> int:
+    return sum(path.stat().st_size for path in directory.rglob("*") if path.is_file())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dirs", type=int, default=20)
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--size", type=int, default=100_000, help="Bytes per file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp:
+        repository = Path(temp) / "repository"
+        _create_repository(repository, args.dirs, args.files, args.size)
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=repository,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+
+        work_dir = Path(temp) / "work"
+        runner = LocalRunner(
+            _process(_preprocess(repository / "main.yml")),
+            repository,
+            commit,
+            LocalCache(Path(temp) / "cache"),
+            work_dir,
+            max_workers=2,
+            log=io.StringIO(),
+        )
+        results = runner.run()
+
+        print(
+            f"Repository: {args.dirs * args.files} files,"
+            f" {_size(repository / '.git' / 'objects') / 1e6:.1f} MB of objects"
+        )
+        for job in ("cone", "precise"):
+            workspace = work_dir / "jobs" / job
+            files = sum(1 for path in workspace.rglob("*.bin"))
+            print(
+                f"{job:<8} {results[job].result:<8}"
+                f" fetched {_size(workspace / '.git' / 'objects') / 1e6:8.1f} MB,"
+                f" checked out {files} files"
+            )
+
+
+if __name__ == "__main__":
+    main()
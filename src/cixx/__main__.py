@@ -1,28 +1,91 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
+import json
+import os
 import sys
+import tempfile
+import time
+from collections.abc import Collection, Mapping
 from pathlib import Path
+from typing import cast
 
 import ruamel.yaml
-from ruamel.yaml.representer import RoundTripRepresenter
 
 from . import _github_actions as gh
 from . import _init_job as init_job
 from . import _normal_job as normal_job
-from ._common import INIT_JOB_ID, JobDetails, outputs_file
+from ._common import (
+    FORCE_RERUN_INPUT,
+    INIT_JOB_ID,
+    CacheDetails,
+    CachedStepDetails,
+    Helpers,
+    JobDetails,
+    ShardDetails,
+    get_caches,
+    outputs_file,
+)
+from ._keys import GitObjects, format_prediction, get_cache_keys, get_keys
+from ._local_cache import LocalCache
+from ._local_run import LocalRunner, format_results
+from ._lsp import LanguageServer
+from ._repository import find_root
 from ._reuseable_workflow import expand_cixx_uses, replace_jobs_references
+from ._schedule import Schedule, format_schedule, load_durations, schedule
+from ._schema import InvalidWorkflowError, check, validate
+from ._split import find_helpers, format_sizes, get_children, get_helpers_action, split
+from ._telemetry import format_report, load_records
 from ._transform import (
+    expand_for_each,
+    expand_matrices,
+    expand_shards,
+    expand_submodules,
     flatten_nested_steps_and_expand_implicit_run,
+    fold_conditions,
     remove_x_properties,
 )
-from ._validation import Json, to_json_array_of_strings, to_json_object
+from ._validation import Json, is_json_object, to_json_array, to_json_object, to_string
+from ._yaml import dump
 
 
 def main():
     """Process command line arguments"""
 
-    parser = argparse.ArgumentParser(description="Compile to GitHub Actions workflow.")
+    parser = argparse.ArgumentParser(
+        prog="ci++",
+        description="Compile to GitHub Actions workflow, compile is the default "
+        "command.",
+    )
+    subparsers = parser.add_subparsers(title="commands")
+    _add_compile_parser(subparsers)
+    _add_check_parser(subparsers)
+    _add_plan_parser(subparsers)
+    _add_run_parser(subparsers)
+    _add_report_parser(subparsers)
+    _add_lsp_parser(subparsers)
+
+    argv = sys.argv[1:]
+    # So ci++ input output compiles
+    if not argv or argv[0] not in [*subparsers.choices, "-h", "--help"]:
+        argv = ["compile", *argv]
+
+    args = parser.parse_args(argv)
+    try:
+        sys.exit(args.main(args))
+    except InvalidWorkflowError as error:
+        for problem in dict.fromkeys(error.problems):
+            print(problem, file=sys.stderr)
+        sys.exit(1)
+
+
+def _add_compile_parser(subparsers: argparse._SubParsersAction):
+    parser = subparsers.add_parser(
+        "compile",
+        help="Compile to GitHub Actions workflow",
+        description="Compile to GitHub Actions workflow.",
+    )
     parser.add_argument("input_file", help="Input CI++ YAML file")
     parser.add_argument(
         "output_file",
@@ -35,45 +98,346 @@ def main():
         action="store_true",
         help="Only expand YAML references, cixx-uses, nested steps, run strings",
     )
+    parser.add_argument(
+        "--durations",
+        help="JSON file of job name to historical duration in seconds, "
+        "used to keep jobs on the critical path fast",
+    )
+    parser.add_argument(
+        "--telemetry",
+        action="store_true",
+        help="Record cache hits, sizes and timings in the job summaries and "
+        "artifacts, see ci++ report",
+    )
+    parser.add_argument(
+        "--split-max-bytes",
+        type=int,
+        help="Run scripts repeated in jobs from a generated composite action, and "
+        "split a larger workflow into child workflows it calls, needs the "
+        "output file in .github/workflows",
+    )
+    parser.set_defaults(main=lambda args: _compile(parser, args))
 
-    args = parser.parse_args()
-
-    input_file = Path(args.input_file)
-    input_ = expand_cixx_uses(input_file)
 
-    input_ = remove_x_properties(input_)
-    input_ = flatten_nested_steps_and_expand_implicit_run(input_)
+def _compile(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    output_file = Path(args.output_file) if args.output_file else None
+    if args.split_max_bytes is not None and (
+        output_file is None
+        or output_file.parent.name != "workflows"
+        or output_file.parent.parent.name != ".github"
+    ):
+        parser.error("--split-max-bytes needs an output file in .github/workflows")
 
-    input_ = replace_jobs_references(input_)
+    input_ = _preprocess(Path(args.input_file))
 
+    helpers = None
     if args.preprocess_only:
         output = input_
     else:
-        output = _process(input_)
+        durations = load_durations(Path(args.durations)) if args.durations else None
+        if args.split_max_bytes is not None and output_file is not None:
+            # Durations only change the runners and coalescing, not the scripts
+            helpers = Helpers(
+                action=f".github/actions/cixx-{output_file.stem}",
+                steps=find_helpers(_process(input_, telemetry=args.telemetry)),
+            )
+        output = _process(input_, durations, args.telemetry, helpers)
+
+    if output_file is None:
+        dump(output, sys.stdout)
+        return
+
+    files = {output_file: output}
+    if args.split_max_bytes is not None and not args.preprocess_only:
+        workflows = split(output, output_file.name, args.split_max_bytes)
+        files = {output_file.parent / name: data for name, data in workflows.items()}
+        if helpers is not None and (
+            action := get_helpers_action(workflows, helpers, output_file.name)
+        ):
+            files[
+                output_file.parent.parent.parent / helpers.action / "action.yml"
+            ] = action
+
+    stale = _get_stale_children(output_file, files)
+    for path, data in files.items():
+        path.parent.mkdir(exist_ok=True, parents=True)
+        with open(path, "w", encoding="utf-8") as file:
+            dump(data, file)
+    for path in stale:
+        path.unlink(missing_ok=True)
+        print(
+            f"Removed {path}, the workflow is no longer split into it", file=sys.stderr
+        )
+    if args.split_max_bytes is not None:
+        print(
+            format_sizes({str(path): data for path, data in files.items()}),
+            file=sys.stderr,
+        )
+
+
+def _get_stale_children(output_file: Path, files: Collection[Path]) -> list[Path]:
+    """Returns the child workflows an earlier split wrote that aren't written now"""
+    try:
+        previous = ruamel.yaml.YAML(typ="safe").load(output_file)
+    except (OSError, ruamel.yaml.YAMLError):
+        return []
+    return [
+        output_file.parent / name
+        for name in get_children(previous, output_file.name)
+        if output_file.parent / name not in files
+    ]
+
+
+def _add_plan_parser(subparsers: argparse._SubParsersAction):
+    parser = subparsers.add_parser(
+        "plan",
+        help="Predict which jobs a commit would rebuild",
+        description="Predict which jobs a commit would rebuild from a local checkout, "
+        "and show the critical path and the slack of each job.",
+    )
+    parser.add_argument("input_file", help="Input CI++ YAML file")
+    parser.add_argument(
+        "--rev", default="HEAD", help="Revision to compute keys for, default HEAD"
+    )
+    parser.add_argument(
+        "--base", help="Revision to compare keys with to explain what changed"
+    )
+    existing = parser.add_mutually_exclusive_group()
+    existing.add_argument(
+        "--cache-keys",
+        help="File listing the existing cache keys, the first field of each line",
+    )
+    existing.add_argument("--cache-dir", help="Local cache directory")
+    parser.add_argument(
+        "--durations",
+        help="JSON file of job name to historical duration in seconds",
+    )
+    parser.set_defaults(main=_plan)
 
-    if args.output_file:
-        output_file = Path(args.output_file)
-        output_file.parent.mkdir(exist_ok=True, parents=True)
-    else:
-        output_file = sys.stdout
 
-    yaml = ruamel.yaml.YAML()
+def _plan(args: argparse.Namespace):
+    input_file = Path(args.input_file)
+    input_ = to_json_object(_preprocess(input_file), "top level")
+    jobs = to_json_object(input_["jobs"], "jobs")
+    job_details = {
+        job_key: _process_job(job_key, job)
+        for job_key, job in (
+            (job_key, to_json_object(job, f"jobs.{job_key}"))
+            for job_key, job in jobs.items()
+        )
+        if "steps" in job
+    }
+
+    existing_keys = None
+    if args.cache_keys:
+        existing_keys = {
+            line.split()[0]
+            for line in Path(args.cache_keys).read_text().splitlines()
+            if line.strip()
+        }
+    elif args.cache_dir:
+        cache_dir = Path(args.cache_dir)
+        existing_keys = (
+            LocalCache(cache_dir).keys()
+            | LocalCache(cache_dir, content_addressed=True).keys()
+        )
+
+    with GitObjects(find_root(input_file.parent)) as git:
+        commit = _resolve_commit(git, args.rev)
+        keys = get_keys(git, commit, job_details)
+        cache_keys = get_cache_keys(git, commit, get_caches(job_details))
+        base_keys = None
+        if args.base:
+            base_keys = get_keys(git, _resolve_commit(git, args.base), job_details)
+
+    print(f"Jobs at {commit}:")
+    print(format_prediction(keys, existing_keys, base_keys))
+    if cache_keys:
+        print()
+        print("Caches:")
+        print(format_prediction(cache_keys, None))
+
+    if args.durations:
+        print()
+        print(
+            format_schedule(schedule(job_details, load_durations(Path(args.durations))))
+        )
+
+
+def _add_run_parser(subparsers: argparse._SubParsersAction):
+    parser = subparsers.add_parser(
+        "run",
+        help="Run the workflow on this machine",
+        description="Run the workflow on this machine with a local cache.",
+    )
+    parser.add_argument("input_file", help="Input CI++ YAML file")
+    parser.add_argument("--rev", default="HEAD", help="Revision to run, default HEAD")
+    parser.add_argument(
+        "--cache-dir",
+        default=Path.home() / ".cache" / "cixx",
+        help="Local cache directory, default ~/.cache/cixx",
+    )
+    parser.add_argument(
+        "--work-dir", help="Directory for job workspaces, default a temporary one"
+    )
+    parser.add_argument(
+        "--content-addressed",
+        action="store_true",
+        help="Store each distinct output file once in the cache directory, "
+        "compressed with zstd, instead of an archive per entry",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Maximum jobs to run at once, default the number of CPUs",
+    )
+    parser.add_argument(
+        "--telemetry-dir",
+        help="Record telemetry like --telemetry into this directory, see ci++ report",
+    )
+    parser.set_defaults(main=_run)
+
+
+def _run(args: argparse.Namespace) -> int:
+    input_file = Path(args.input_file)
+    input_ = {
+        key: value
+        for key, value in to_json_object(_preprocess(input_file), "top level").items()
+        if key != "cache-backend"
+    }
+    if not args.content_addressed:
+        # Batched restores read the same entries as the actions cache, content
+        # addressed ones are restored one at a time instead
+        input_["cache-backend"] = {"directory": str(Path(args.cache_dir).absolute())}
+    workflow = _process(input_, telemetry=bool(args.telemetry_dir))
+    repository = find_root(input_file.parent)
+    with GitObjects(repository) as git:
+        commit = _resolve_commit(git, args.rev)
+
+    with contextlib.ExitStack() as stack:
+        if args.work_dir:
+            work_dir = Path(args.work_dir)
+        else:
+            work_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        runner = LocalRunner(
+            workflow,
+            repository,
+            commit,
+            LocalCache(Path(args.cache_dir), args.content_addressed),
+            work_dir,
+            args.jobs,
+            artifact_dir=Path(args.telemetry_dir) if args.telemetry_dir else None,
+        )
+        start = time.monotonic()
+        results = runner.run()
+
+    print(format_results(results, time.monotonic() - start))
+    return 1 if any(result.result == "failure" for result in results.values()) else 0
+
+
+def _add_report_parser(subparsers: argparse._SubParsersAction):
+    parser = subparsers.add_parser(
+        "report",
+        help="Summarize the telemetry of workflows",
+        description="Summarize the telemetry of workflows compiled with --telemetry.",
+    )
+    parser.add_argument(
+        "directory",
+        help="Directory of telemetry artifacts, e.g. from gh run download",
+    )
+    parser.add_argument(
+        "--last", type=int, default=10, help="Number of recent runs to list"
+    )
+    parser.set_defaults(main=_report)
+
+
+def _report(args: argparse.Namespace):
+    print(format_report(load_records(Path(args.directory)), args.last))
+
+
+def _add_check_parser(subparsers: argparse._SubParsersAction):
+    parser = subparsers.add_parser(
+        "check",
+        help="Validate CI++ files without generating anything",
+        description="Validate CI++ files and the files they cixx-uses without "
+        "generating anything, printing each problem as file:line:column.",
+    )
+    parser.add_argument("input_files", nargs="+", help="Input CI++ YAML files")
+    parser.set_defaults(main=_check)
+
+
+def _check(args: argparse.Namespace) -> int:
+    problems = [
+        problem
+        for input_file in args.input_files
+        for problem in check(Path(input_file))
+    ]
+    for problem in dict.fromkeys(problems):
+        print(problem)
+    return 1 if problems else 0
+
+
+def _add_lsp_parser(subparsers: argparse._SubParsersAction):
+    parser = subparsers.add_parser(
+        "lsp",
+        help="Language server for editing CI++ files",
+        description="Language server for editing CI++ files, with diagnostics, "
+        "go to definition of jobs and outputs, and hover of expanded expressions.",
+    )
+    parser.add_argument(
+        "--stdio", action="store_true", help="Talk over stdin and stdout, the default"
+    )
+    parser.set_defaults(main=_lsp)
+
 
-    class NonAliasingRTRepresenter(RoundTripRepresenter):
-        """Removes aliases because they're not supported by github"""
+def _lsp(args: argparse.Namespace) -> int:
+    return LanguageServer(sys.stdin.buffer, sys.stdout.buffer).serve()
 
-        def ignore_aliases(self, data: object):
-            return True
 
-        def represent_scalar(self, tag, value, style=None, anchor=None):  # type: ignore
-            return super().represent_scalar(tag, value, style)  # type: ignore
+def _resolve_commit(git: GitObjects, rev: str) -> str:
+    commit = git.read(f"{rev}^{{commit}}")
+    if commit is None:
+        raise ValueError(f"Unknown revision: {rev}")
+    return commit.sha
 
-    yaml.Representer = NonAliasingRTRepresenter
 
-    yaml.dump(output, output_file)  # type: ignore
+def _preprocess(input_file: Path) -> Json:
+    input_ = expand_cixx_uses(input_file)
 
+    input_ = remove_x_properties(input_)
+    input_ = flatten_nested_steps_and_expand_implicit_run(input_)
 
-def _process(input_: Json) -> gh.Workflow:
+    input_ = replace_jobs_references(input_)
+    input_ = expand_for_each(input_, find_root(input_file.parent))
+    input_ = expand_matrices(input_)
+    # The substituted values are unchecked, the later stages rely on their types
+    if problems := validate(input_, str(input_file), expanded=True):
+        raise InvalidWorkflowError(problems)
+    input_ = expand_shards(input_)
+    input_ = expand_submodules(input_, find_root(input_file.parent))
+    input_ = fold_conditions(input_)
+
+    return input_
+
+
+# A newer run of the same ref cancels the older one, jobs it already committed
+# are cache hits for the newer run. Each run of the default branch has a group of
+# its own so none of them are cancelled or left pending.
+_DEFAULT_CONCURRENCY = {
+    "group": "${{ github.workflow }}-${{ github.ref == format('refs/heads/{0}',"
+    " github.event.repository.default_branch) && github.run_id || github.ref }}",
+    "cancel-in-progress": True,
+}
+
+
+def _process(
+    input_: Json,
+    durations: Mapping[str, float] | None = None,
+    telemetry: bool = False,
+    helpers: Helpers | None = None,
+) -> gh.Workflow:
     input_ = to_json_object(input_, "top level")
 
     on = to_json_object(input_["on"], "on")  # pylint: disable=invalid-name
@@ -98,48 +462,238 @@ def _process(input_: Json) -> gh.Workflow:
             psuedo_jobs[job_key] = job
 
     on_out = on
-
+    if any(job.cache_failures for job in normal_job_details.values()):
+        # Lets a run go ahead with jobs that failed with the same key before
+        dispatch = to_json_object(
+            on.get("workflow_dispatch") or {}, "on.workflow_dispatch"
+        )
+        on_out = {
+            **on,
+            "workflow_dispatch": {
+                **dispatch,
+                "inputs": {
+                    **to_json_object(
+                        dispatch.get("inputs", {}), "on.workflow_dispatch.inputs"
+                    ),
+                    FORCE_RERUN_INPUT: {
+                        "description": "Run jobs whose failure is cached",
+                        "type": "boolean",
+                        "default": False,
+                    },
+                },
+            },
+        }
+
+    schedule_ = None
+    if durations is not None:
+        schedule_ = schedule(normal_job_details, durations)
+        print(
+            f"Expected wall time: {schedule_.wall_time:.0f}s, critical path: "
+            + " -> ".join(schedule_.critical_path),
+            file=sys.stderr,
+        )
+        for job_name, job in normal_jobs.items():
+            if "critical-runs-on" in job and schedule_.is_critical(job_name):
+                normal_jobs[job_name] = {
+                    **job,
+                    "runs-on": cast(str, job["critical-runs-on"]),
+                }
+
+    coalesced = _coalesce(normal_jobs, normal_job_details, schedule_)
+    github_jobs = {
+        job_name: github_job
+        for github_job, job_names in coalesced.items()
+        for job_name in job_names
+    }
     jobs_out = {
-        INIT_JOB_ID: init_job.create(targets, normal_job_details, psuedo_jobs),
+        INIT_JOB_ID: init_job.create(
+            targets, normal_job_details, psuedo_jobs, telemetry
+        ),
         **{
-            job_name: normal_job.create(job_name, job, normal_job_details)
-            for job_name, job in normal_jobs.items()
+            github_job: normal_job.create(
+                job_names,
+                normal_jobs,
+                normal_job_details,
+                github_jobs,
+                telemetry,
+                helpers,
+                cast(dict[str, str] | None, input_.get("cache-backend")),
+            )
+            for github_job, job_names in coalesced.items()
         },
     }
 
-    return {
-        "on": on_out,
-        "jobs": jobs_out,
-    }
+    workflow: gh.Workflow = {"on": on_out, "jobs": jobs_out}
+    # Written as null to not cancel anything
+    concurrency = input_.get("concurrency", _DEFAULT_CONCURRENCY)
+    if concurrency is not None:
+        workflow = {"on": on_out, "concurrency": concurrency, "jobs": jobs_out}
+    return workflow
+
+
+def _coalesce(
+    jobs: Mapping[str, dict[str, Json]],
+    job_details: Mapping[str, JobDetails],
+    schedule_: Schedule | None = None,
+) -> dict[str, list[str]]:
+    """Return the jobs to run in each GitHub job
+
+    Jobs that opt in with coalesce are run in one GitHub job, to save the
+    overhead of each job, if they have the same runs-on and needs. Jobs on the
+    critical path are left on their own runner because running them one after
+    another would delay the whole workflow.
+    """
+    groups = dict[str, list[str]]()
+    group_ids = dict[str, str]()
+
+    for name, job in jobs.items():
+        details = job_details[name]
+        if (
+            not details.coalesce
+            or details.shard is not None
+            or (schedule_ is not None and schedule_.is_critical(name))
+        ):
+            groups[name] = [name]
+            continue
+
+        compatibility = json.dumps([job["runs-on"], sorted(details.needs)])
+        if compatibility in group_ids:
+            groups[group_ids[compatibility]].append(name)
+        else:
+            group_ids[compatibility] = name
+            groups[name] = [name]
+
+    github_jobs = dict[str, list[str]]()
+    for name, group in groups.items():
+        if len(group) > 1:
+            github_job = f"{name}-coalesced"
+            while github_job in jobs:
+                github_job += "-"
+            github_jobs[github_job] = group
+        else:
+            github_jobs[name] = group
+    return github_jobs
 
 
 def _process_job(key: str, job: dict[str, Json]) -> JobDetails:
-    paths = to_json_array_of_strings(job.get("paths", ["./"]), f"jobs.{key}.paths")
-
-    output_paths_raw = to_json_array_of_strings(
-        job.get("output-paths", []), f"jobs.{key}.output-paths"
-    )
-    output_paths = [*output_paths_raw, outputs_file(key)]
-
-    extra_key = job.get("extra-key", "")
-    if not isinstance(extra_key, str):
-        raise TypeError(f"jobs.{key}.extra-key")
-
-    force = job.get("force", False)
-    if not isinstance(force, bool):
-        raise TypeError(f"jobs.{key}.force")
-
-    needs = to_json_array_of_strings(job.get("needs", []), f"jobs.{key}.needs")
+    """Returns the details of a job of a preprocessed workflow
+
+    Its values were checked against the schema once expanded, so only the ones
+    added after that, shard, submodules and a folded if, are checked here.
+    """
+    paths = cast(list[str], job.get("paths", ["./"]))
+
+    shard = None
+    if "shard" in job:
+        shard_raw = to_json_object(job["shard"], f"jobs.{key}.shard")
+        index, count = shard_raw["index"], shard_raw["count"]
+        if not isinstance(index, int) or not isinstance(count, int):
+            raise TypeError(f"jobs.{key}.shard")
+        if "shard-paths" in job:
+            # Only these are split between the shards, paths are common to all
+            shard_paths = cast(list[str], job["shard-paths"])
+            paths = [*paths, *shard_paths]
+        else:
+            shard_paths = paths
+        shard = ShardDetails(index=index, count=count, paths=shard_paths)
+
+    cached_steps = dict[int, CachedStepDetails]()
+    for i, step in enumerate(cast(list[dict[str, Json]], job["steps"])):
+        if "output-paths" not in step:
+            if "paths" in step:
+                raise ValueError(f"jobs.{key}.steps[{i}] has paths but no output-paths")
+            continue
+        cached_steps[i] = CachedStepDetails(
+            paths=cast(list[str], step.get("paths", [])),
+            output_paths=cast(list[str], step["output-paths"]),
+        )
+        # The job must also rerun if they change, and clone them
+        paths = [
+            *paths,
+            *(path for path in cached_steps[i].paths if path not in paths),
+        ]
+
+    output_paths_raw = job.get("output-paths", [])
+    output_groups = dict[str, list[str]]()
+    if is_json_object(output_paths_raw):
+        # Each named group is its own cache entry so it can be restored on its own
+        output_groups = cast(dict[str, list[str]], output_paths_raw)
+        output_paths = [outputs_file(key)]
+    else:
+        output_paths = [*cast(list[str], output_paths_raw), outputs_file(key)]
 
-    outputs = job.get("outputs")
+    incremental_paths = cast(list[str], job.get("incremental-paths", []))
+    all_output_paths = {
+        path
+        for group_paths in [output_paths, *output_groups.values()]
+        for path in group_paths
+    }
+    if overlap := set(incremental_paths) & all_output_paths:
+        raise ValueError(
+            f"jobs.{key}.incremental-paths overlaps output-paths: {sorted(overlap)}"
+        )
+
+    needs = list[str]()
+    need_paths = dict[str, list[str]]()
+    for need in cast(list[Json], job.get("needs", [])):
+        if is_json_object(need):
+            need_name = cast(str, need["job"])
+            if "paths" in need:
+                need_paths[need_name] = cast(list[str], need["paths"])
+        else:
+            need_name = cast(str, need)
+        if need_name not in needs:
+            needs.append(need_name)
+
+    condition = job.get("if")
+    if condition is not None:
+        condition = to_string(condition, f"jobs.{key}.if")
+
+    submodules = dict[str, str]()
+    for i, submodule in enumerate(
+        to_json_array(job.get("submodules", []), f"jobs.{key}.submodules")
+    ):
+        submodule = to_json_object(submodule, f"jobs.{key}.submodules[{i}]")
+        submodules[
+            to_string(submodule["name"], f"jobs.{key}.submodules[{i}].name")
+        ] = to_string(submodule["path"], f"jobs.{key}.submodules[{i}].path")
+
+    cache_failures = cast(bool, job.get("cache-failures", False))
+    failure_log = cast(bool, job.get("failure-log", False))
+    if failure_log and not cache_failures:
+        raise ValueError(f"jobs.{key}.failure-log needs cache-failures")
+
+    caches = list[CacheDetails]()
+    for cache in cast(list[dict[str, Json]], job.get("cache", [])):
+        cache_details = CacheDetails(
+            paths=cast(list[str], cache["paths"]),
+            key_files=cast(list[str], cache.get("key-files", [])),
+        )
+        if cache_details not in caches:
+            caches.append(cache_details)
 
     return JobDetails(
         paths=paths,
         output_paths=output_paths,
-        extra_key=extra_key,
+        extra_key=cast(str, job.get("extra-key", "")),
         needs=needs,
-        force=force,
-        outputs=outputs,
+        force=cast(bool, job.get("force", False)),
+        outputs=job.get("outputs"),
+        incremental_paths=incremental_paths,
+        caches=caches,
+        output_groups=output_groups,
+        need_paths=need_paths,
+        matrix=cast(dict[str, Json] | None, job.get("matrix")),
+        shard=shard,
+        coalesce=cast(bool, job.get("coalesce", False)),
+        condition=condition,
+        cached_steps=cached_steps,
+        restore_concurrency=cast(int | None, job.get("restore-concurrency")),
+        lfs=cast(bool, job.get("lfs", False)),
+        submodules=submodules,
+        sparse_checkout=cast(str, job.get("sparse-checkout", "cone")),
+        cache_failures=cache_failures,
+        failure_log=failure_log,
     )
 
 
@@ -0,0 +1,306 @@
+"""Restores and saves cache entries from a directory or an HTTP server
+
+Only uses the standard library of Python 3.8 because the generated workflow
+embeds this module in steps, where `main` is called with the mode. Entries are
+tar files of paths relative to the workspace, or to the home directory for
+names starting with `~/`.
+
+The backend is chosen by the environment:
+    CIXX_CACHE_DIR: A directory of `<quoted key>.tar` files, e.g. on a disk
+        shared by self-hosted runners
+    CIXX_CACHE_URL: The base URL of an HTTP server, entries are read with GET and
+        written with PUT to `<url>/<quoted key>.tar`
+    CIXX_CACHE_TOKEN: Optional bearer token for the HTTP server
+"""
+
+from __future__ import annotations
+
+import glob
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+SUFFIX = ".tar"
+
+# Archive names of paths in the home directory start with this
+HOME_PREFIX = "~/"
+
+
+def entry_name(key: str) -> str:
+    """Returns the file name of the entry for a key"""
+    return quote(key, safe="") + SUFFIX
+
+
+def expand(pattern: str, workspace: Path, home: Path) -> List[Path]:
+    """Returns the paths matching a pattern relative to the workspace or `~/`"""
+    pattern = pattern.strip()
+    if not pattern:
+        return []
+    if pattern == "~" or pattern.startswith(HOME_PREFIX):
+        full_pattern = str(home / pattern[1:].lstrip("/"))
+    else:
+        full_pattern = str(workspace / pattern)
+    return [Path(path) for path in sorted(glob.glob(full_pattern, recursive=True))]
+
+
+def archive(paths: List[str], workspace: Path, home: Path, file: IO[bytes]):
+    """Write a tar of the paths, which may be glob patterns, to the file
+
+    Raises:
+        ValueError: if a path is outside the workspace and home directory
+    """
+    with tarfile.open(fileobj=file, mode="w") as tar:
+        for pattern in paths:
+            for path in expand(pattern, workspace, home):
+                tar.add(str(path), arcname=to_archive_name(path, workspace, home))
+
+
+def extract(file: IO[bytes], workspace: Path, home: Path, key: str):
+    """Extract a tar written by `archive` into the workspace and home directory
+
+    Links are checked like the data filter of tarfile, which Python 3.8 lacks.
+
+    Raises:
+        ValueError: if the entry has a path outside those directories, or a link
+            to one
+    """
+    with tarfile.open(fileobj=file) as tar:
+        for member in tar.getmembers():
+            archive_name = member.name
+            root, name = from_archive_name(archive_name, workspace, home, key)
+            member.name = name
+            # Symlinks extracted before could lead outside
+            if not _is_inside(root, os.path.dirname(name)):
+                raise ValueError(f"Unsafe path {archive_name} in {key}")
+            if member.islnk():
+                # Hard links name another member of the entry
+                link_root, member.linkname = from_archive_name(
+                    member.linkname, workspace, home, key
+                )
+                if link_root != root or not _is_inside(root, member.linkname):
+                    raise ValueError(f"Unsafe link {archive_name} in {key}")
+            elif member.issym() and not _is_inside(
+                root, os.path.join(os.path.dirname(name), member.linkname)
+            ):
+                raise ValueError(f"Unsafe link {archive_name} in {key}")
+            tar.extract(member, str(root))
+
+
+def _is_inside(root: Path, path: str) -> bool:
+    """Checks if the path relative to root resolves inside it, following symlinks"""
+    real_root = os.path.realpath(root)
+    real_path = os.path.realpath(os.path.join(real_root, path))
+    return os.path.commonpath([real_root, real_path]) == real_root
+
+
+def from_archive_name(
+    archive_name: str, workspace: Path, home: Path, key: str
+) -> Tuple[Path, str]:
+    """Returns the directory a path in an entry is relative to, and the path
+
+    Raises:
+        ValueError: if the path is outside that directory
+    """
+    if archive_name.startswith(HOME_PREFIX):
+        root, name = home, archive_name[len(HOME_PREFIX) :]
+    else:
+        root, name = workspace, archive_name
+    if Path(name).is_absolute() or ".." in Path(name).parts:
+        raise ValueError(f"Unsafe path {archive_name} in {key}")
+    return root, name
+
+
+def to_archive_name(path: Path, workspace: Path, home: Path) -> str:
+    """Returns the path in an entry, relative to the workspace or `~/`
+
+    Raises:
+        ValueError: if the path is outside those directories
+    """
+    path = path.absolute()
+    # The home directory may be inside the workspace so check it first
+    for root, prefix in ((home.absolute(), HOME_PREFIX), (workspace.absolute(), "")):
+        try:
+            return prefix + str(path.relative_to(root))
+        except ValueError:
+            pass
+    raise ValueError(f"Can't cache {path}, it's outside {workspace} and {home}")
+
+
+class DirectoryBackend:
+    """Entries in a directory, the layout of `ci++ run --cache-dir`"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+
+    def download(self, key: str, file: IO[bytes]) -> bool:
+        """Copy the entry into the file, returns whether it exists"""
+        try:
+            with open(self.directory / entry_name(key), "rb") as entry:
+                shutil.copyfileobj(entry, file)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def upload(self, key: str, file: IO[bytes]):
+        """Store the file under the key unless it already exists"""
+        path = self.directory / entry_name(key)
+        if path.exists():
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Write then rename so concurrent jobs never see a partial entry
+        with tempfile.NamedTemporaryFile(
+            dir=str(self.directory), suffix=".tmp", delete=False
+        ) as temporary:
+            shutil.copyfileobj(file, temporary)
+        os.replace(temporary.name, str(path))
+
+
+class HttpBackend:
+    """Entries on an HTTP server, missing ones respond with 404"""
+
+    def __init__(self, url: str, token: Optional[str] = None, timeout: float = 60):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def _request(self, key: str, method: str, data: Optional[IO[bytes]] = None):
+        request = urllib.request.Request(
+            f"{self.url}/{entry_name(key)}", data=data, method=method  # type: ignore
+        )
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        if data is not None:
+            request.add_header("Content-Length", str(os.fstat(data.fileno()).st_size))
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def download(self, key: str, file: IO[bytes]) -> bool:
+        """Copy the entry into the file, returns whether it exists"""
+        try:
+            with self._request(key, "GET") as response:
+                shutil.copyfileobj(response, file)
+        except urllib.error.HTTPError as error:
+            if error.code == 404:
+                return False
+            raise
+        return True
+
+    def upload(self, key: str, file: IO[bytes]):
+        """Store the file under the key"""
+        with self._request(key, "PUT", file):
+            pass
+
+
+def get_backend(env: Dict[str, str]):
+    """Returns the backend configured by the environment, or None"""
+    if env.get("CIXX_CACHE_DIR"):
+        return DirectoryBackend(Path(env["CIXX_CACHE_DIR"]))
+    if env.get("CIXX_CACHE_URL"):
+        return HttpBackend(env["CIXX_CACHE_URL"], env.get("CIXX_CACHE_TOKEN"))
+    return None
+
+
+def restore_all(
+    backend, entries: Dict[str, str], workspace: Path, home: Path, concurrency: int
+) -> Dict[str, Optional[str]]:
+    """Download entries in parallel and extract them
+
+    Args:
+        backend: Where the entries are
+        entries: The key of each entry by name
+        workspace: The directory relative paths are extracted to
+        home: The directory `~/` paths are extracted to
+        concurrency: The most entries to transfer at once
+
+    Returns:
+        By name, None if restored, otherwise why not. A missing entry isn't an
+        error, like actions/cache.
+    """
+    # Entries may share directories, which tarfile can't create concurrently
+    extract_lock = threading.Lock()
+
+    def restore(key: str) -> Optional[str]:
+        try:
+            with tempfile.TemporaryFile() as file:
+                if not backend.download(key, file):
+                    return "not found"
+                file.seek(0)
+                with extract_lock:
+                    extract(file, workspace, home, key)
+        except (OSError, ValueError, tarfile.TarError) as error:
+            return f"error: {error}"
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        results = pool.map(restore, entries.values())
+        return dict(zip(entries, results))
+
+
+def save_all(backend, entries: Dict[str, List[str]], workspace: Path, home: Path):
+    """Archive and upload the paths of each entry by key"""
+    for key, paths in entries.items():
+        with tempfile.TemporaryFile() as file:
+            archive(paths, workspace, home, file)
+            file.seek(0)
+            backend.upload(key, file)
+
+
+def main(mode: str) -> int:
+    """Run a step of the generated workflow
+
+    In restore mode `CIXX_RESTORE_ENTRIES` is a JSON object of the key of each
+    entry by name, and `CIXX_RESTORE_CONCURRENCY` the most to transfer at once.
+    The names of the restored entries are written to the `restored` output, the
+    others are left for the actions cache. In save mode `CIXX_SAVE_ENTRIES` is
+    a JSON array of objects with the key and paths of each entry.
+    """
+    backend = get_backend(dict(os.environ))
+    workspace = Path(os.environ.get("GITHUB_WORKSPACE", "."))
+    home = Path.home()
+
+    if mode == "save":
+        if backend is not None:
+            save_entries = json.loads(os.environ["CIXX_SAVE_ENTRIES"])
+            save_all(
+                backend,
+                {entry["key"]: entry["paths"] for entry in save_entries},
+                workspace,
+                home,
+            )
+        return 0
+
+    entries = json.loads(os.environ["CIXX_RESTORE_ENTRIES"])
+    if backend is None:
+        print("No CIXX_CACHE_DIR or CIXX_CACHE_URL, restoring one at a time")
+        results = dict.fromkeys(entries, "no backend")
+    else:
+        concurrency = int(os.environ.get("CIXX_RESTORE_CONCURRENCY", "4"))
+        results = restore_all(backend, entries, workspace, home, concurrency)
+
+    for name, result in results.items():
+        if result is None:
+            print(f"{name}: restored {entries[name]}")
+        elif result.startswith("error: "):
+            # Reported per entry, it's retried from the actions cache
+            print(f"::warning title=Restore {name}::{result[len('error: ') :]}")
+        else:
+            print(f"{name}: {result}")
+
+    restored = " ".join(name for name, result in results.items() if result is None)
+    with open(os.environ["GITHUB_OUTPUT"], "a") as output:
+        # Padded so a condition can check for " <name> "
+        output.write(f"restored= {restored} \n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1]))
@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO
+from urllib.parse import quote, unquote
+
+from ._cache_client import expand, from_archive_name, to_archive_name
+from ._validation import to_json_array, to_json_object, to_string
+
+VERSION = 1
+
+_MANIFEST_SUFFIX = ".json"
+_BLOB_SUFFIX = ".zst"
+
+
+@dataclass(slots=True)
+class TransferStats:
+    """Bytes of compressed blobs moved by a store"""
+
+    stored: int = 0
+    fetched: int = 0
+    # Files whose blob was already there
+    reused: int = 0
+
+
+class ContentAddressedStore:
+    """Cache entries as manifests of file hashes and a store of their contents
+
+    Each distinct file is compressed with zstd once and stored under its SHA-256,
+    so files that are the same in many entries, like unchanged wheels or
+    generated sources, take space once. The layout of the directory is:
+
+        manifests/<quoted key>.json
+        blobs/<first 2 hex digits>/<sha256>.zst
+
+    Restores copy the blobs they need into the local directory, if it's given,
+    and only those missing from it, like a runner with a disk kept between jobs.
+    """
+
+    def __init__(
+        self, directory: Path, local: Path | None = None, workers: int | None = None
+    ):
+        self.directory = directory
+        self.local = local
+        self.workers = workers or os.cpu_count() or 1
+        self.stats = TransferStats()
+        self._stats_lock = threading.Lock()
+
+    def manifest(self, key: str) -> Path:
+        """Returns the manifest file of the entry for the key"""
+        return self.directory / "manifests" / (quote(key, safe="") + _MANIFEST_SUFFIX)
+
+    def keys(self) -> set[str]:
+        """Returns the keys of all entries"""
+        manifests = self.directory / "manifests"
+        if not manifests.is_dir():
+            return set()
+        return {
+            unquote(path.name.removesuffix(_MANIFEST_SUFFIX))
+            for path in manifests.iterdir()
+            if path.name.endswith(_MANIFEST_SUFFIX)
+        }
+
+    def save(self, key: str, paths: list[str], workspace: Path, home: Path) -> bool:
+        """Store the paths under the key unless it already exists
+
+        Args:
+            key: The key of the entry
+            paths: Paths or glob patterns, relative to the workspace or `~/`
+            workspace: The directory relative paths are in
+            home: The directory `~` refers to
+
+        Returns:
+            Whether the entry was saved
+
+        Raises:
+            ValueError: if a path is outside the workspace and home directory
+        """
+        if self.manifest(key).exists():
+            return False
+
+        files = dict[str, Path]()
+        directories = list[str]()
+        symlinks = dict[str, str]()
+        for pattern in paths:
+            for path in expand(pattern, workspace, home):
+                for found in _walk(path):
+                    name = to_archive_name(found, workspace, home)
+                    if found.is_symlink():
+                        symlinks[name] = os.readlink(found)
+                    elif found.is_dir():
+                        directories.append(name)
+                    else:
+                        files[name] = found
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            entries = list(pool.map(self._store_file, files.values()))
+
+        manifest = {
+            "version": VERSION,
+            "directories": list(dict.fromkeys(directories)),
+            "symlinks": symlinks,
+            "files": {
+                name: {"sha256": sha256, "size": size, "mode": mode}
+                for name, (sha256, size, mode) in zip(files, entries)
+            },
+        }
+        _write_atomic(self.manifest(key), json.dumps(manifest).encode())
+        return True
+
+    def restore(self, key: str, workspace: Path, home: Path):
+        """Write the files of an entry into the workspace and home directory
+
+        Raises:
+            ValueError: if the entry has a path outside those directories
+        """
+        manifest = to_json_object(
+            json.loads(self.manifest(key).read_text()), self.manifest(key).name
+        )
+        if manifest.get("version") != VERSION:
+            raise ValueError(f"Unsupported manifest version in {key}")
+
+        for name in to_json_array(manifest["directories"], "directories"):
+            name = to_string(name, "directories")
+            root, path = from_archive_name(name, workspace, home, key)
+            (root / path).mkdir(parents=True, exist_ok=True)
+
+        files = list[tuple[Path, str, int]]()
+        for name, file in to_json_object(manifest["files"], "files").items():
+            root, path = from_archive_name(name, workspace, home, key)
+            file = to_json_object(file, f"files.{name}")
+            files.append(
+                (root / path, str(file["sha256"]), int(file["mode"]))  # type: ignore
+            )
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for _ in pool.map(lambda file: self._restore_file(*file), files):
+                pass
+
+        for name, target in to_json_object(manifest["symlinks"], "symlinks").items():
+            root, path = from_archive_name(name, workspace, home, key)
+            destination = root / path
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            if destination.is_symlink() or destination.exists():
+                destination.unlink()
+            destination.symlink_to(to_string(target, f"symlinks.{name}"))
+
+    def blob(self, sha256: str, directory: Path | None = None) -> Path:
+        """Returns the file of the compressed contents with the hash"""
+        return (
+            (directory or self.directory)
+            / "blobs"
+            / sha256[:2]
+            / (sha256 + _BLOB_SUFFIX)
+        )
+
+    def _store_file(self, path: Path) -> tuple[str, int, int]:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        stat = path.stat()
+
+        blob = self.blob(sha256)
+        if blob.exists():
+            self._count(reused=1)
+        else:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=blob.parent, suffix=".tmp", delete=False
+            ) as temporary:
+                _zstd(["-q", "-c", str(path)], stdout=temporary)
+            os.replace(temporary.name, blob)
+            self._count(stored=blob.stat().st_size)
+        return sha256, stat.st_size, stat.st_mode & 0o777
+
+    def _restore_file(self, destination: Path, sha256: str, mode: int):
+        blob = self.blob(sha256)
+        if self.local is not None:
+            local_blob = self.blob(sha256, self.local)
+            if local_blob.exists():
+                self._count(reused=1)
+            else:
+                local_blob.parent.mkdir(parents=True, exist_ok=True)
+                with tempfile.NamedTemporaryFile(
+                    dir=local_blob.parent, suffix=".tmp", delete=False
+                ) as temporary:
+                    with open(blob, "rb") as remote:
+                        shutil.copyfileobj(remote, temporary)
+                os.replace(temporary.name, local_blob)
+                self._count(fetched=local_blob.stat().st_size)
+            blob = local_blob
+        else:
+            self._count(fetched=blob.stat().st_size)
+
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        if destination.is_symlink():
+            destination.unlink()
+        with open(destination, "wb") as file:
+            _zstd(["-q", "-d", "-c", str(blob)], stdout=file)
+        destination.chmod(mode)
+
+    def _count(self, stored: int = 0, fetched: int = 0, reused: int = 0):
+        with self._stats_lock:
+            self.stats.stored += stored
+            self.stats.fetched += fetched
+            self.stats.reused += reused
+
+
+def _walk(path: Path) -> list[Path]:
+    """Returns the path and, if it's a directory, everything in it"""
+    if path.is_symlink() or not path.is_dir():
+        return [path]
+    found = [path]
+    for root, directories, files in os.walk(path):
+        for name in sorted([*directories, *files]):
+            found.append(Path(root) / name)
+        # Symlinks to directories are listed but not followed
+        directories.sort()
+    return found
+
+
+def _zstd(args: list[str], stdout: IO[bytes]):
+    # Each file is compressed on its own thread of the pool, so one thread each
+    subprocess.run(["zstd", "-T1", *args], stdout=stdout, check=True)
+
+
+def _write_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        dir=path.parent, suffix=".tmp", delete=False
+    ) as temporary:
+        temporary.write(data)
+    os.replace(temporary.name, path)
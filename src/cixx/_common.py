@@ -1,19 +1,87 @@
 from __future__ import annotations
 
+import hashlib
+import json
 from collections.abc import Mapping
 from dataclasses import dataclass
+from posixpath import normpath
+
+from . import _github_actions as gh
 from ._validation import Json
 
 INIT_JOB_ID = "cixx-init"
 
 ACTIONS_CACHE_VERSION = "204c5fc6f17f75fc56021276acb5aa4b6a051d8e"
 
+# The workflow_dispatch input to run jobs whose failure is cached
+FORCE_RERUN_INPUT = "cixx-force-rerun"
+
 
 def outputs_file(job_name: str) -> str:
     """Return the filename for the job outputs"""
     return f"__cixx_outputs_{job_name}.json"
 
 
+@dataclass(frozen=True, slots=True)
+class CacheDetails:
+    """Settings for a tool or dependency cache"""
+
+    paths: list[str]
+    key_files: list[str]
+
+
+def cache_id(cache: CacheDetails) -> str:
+    """Returns an ID that is the same for every job using an identical cache"""
+    digest = hashlib.sha1(json.dumps([cache.paths, cache.key_files]).encode())
+    return f"cache-{digest.hexdigest()[:12]}"
+
+
+@dataclass(frozen=True, slots=True)
+class Helpers:
+    """Steps run from a shared composite action instead of repeated in each job"""
+
+    # The directory of the action relative to the root, without ./
+    action: str
+    # The shell and run of each step by helper_id
+    steps: dict[str, gh.Step]
+
+
+def helper_id(step: gh.Step) -> str:
+    """Returns an ID that is the same for every step running an identical script"""
+    digest = hashlib.sha1(json.dumps([step.get("shell"), step["run"]]).encode())
+    return f"helper-{digest.hexdigest()[:12]}"
+
+
+@dataclass(frozen=True, slots=True)
+class ShardDetails:
+    """Which part of a sharded job this is"""
+
+    index: int
+    count: int
+    paths: list[str]
+
+
+@dataclass(frozen=True, slots=True)
+class CachedStepDetails:
+    """Settings for a step that is skipped if its own inputs are unchanged"""
+
+    paths: list[str]
+    output_paths: list[str]
+
+
+# Filters `git ls-tree` lines to those whose path hashes to the shard, so the
+# init job and the shard itself agree on which files belong to it
+SHARD_FILTER = r"""LC_ALL=C awk -F '\t' -v shard="$1" -v count="$2" '
+    BEGIN { for (i = 0; i < 256; i++) ord[sprintf("%c", i)] = i }
+    {
+        hash = 0
+        for (i = 1; i <= length($2); i++) {
+            hash = (hash * 31 + ord[substr($2, i, 1)]) % 4294967296
+        }
+        if (hash % count == shard) print
+    }'"""
+
+
 @dataclass(frozen=True, slots=True)
 class JobDetails:
     """Settings for a job"""
@@ -24,6 +92,26 @@ class JobDetails:
     needs: list[str]
     force: bool
     outputs: Json
+    incremental_paths: list[str]
+    caches: list[CacheDetails]
+    output_groups: dict[str, list[str]]
+    need_paths: dict[str, list[str]]
+    matrix: dict[str, Json] | None
+    shard: ShardDetails | None
+    coalesce: bool
+    condition: str | None
+    # By index in steps
+    cached_steps: dict[int, CachedStepDetails]
+    # Restore the needs in one step, this many at once
+    restore_concurrency: int | None
+    lfs: bool
+    # The path of each submodule to check out by name
+    submodules: dict[str, str]
+    # cone or precise
+    sparse_checkout: str
+    cache_failures: bool
+    # Keep the end of the log of the bash steps in a cached failure
+    failure_log: bool
 
 
 def _get_upstream_inclusive(
@@ -44,16 +132,87 @@ def _get_upstream_inclusive(
     return upstream
 
 
+def get_caches(jobs: Mapping[str, JobDetails]) -> dict[str, CacheDetails]:
+    """Returns the tool and dependency caches of all jobs by ID"""
+    return {cache_id(cache): cache for job in jobs.values() for cache in job.caches}
+
+
 def is_implicitly_force(job_name: str, jobs: Mapping[str, JobDetails]) -> bool:
     """Returns whether this job will always run"""
     return any(job.force for job in _get_upstream_inclusive(job_name, jobs).values())
 
 
+def git_path(path: str) -> str:
+    """Returns the path as used in `<commit>:<path>` to name a git object"""
+    path = normpath(path)
+    # A bare "." is looked up as a file named "." rather than the root tree
+    return "./" if path == "." else path
+
+
+def key_strings(job: JobDetails) -> list[tuple[str, str]]:
+    """Returns the setting and string hashed into the job key after the needs"""
+    strings = list[tuple[str, str]]()
+    if job.extra_key:
+        strings.append(("extra-key", job.extra_key))
+    if job.matrix is not None:
+        # Each cell of a matrix has its own key
+        strings.append(("matrix", json.dumps(job.matrix, sort_keys=True)))
+    if job.shard is not None:
+        strings.append(("shard", f"shard {job.shard.index}/{job.shard.count}"))
+    if job.lfs:
+        # The files are the LFS objects instead of the pointers, which are hashed
+        strings.append(("lfs", "lfs"))
+    return strings
+
+
+def incremental_key_prefix(job_name: str) -> str:
+    """Returns the cache key prefix shared by all incremental states of a job"""
+    return f"cixx-incremental.{job_name}."
+
+
 def key_output(job_name: str) -> str:
     """Returns the output ID for the cache key"""
     return f"key-{job_name}"
 
 
+def step_key_name(job_name: str, index: int) -> str:
+    """Returns the name of the key of a job's cached step, counted from 0"""
+    return f"{job_name}-step-{index}"
+
+
+def step_key_output(job_name: str, index: int) -> str:
+    """Returns the output ID for the cache key of a job's cached step"""
+    return key_output(step_key_name(job_name, index))
+
+
+def cache_key_prefix(cache: CacheDetails) -> str:
+    """Returns the start of every key of a tool or dependency cache
+
+    A cache without key files gets a new key each run, which restores the newest
+    entry with this prefix.
+    """
+    return f"cixx-{cache_id(cache)}-" + ("" if cache.key_files else "rolling-")
+
+
+def cache_key_output(cache_id_: str) -> str:
+    """Returns the output ID for the key of a tool or dependency cache"""
+    return f"{cache_id_}-key"
+
+
+def outputs_output(job_name: str) -> str:
+    """Returns the GitHub job output ID for the outputs of a job that ran"""
+    return f"cixx-outputs-{job_name}"
+
+
 def needs_build_output(job_name: str) -> str:
     """Returns the output ID for the flag for needing a build"""
     return f"needs-build-{job_name}"
+
+
+def format_seconds(seconds: float) -> str:
+    """Returns a duration like `1h02m`, `3m04s` or `5s`"""
+    minutes, seconds = divmod(round(seconds), 60)
+    if minutes >= 60:
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}h{minutes:02}m"
+    return f"{minutes}m{seconds:02}s" if minutes else f"{seconds}s"
@@ -1,6 +1,10 @@
+from __future__ import annotations
+
 import json
+import math
 import re
-from collections.abc import Collection, Iterator
+from collections.abc import Collection, Iterator, Mapping
+from dataclasses import dataclass
 from typing import Callable, TypeVar
 
 from ._validation import Json
@@ -10,7 +14,7 @@ def to_expression(obj: Json) -> str:
     """Return the conversion of a object containing template strings to an expression"""
     match obj:
         case str():
-            return _template_str_to_expression(obj)
+            return fold_expression(_template_str_to_expression(obj))
         case float() | int() | bool() | None:
             return json.dumps(obj)
         case dict() | list():
@@ -19,7 +23,7 @@ def to_expression(obj: Json) -> str:
             json_expression = _format_split_template(
                 list(_split_template(json_template))
             )
-            return f"""fromJSON({json_expression})"""
+            return fold_expression(f"""fromJSON({json_expression})""")
 
 
 def to_json_template(obj: Json) -> str:
@@ -39,9 +43,12 @@ def to_json_template(obj: Json) -> str:
 def get_full_expression_or_none(obj: str) -> str | None:
     """Return the expression if this string is a full expresssion or None"""
     if obj.startswith("${{"):
-        if not obj.endswith("}}"):
-            raise ValueError(f"Expected '}}' at end in: {obj}")
-        return obj[3:-2].strip()
+        match list(_split_template(obj)):
+            case [("", False), (expression, True), ("", False)]:
+                return expression.strip()
+            case _:
+                # Something after the first expression, e.g. "${{ a }}/b"
+                return None
     return None
 
 
@@ -58,6 +65,12 @@ def _template_str_to_expression(obj: str) -> str:
 def _template_str_to_json(obj: str) -> str:
     """Return the JSON conversion of a template string"""
     expression = _template_str_to_expression(obj)
+    try:
+        folded = _fold(parse_expression(expression), boolean=False)
+    except ValueError:
+        folded = None  # Left for GitHub to report
+    if isinstance(folded, _Literal):
+        return json.dumps(folded.value)
     return f"${{{{toJson({expression})}}}}"
 
 
@@ -136,6 +149,105 @@ def replace_identifiers(
     )
 
 
+def substitute_context(obj: _TJson, name: str, value: Json) -> _TJson:
+    """Replace references to a context with its value
+
+    Full expressions are replaced by the value itself so they keep their type,
+    references inside other expressions are replaced by an equivalent expression.
+
+    Args:
+        obj: The object to make replacements in
+        name: The name of the context, e.g. inputs
+        value: The value of the context
+
+    Returns:
+        The object with the context substituted
+    """
+    full_replaced = _replace_strings(
+        obj,
+        lambda s: _replace_full_expression(
+            s, get_full_expression_replacements(name, value)
+        ),
+    )
+    replaced = replace_identifiers(
+        full_replaced, get_expression_replacements(name, value)
+    )
+    return _replace_strings(replaced, _inline_string_literals)  # type: ignore
+
+
+_STRING_LITERAL = re.compile(r"\s*'((?:[^']|'')*)'\s*")
+
+
+def _inline_string_literals(template_str: str) -> str:
+    """Replace expressions that are only a string literal with the string
+
+    So substituted values can be used in places that aren't evaluated, e.g. paths.
+    """
+    if "${{" not in template_str:
+        return template_str
+
+    parts = list[str]()
+    for part, is_expression in _split_template(template_str):
+        if is_expression:
+            match = _STRING_LITERAL.fullmatch(part)
+            if match and "${{" not in match.group(1):
+                part = match.group(1).replace("''", "'")
+            else:
+                part = f"${{{{{part}}}}}"
+        parts.append(part)
+    return "".join(parts)
+
+
+_TJson1 = TypeVar("_TJson1", bound=Json)
+_TJson2 = TypeVar("_TJson2", bound=Json)
+
+
+def _get_replacements(
+    name: str, obj: Json, replacer: Callable[[_TJson2], _TJson1]
+) -> list[tuple[str, _TJson1]]:
+    """Return the replacements with as much as can be expanded first"""
+    replacements = list[tuple[str, _TJson1]]()
+    match obj:
+        case str():
+            pass
+        case float() | int() | bool() | None:
+            pass
+        case list():
+            replacements.extend(
+                (
+                    replacement
+                    for i, value in enumerate(obj)
+                    for replacement in _get_replacements(
+                        f"{name}[{i}]", value, replacer
+                    )
+                )
+            )
+        case dict():
+            replacements.extend(
+                (
+                    replacement
+                    for key, value in obj.items()
+                    for replacement in _get_replacements(
+                        f"{name}.{key}", value, replacer
+                    )
+                )
+            )
+
+    replacement = replacer(obj)
+    replacements.append((name, replacement))
+    return replacements
+
+
+def get_expression_replacements(name: str, obj: Json) -> list[tuple[str, str]]:
+    """Return replacements of references to a value with equivalent expressions"""
+    return _get_replacements(name, obj, to_expression)
+
+
+def get_full_expression_replacements(name: str, obj: Json) -> list[tuple[str, Json]]:
+    """Return replacements of full expressions referencing a value with the value"""
+    return _get_replacements(name, obj, lambda x: x)
+
+
 def _split_template(obj: str) -> Iterator[tuple[str, bool]]:
     start = 0
     in_expression = False
@@ -233,7 +345,7 @@ def replace_identiers_in_template_str(
 
 
 def _replace_identier(expression: str, old: str, new: str) -> tuple[str, bool]:
-    pattern = rf"('([^']*|'')*'(?!'))|(?<![\w\-\.]){re.escape(old)}"
+    pattern = rf"('([^']*|'')*'(?!'))|(?<![\w\-\.]){re.escape(old)}(?![\w\-])"
 
     replacement_was_made = False
 
@@ -248,3 +360,654 @@ def _replace_identier(expression: str, old: str, new: str) -> tuple[str, bool]:
 
     replaced = re.sub(pattern, repl, expression)
     return replaced, replacement_was_made
+
+
+@dataclass(frozen=True, slots=True)
+class _Literal:
+    value: Json
+
+
+@dataclass(frozen=True, slots=True)
+class _Identifier:
+    name: str
+
+
+@dataclass(frozen=True, slots=True)
+class _Property:
+    obj: Expression
+    name: str
+
+
+@dataclass(frozen=True, slots=True)
+class _Index:
+    obj: Expression
+    index: Expression
+
+
+@dataclass(frozen=True, slots=True)
+class _Filter:
+    """`obj.*`, the elements of an array or the values of an object"""
+
+    obj: Expression
+
+
+@dataclass(frozen=True, slots=True)
+class _Not:
+    operand: Expression
+
+
+@dataclass(frozen=True, slots=True)
+class _Binary:
+    operator: str
+    left: Expression
+    right: Expression
+
+
+@dataclass(frozen=True, slots=True)
+class _Call:
+    function: str
+    args: tuple[Expression, ...]
+
+
+Expression = (
+    _Literal | _Identifier | _Property | _Index | _Filter | _Not | _Binary | _Call
+)
+
+_TOKEN = re.compile(
+    r"""\s*(?:
+        (?P<string>'(?:[^']|'')*')
+        |(?P<number>0x[0-9a-fA-F]+|[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+        |(?P<name>[A-Za-z_][A-Za-z0-9_-]*)
+        |(?P<operator>==|!=|<=|>=|&&|\|\||[<>!().,\[\]*])
+    )""",
+    re.VERBOSE,
+)
+
+# Lowest precedence first
+_BINARY_OPERATORS = [["||"], ["&&"], ["==", "!="], ["<", "<=", ">", ">="]]
+
+
+def parse_expression(expression: str) -> Expression:
+    """Parse the inside of a `${{ }}` expression
+
+    Raises:
+        ValueError: if the expression isn't valid
+    """
+    tokens = list[tuple[str, str]]()
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if match is None or match.lastgroup is None:
+            raise ValueError(f"Invalid expression at {position}: {expression}")
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        position = match.end()
+
+    parser = _Parser(tokens, expression)
+    result = parser.parse_binary(0)
+    if parser.position != len(tokens):
+        raise ValueError(f"Unexpected {parser.peek()} in: {expression}")
+    return result
+
+
+class _Parser:
+    def __init__(self, tokens: list[tuple[str, str]], expression: str):
+        self.tokens = tokens
+        self.expression = expression
+        self.position = 0
+
+    def peek(self) -> str | None:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][1]
+        return None
+
+    def take(self, expected: str | None = None) -> tuple[str, str]:
+        if self.position >= len(self.tokens):
+            raise ValueError(f"Unexpected end of expression: {self.expression}")
+        token = self.tokens[self.position]
+        if expected is not None and token[1] != expected:
+            raise ValueError(
+                f"Expected {expected} not {token[1]} in: {self.expression}"
+            )
+        self.position += 1
+        return token
+
+    def parse_binary(self, level: int) -> Expression:
+        if level == len(_BINARY_OPERATORS):
+            return self.parse_unary()
+        left = self.parse_binary(level + 1)
+        while self.peek() in _BINARY_OPERATORS[level]:
+            operator = self.take()[1]
+            left = _Binary(operator, left, self.parse_binary(level + 1))
+        return left
+
+    def parse_unary(self) -> Expression:
+        if self.peek() == "!":
+            self.take()
+            return _Not(self.parse_unary())
+        return self.parse_postfix(self.parse_primary())
+
+    def parse_primary(self) -> Expression:
+        kind, text = self.take()
+        match kind, text:
+            case "string", _:
+                return _Literal(text[1:-1].replace("''", "'"))
+            case "number", _:
+                return _Literal(_parse_number(text))
+            case "name", "null":
+                return _Literal(None)
+            case "name", "true" | "false":
+                return _Literal(text == "true")
+            case "name", _ if self.peek() == "(":
+                self.take("(")
+                args = list[Expression]()
+                while self.peek() != ")":
+                    if args:
+                        self.take(",")
+                    args.append(self.parse_binary(0))
+                self.take(")")
+                return _Call(text, tuple(args))
+            case "name", _:
+                return _Identifier(text)
+            case "operator", "(":
+                inner = self.parse_binary(0)
+                self.take(")")
+                return inner
+            case _:
+                raise ValueError(f"Unexpected {text} in: {self.expression}")
+
+    def parse_postfix(self, obj: Expression) -> Expression:
+        while self.peek() in (".", "["):
+            if self.take()[1] == ".":
+                kind, name = self.take()
+                if name == "*":
+                    obj = _Filter(obj)
+                    continue
+                if kind != "name":
+                    raise ValueError(
+                        f"Unsupported property {name} in: {self.expression}"
+                    )
+                obj = _Property(obj, name)
+            else:
+                obj = _Index(obj, self.parse_binary(0))
+                self.take("]")
+        return obj
+
+
+def _parse_number(text: str) -> int | float:
+    if text.lower().startswith("0x"):
+        return int(text, 16)
+    number = float(text)
+    return int(number) if number.is_integer() and "." not in text else number
+
+
+def evaluate(
+    expression: str | Expression,
+    contexts: Mapping[str, Json],
+    status: str = "success",
+) -> Json:
+    """Evaluate an expression like GitHub Actions
+
+    Args:
+        expression: The inside of a `${{ }}` expression or its parsed form
+        contexts: The value of each context, e.g. github, needs, steps
+        status: The result of the job so far, used by success() and similar
+
+    Returns:
+        The value of the expression
+
+    Raises:
+        ValueError: if the expression is invalid or uses unsupported functions
+    """
+    if isinstance(expression, str):
+        expression = parse_expression(expression)
+    return _evaluate(expression, contexts, status)
+
+
+def _evaluate(node: Expression, contexts: Mapping[str, Json], status: str) -> Json:
+    match node:
+        case _Literal(value):
+            return value
+        case _Identifier(name):
+            return _get_member(dict(contexts), name)
+        case _Property(obj, name):
+            return _get_filtered_member(obj, _evaluate(obj, contexts, status), name)
+        case _Index(obj, index):
+            return _get_filtered_member(
+                obj,
+                _evaluate(obj, contexts, status),
+                _evaluate(index, contexts, status),
+            )
+        case _Filter(obj):
+            value = _evaluate(obj, contexts, status)
+            if _is_filtered(obj):
+                return [element for item in _filter(value) for element in _filter(item)]
+            return _filter(value)
+        case _Not(operand):
+            return not is_truthy(_evaluate(operand, contexts, status))
+        case _Binary("&&", left, right):
+            value = _evaluate(left, contexts, status)
+            return _evaluate(right, contexts, status) if is_truthy(value) else value
+        case _Binary("||", left, right):
+            value = _evaluate(left, contexts, status)
+            return value if is_truthy(value) else _evaluate(right, contexts, status)
+        case _Binary(operator, left, right):
+            return _compare(
+                operator,
+                _evaluate(left, contexts, status),
+                _evaluate(right, contexts, status),
+            )
+        case _Call(function, args):
+            return _call(
+                function, [_evaluate(arg, contexts, status) for arg in args], status
+            )
+
+
+def _is_filtered(node: Expression) -> bool:
+    """Whether the value of node is the array of a filter, e.g. `a.*.b`"""
+    match node:
+        case _Filter():
+            return True
+        case _Property(obj, _) | _Index(obj, _):
+            return _is_filtered(obj)
+        case _:
+            return False
+
+
+def _filter(value: Json) -> list[Json]:
+    match value:
+        case list():
+            return value
+        case dict():
+            return list(value.values())
+        case _:
+            return []
+
+
+def _get_filtered_member(node: Expression, obj: Json, key: Json) -> Json:
+    """Get the member of each element if node is filtered, like GitHub Actions"""
+    if not _is_filtered(node):
+        return _get_member(obj, key)
+    return [
+        member
+        for element in _filter(obj)
+        if (member := _get_member(element, key)) is not None
+    ]
+
+
+def _get_member(obj: Json, key: Json) -> Json:
+    match obj, key:
+        case dict(), str():
+            if key in obj:
+                return obj[key]
+            # Contexts are case insensitive
+            for name, value in obj.items():
+                if name.lower() == key.lower():
+                    return value
+            return None
+        case list(), int() | float() if not isinstance(key, bool):
+            if key == int(key) and 0 <= key < len(obj):
+                return obj[int(key)]
+            return None
+        case _:
+            return None
+
+
+def is_truthy(value: Json) -> bool:
+    """Returns how a value converts to a boolean in an expression"""
+    match value:
+        case None | False | "":
+            return False
+        case int() | float():
+            return value != 0 and not math.isnan(value)
+        case _:
+            return True
+
+
+def _to_number(value: Json) -> float:
+    match value:
+        case None:
+            return 0.0
+        case bool():
+            return float(value)
+        case int() | float():
+            return float(value)
+        case str():
+            text = value.strip()
+            if not text:
+                return 0.0
+            try:
+                return float(_parse_number(text))
+            except ValueError:
+                return math.nan
+        case _:
+            return math.nan
+
+
+def _compare(operator: str, left: Json, right: Json) -> bool:
+    if isinstance(left, (dict, list)) or isinstance(right, (dict, list)):
+        # Objects and arrays are only equal to themselves
+        same = left is right
+        return {"==": same, "!=": not same}.get(operator, False)
+
+    # Strings compare case insensitively, anything else is coerced to a number
+    if isinstance(left, str) and isinstance(right, str):
+        left_value: str | float = left.lower()
+        right_value: str | float = right.lower()
+    else:
+        left_value, right_value = _to_number(left), _to_number(right)
+
+    match operator:
+        case "==":
+            return left_value == right_value
+        case "!=":
+            return left_value != right_value
+        case "<":
+            return left_value < right_value  # type: ignore
+        case "<=":
+            return left_value <= right_value  # type: ignore
+        case ">":
+            return left_value > right_value  # type: ignore
+        case ">=":
+            return left_value >= right_value  # type: ignore
+        case _:
+            raise ValueError(f"Unknown operator: {operator}")
+
+
+def format_value(value: Json) -> str:
+    """Returns the string a value becomes when interpolated into a string"""
+    match value:
+        case None:
+            return ""
+        case bool():
+            return "true" if value else "false"
+        case float() if value.is_integer():
+            return str(int(value))
+        case int() | float():
+            return str(value)
+        case str():
+            return value
+        case list():
+            return "Array"
+        case dict():
+            return "Object"
+
+
+def _call(function: str, args: list[Json], status: str) -> Json:
+    match function.lower(), args:
+        case "success", []:
+            return status == "success"
+        case "always", []:
+            return True
+        case "failure", []:
+            return status == "failure"
+        case "cancelled", []:
+            return status == "cancelled"
+        case "contains", [list() as search, item]:
+            return any(_compare("==", element, item) for element in search)
+        case "contains", [search, item]:
+            return format_value(item).lower() in format_value(search).lower()
+        case "startswith", [search, item]:
+            return format_value(search).lower().startswith(format_value(item).lower())
+        case "endswith", [search, item]:
+            return format_value(search).lower().endswith(format_value(item).lower())
+        case "format", [str() as template, *values]:
+            return _format(template, [format_value(value) for value in values])
+        case "join", [list() as values, *separator] if len(separator) <= 1:
+            return format_value(separator[0] if separator else ",").join(
+                format_value(value) for value in values
+            )
+        case "join", [value, *separator] if len(separator) <= 1:
+            return format_value(value)
+        case "tojson", [value]:
+            return json.dumps(value, indent=2)
+        case "fromjson", [str() as value]:
+            return json.loads(value)
+        case _:
+            raise ValueError(f"Unsupported function {function} with {len(args)} args")
+
+
+def _format(template: str, values: list[str]) -> str:
+    def repl(match: re.Match[str]) -> str:
+        if match.group(1) is not None:
+            index = int(match.group(1))
+            if index >= len(values):
+                raise ValueError(f"format has no argument {index}: {template}")
+            return values[index]
+        return match.group(0)[0]
+
+    return re.sub(r"\{(\d+)\}|\{\{|\}\}", repl, template)
+
+
+def evaluate_template(
+    obj: _TJson, contexts: Mapping[str, Json], status: str = "success"
+) -> Json:
+    """Evaluate the expressions in all template strings in an object
+
+    A string that is a full expression becomes its value, otherwise each
+    expression is interpolated as a string.
+    """
+
+    def replacer(template_str: str) -> Json:
+        if "${{" not in template_str:
+            return template_str
+        if (full_expression := get_full_expression_or_none(template_str)) is not None:
+            return evaluate(full_expression, contexts, status)
+        return "".join(
+            format_value(evaluate(part, contexts, status)) if is_expression else part
+            for part, is_expression in _split_template(template_str)
+        )
+
+    return _replace_strings(obj, replacer)
+
+
+# Functions whose result only depends on their arguments
+_CONSTANT_FUNCTIONS = {
+    "contains",
+    "startswith",
+    "endswith",
+    "format",
+    "join",
+    "tojson",
+    "fromjson",
+}
+
+_STATUS_FUNCTIONS = {"success", "always", "failure", "cancelled"}
+
+
+def fold_expression(expression: str) -> str:
+    """Return the expression with constant subexpressions evaluated
+
+    The expression is returned unchanged if nothing can be folded.
+    """
+    try:
+        node = parse_expression(expression)
+    except ValueError:
+        return expression  # Left for GitHub to report
+    folded = _fold(node, boolean=False)
+    if folded == node:
+        return expression
+    return _to_source(folded)
+
+
+def fold_condition(condition: Json) -> bool | str:
+    """Return whether an if condition is statically true or false
+
+    Args:
+        condition: The if condition, with or without `${{ }}`
+
+    Returns:
+        The truth of the condition, or the folded expression if it isn't known
+        until the workflow runs
+    """
+    if not isinstance(condition, str):
+        return is_truthy(condition)
+    expression = get_full_expression_or_none(condition) or condition
+    try:
+        node = parse_expression(expression)
+    except ValueError:
+        return expression  # Left for GitHub to report
+    folded = _fold(node, boolean=True)
+
+    if _has_status_function(node) and not _has_status_function(folded):
+        # The result doesn't depend on the status so it must not be implied
+        if isinstance(folded, _Literal):
+            return "always()" if is_truthy(folded.value) else False
+        return f"always() && ({_to_source(folded)})"
+    if isinstance(folded, _Literal):
+        return is_truthy(folded.value)
+    if folded == node:
+        return expression
+    return _to_source(folded)
+
+
+def _fold(node: Expression, boolean: bool) -> Expression:
+    """Fold constant subexpressions
+
+    Args:
+        node: The expression
+        boolean: If only the truth of the result matters, like in an if
+    """
+    match node:
+        case _Literal() | _Identifier():
+            return node
+        case _Property(obj, name):
+            obj = _fold(obj, boolean=False)
+            if isinstance(obj, _Literal):
+                return _Literal(_get_member(obj.value, name))
+            return _Property(obj, name)
+        case _Index(obj, index):
+            obj, index = _fold(obj, boolean=False), _fold(index, boolean=False)
+            if isinstance(obj, _Literal) and isinstance(index, _Literal):
+                return _Literal(_get_member(obj.value, index.value))
+            return _Index(obj, index)
+        case _Filter(obj):
+            # Not folded to a literal, it would lose that members are per element
+            return _Filter(_fold(obj, boolean=False))
+        case _Not(operand):
+            operand = _fold(operand, boolean=True)
+            if isinstance(operand, _Literal):
+                return _Literal(not is_truthy(operand.value))
+            return _Not(operand)
+        case _Binary("&&" | "||" as operator, left, right):
+            left = _fold(left, boolean)
+            short_circuits = operator == "||"
+            if isinstance(left, _Literal):
+                if is_truthy(left.value) == short_circuits:
+                    return left
+                return _fold(right, boolean)
+            right = _fold(right, boolean)
+            if boolean and isinstance(right, _Literal):
+                if is_truthy(right.value) == short_circuits:
+                    return _Literal(short_circuits)
+                return left
+            return _Binary(operator, left, right)
+        case _Binary(operator, left, right):
+            left, right = _fold(left, boolean=False), _fold(right, boolean=False)
+            if isinstance(left, _Literal) and isinstance(right, _Literal):
+                return _Literal(_compare(operator, left.value, right.value))
+            return _Binary(operator, left, right)
+        case _Call(function, args):
+            args = tuple(_fold(arg, boolean=False) for arg in args)
+            if function.lower() in _CONSTANT_FUNCTIONS and all(
+                isinstance(arg, _Literal) for arg in args
+            ):
+                try:
+                    return _Literal(_evaluate(_Call(function, args), {}, "success"))
+                except ValueError:
+                    pass  # Left for GitHub to report
+            if function.lower() == "format" and args:
+                return _fold_format(function, args)
+            return _Call(function, args)
+
+
+def _fold_format(function: str, args: tuple[Expression, ...]) -> Expression:
+    """Move literal arguments of format into the format string"""
+    template, *values = args
+    if not isinstance(template, _Literal) or not isinstance(template.value, str):
+        return _Call(function, args)
+
+    kept = list[Expression]()
+    new_indexes = dict[int, int]()
+
+    def repl(match: re.Match[str]) -> str:
+        if match.group(1) is None:
+            return match.group(0)
+        index = int(match.group(1))
+        if index >= len(values):
+            return match.group(0)  # Left for GitHub to report
+        value = values[index]
+        if isinstance(value, _Literal):
+            return format_value(value.value).replace("{", "{{").replace("}", "}}")
+        if index not in new_indexes:
+            new_indexes[index] = len(kept)
+            kept.append(value)
+        return f"{{{new_indexes[index]}}}"
+
+    new_template = re.sub(r"\{(\d+)\}|\{\{|\}\}", repl, template.value)
+    if len(kept) == len(values):
+        return _Call(function, args)
+    return _Call(function, (_Literal(new_template), *kept))
+
+
+def _has_status_function(node: Expression) -> bool:
+    match node:
+        case _Literal() | _Identifier():
+            return False
+        case _Property(obj, _):
+            return _has_status_function(obj)
+        case _Index(obj, index):
+            return _has_status_function(obj) or _has_status_function(index)
+        case _Filter(obj):
+            return _has_status_function(obj)
+        case _Not(operand):
+            return _has_status_function(operand)
+        case _Binary(_, left, right):
+            return _has_status_function(left) or _has_status_function(right)
+        case _Call(function, args):
+            return function.lower() in _STATUS_FUNCTIONS or any(
+                _has_status_function(arg) for arg in args
+            )
+
+
+_PRECEDENCE = {
+    operator: i
+    for i, operators in enumerate(_BINARY_OPERATORS)
+    for operator in operators
+}
+_UNARY_PRECEDENCE = len(_BINARY_OPERATORS)
+
+
+def _to_source(node: Expression, precedence: int = 0) -> str:
+    """Return the expression text for a parsed expression"""
+    match node:
+        case _Literal(str() as value):
+            escaped = value.replace("'", "''")
+            return f"'{escaped}'"
+        case _Literal(dict() | list() as value):
+            # There is no array or object literal
+            escaped = json.dumps(value, separators=(",", ":")).replace("'", "''")
+            return f"fromJSON('{escaped}')"
+        case _Literal(float() as value) if value.is_integer():
+            return str(int(value))
+        case _Literal(value):
+            return json.dumps(value)
+        case _Identifier(name):
+            return name
+        case _Property(obj, name):
+            return f"{_to_source(obj, _UNARY_PRECEDENCE + 1)}.{name}"
+        case _Index(obj, index):
+            return f"{_to_source(obj, _UNARY_PRECEDENCE + 1)}[{_to_source(index)}]"
+        case _Filter(obj):
+            return f"{_to_source(obj, _UNARY_PRECEDENCE + 1)}.*"
+        case _Not(operand):
+            source = f"!{_to_source(operand, _UNARY_PRECEDENCE)}"
+            return f"({source})" if precedence > _UNARY_PRECEDENCE else source
+        case _Binary(operator, left, right):
+            level = _PRECEDENCE[operator]
+            source = (
+                f"{_to_source(left, level)} {operator} {_to_source(right, level + 1)}"
+            )
+            return f"({source})" if precedence > level else source
+        case _Call(function, args):
+            return f"{function}({', '.join(_to_source(arg) for arg in args)})"
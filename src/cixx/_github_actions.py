@@ -6,7 +6,11 @@ from ._validation import Json
 _Dict = dict[str, Json]
 
 
-class Workflow(TypedDict):
+class _WorkflowOptions(TypedDict, total=False):
+    concurrency: Json
+
+
+class Workflow(_WorkflowOptions):
     """Top level object"""
 
     on: _Dict
@@ -23,6 +27,9 @@ Step = TypedDict(
         "run": str,
         "uses": str,
         "with": dict[str, str],
+        "env": dict[str, str],
+        "working-directory": str,
+        "continue-on-error": bool | str,
     },
     total=False,
 )
@@ -30,11 +37,16 @@ Step = TypedDict(
 Job = TypedDict(
     "Job",
     {
+        "name": str,
         "if": str,
         "needs": list[str],
         "steps": list[Step],
         "runs-on": str | list[str],
         "outputs": dict[str, str],
+        "env": dict[str, str],
+        "uses": str,
+        "with": dict[str, str],
+        "secrets": str,
     },
     total=False,
 )
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import shlex
 from collections.abc import Mapping
 from posixpath import normpath
 from textwrap import dedent
@@ -7,27 +8,59 @@ from textwrap import dedent
 from . import _github_actions as gh
 from ._common import (
     ACTIONS_CACHE_VERSION,
+    INIT_JOB_ID,
+    SHARD_FILTER,
+    CacheDetails,
     JobDetails,
+    cache_key_output,
+    cache_key_prefix,
+    get_caches,
+    git_path,
     is_implicitly_force,
     key_output,
+    key_strings,
     needs_build_output,
+    step_key_name,
+    step_key_output,
 )
+from ._telemetry import START_MARK, get_mark_step, get_record_steps
+from ._validation import Json
 from ._yaml import multiline
 
 
 def create(
-    _targets: object, normal_jobs: Mapping[str, JobDetails], _psuedo_jobs: object
+    _targets: object,
+    normal_jobs: Mapping[str, JobDetails],
+    _psuedo_jobs: object,
+    telemetry: bool = False,
 ) -> gh.Job:
-    """Returns the initialization job."""
+    """Returns the initialization job.
+
+    With telemetry the job records the key and cache hit of each job.
+    """
+    caches = get_caches(normal_jobs)
+    steps = [
+        _get_git_fetch_step(),
+        _get_key_generator_step(normal_jobs, caches),
+        *_get_cache_check_steps(normal_jobs),
+    ]
+    if telemetry:
+        steps = [
+            get_mark_step(START_MARK),
+            *steps,
+            *get_record_steps(INIT_JOB_ID, {"checks": _get_checks_record(normal_jobs)}),
+        ]
     return {
         "runs-on": "ubuntu-20.04",
-        "steps": [
-            _get_git_fetch_step(),
-            _get_key_generator_step(normal_jobs),
-            *_get_cache_check_steps(normal_jobs),
-        ],
+        "steps": steps,
         "outputs": {
             **{key_output(name): _get_key_step_output(name) for name in normal_jobs},
+            **{
+                step_key_output(name, i): _get_key_step_output(step_key_name(name, i))
+                for name, job in normal_jobs.items()
+                for i in range(len(job.cached_steps))
+            },
+            **{cache_key_output(id_): _get_key_step_output(id_) for id_ in caches},
             **{
                 needs_build_output(name): _get_cache_check_step_output(name)
                 for name in normal_jobs
@@ -59,13 +92,16 @@ git -c protocol.version=2 fetch --filter=blob:none --depth=1 origin ${GITHUB_SHA
 _KEY_GENERATION_STEP_ID = "generate-keys"
 
 
-def _get_key_generator_step(jobs: Mapping[str, JobDetails]) -> gh.Step:
-    done = {}
+def _get_key_generator_step(
+    jobs: Mapping[str, JobDetails], caches: Mapping[str, CacheDetails]
+) -> gh.Step:
+    done = set[str]()
     scripts = ["declare -A keys"]
 
     def add_job(name: str):
         if name in done:
             return
+        done.add(name)
 
         job = jobs[name]
 
@@ -73,25 +109,62 @@ def _get_key_generator_step(jobs: Mapping[str, JobDetails]) -> gh.Step:
         for need in job.needs:
             add_job(need)
 
+        strings_quoted = ""
         if is_implicitly_force(name, jobs):
             suffix = "$RANDOM$RANDOM"
         else:
-            paths_quoted = " ".join(f'"{normpath(path)}"' for path in job.paths)
-            needs_quoted = " ".join(f'"${{keys[{need}]}}"' for need in job.needs)
-            suffix = f"$(git_hash_files {paths_quoted} -- {needs_quoted})"
-        # TODO: include extra-key
-        script = dedent(
-            f"""\
-            keys[{name}]="{name}-{suffix}"
-            echo "::set-output name={name}::${{keys[{name}]}}"
-            """
-        )
+            paths = job.paths
+            shard_hash = list[str]()
+            if job.shard is not None:
+                paths = [path for path in paths if path not in job.shard.paths]
+                shard_paths_quoted = " ".join(
+                    f'"{normpath(path)}"' for path in job.shard.paths
+                )
+                shard_hash.append(
+                    f'"$(git_hash_shard {job.shard.index} {job.shard.count}'
+                    f' {shard_paths_quoted})"'
+                )
+            paths_quoted = " ".join(f'"{git_path(path)}"' for path in paths)
+            strings_quoted = " ".join(
+                [
+                    *(f'"${{keys[{need}]}}"' for need in job.needs),
+                    *(shlex.quote(string) for _, string in key_strings(job)),
+                    *shard_hash,
+                ]
+            )
+            suffix = f"$(git_hash_files {paths_quoted} -- {strings_quoted})"
+        scripts.append(_get_key_script(name, suffix))
 
-        scripts.append(script)
+        # Each cached step is keyed on its own paths and everything before it
+        previous_quoted = strings_quoted
+        for i, cached_step in enumerate(job.cached_steps.values()):
+            step_name = step_key_name(name, i)
+            if is_implicitly_force(name, jobs):
+                suffix = "$RANDOM$RANDOM"
+            else:
+                paths_quoted = " ".join(
+                    f'"{git_path(path)}"' for path in cached_step.paths
+                )
+                suffix = f"$(git_hash_files {paths_quoted} -- {previous_quoted})"
+                previous_quoted = f'"${{keys[{step_name}]}}"'
+            scripts.append(_get_key_script(step_name, suffix))
 
     for name in jobs:
         add_job(name)
 
+    for id_, cache in caches.items():
+        if cache.key_files:
+            key_files_quoted = " ".join(
+                f'"{git_path(path)}"' for path in cache.key_files
+            )
+            suffix = f"$(git_hash_files {key_files_quoted} -- )"
+        else:
+            # Nothing to key on, so each run saves a new entry restored by the next
+            suffix = "${GITHUB_RUN_ID}-${GITHUB_RUN_ATTEMPT}"
+        scripts.append(
+            f'echo "::set-output name={id_}::{cache_key_prefix(cache)}{suffix}"\n'
+        )
+
     return {
         "id": _KEY_GENERATION_STEP_ID,
         "name": "Generate keys",
@@ -123,11 +196,35 @@ def _get_key_generator_step(jobs: Mapping[str, JobDetails]) -> gh.Step:
             }
             """
             )
+            + (
+                _GIT_HASH_SHARD
+                if any(job.shard is not None for job in jobs.values())
+                else ""
+            )
             + "\n".join(scripts)
         ),
     }
 
 
+def _get_key_script(name: str, suffix: str) -> str:
+    return dedent(
+        f"""\
+        keys[{name}]="{name}-{suffix}"
+        echo "::set-output name={name}::${{keys[{name}]}}"
+        """
+    )
+
+
+_GIT_HASH_SHARD = f"""\
+function git_hash_shard {{
+    git -c core.quotePath=false ls-tree -r "${{GITHUB_SHA}}" -- "${{@:3}}" \\
+        | {SHARD_FILTER} \\
+        | tee /dev/stderr \\
+        | git hash-object --stdin
+}}
+"""
+
+
 def _get_key_step_output(job_name: str) -> str:
     return "${{ " f"steps.{_KEY_GENERATION_STEP_ID}.outputs.{job_name}" " }}"
 
@@ -158,3 +255,16 @@ def _get_cache_check_steps(jobs: Mapping[str, JobDetails]) -> list[gh.Step]:
         for name, job in jobs.items()
         if not is_implicitly_force(name, jobs)
     ]
+
+
+def _get_checks_record(jobs: Mapping[str, JobDetails]) -> Json:
+    return {
+        name: {
+            "key": _get_key_step_output(name),
+            "hit": "${{ "
+            f"steps.{_get_cache_check_step_id(name)}.outputs.cache-hit == 'true'"
+            " }}",
+        }
+        for name in jobs
+        if not is_implicitly_force(name, jobs)
+    }
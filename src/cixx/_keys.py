@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import hashlib
+import subprocess
+from collections.abc import Mapping
+from dataclasses import dataclass
+from pathlib import Path
+from posixpath import normpath
+
+from ._common import (
+    CacheDetails,
+    JobDetails,
+    cache_key_prefix,
+    git_path,
+    is_implicitly_force,
+    key_strings,
+    step_key_name,
+)
+
+
+@dataclass(frozen=True, slots=True)
+class GitObject:
+    """An object read from the git object database"""
+
+    sha: str
+    type: str
+    content: bytes
+
+
+class GitObjects:
+    """Reads git objects through one `git cat-file --batch` process"""
+
+    def __init__(self, repository: Path):
+        self._process = subprocess.Popen(
+            ["git", "cat-file", "--batch"],
+            cwd=repository,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def __enter__(self) -> GitObjects:
+        return self
+
+    def __exit__(self, *_: object):
+        self.close()
+
+    def close(self):
+        """Stop the git process"""
+        assert self._process.stdin is not None
+        self._process.stdin.close()
+        self._process.wait()
+
+    def read(self, name: str) -> GitObject | None:
+        """Returns the object for a name like `<commit>:<path>` or None if missing
+
+        Raises:
+            ValueError: if the name can't be sent to git
+        """
+        assert self._process.stdin is not None and self._process.stdout is not None
+        if "\n" in name:
+            raise ValueError(f"Object name with a newline: {name!r}")
+        self._process.stdin.write(f"{name}\n".encode())
+        self._process.stdin.flush()
+
+        header = self._process.stdout.readline().split()
+        if len(header) != 3 or header[-1] in (b"missing", b"ambiguous"):
+            return None
+        sha, type_, size = header
+        content = self._process.stdout.read(int(size))
+        self._process.stdout.read(1)  # newline after the content
+        return GitObject(sha.decode(), type_.decode(), content)
+
+    def ls_tree(self, commit: str, paths: list[str]) -> list[bytes]:
+        """Returns the lines of `git -c core.quotePath=false ls-tree -r`"""
+        root = self.read(f"{commit}^{{tree}}")
+        assert root is not None
+        specs = [normpath(path) for path in paths]
+        lines = list[bytes]()
+        self._add_tree_lines(root.content, "", specs, lines)
+        return lines
+
+    def _add_tree_lines(
+        self, tree: bytes, prefix: str, specs: list[str], lines: list[bytes]
+    ):
+        for mode, name, sha in _parse_tree(tree):
+            path = f"{prefix}{name}"
+            matches = any(
+                spec in (".", path) or path.startswith(f"{spec}/") for spec in specs
+            )
+            if mode == "40000":
+                if matches or any(spec.startswith(f"{path}/") for spec in specs):
+                    subtree = self.read(sha)
+                    assert subtree is not None
+                    self._add_tree_lines(subtree.content, f"{path}/", specs, lines)
+            elif matches:
+                type_ = "commit" if mode == "160000" else "blob"
+                lines.append(
+                    f"{int(mode, 8):06o} {type_} {sha}\t".encode() + _quote_path(path)
+                )
+
+
+def _parse_tree(content: bytes) -> list[tuple[str, str, str]]:
+    entries = list[tuple[str, str, str]]()
+    i = 0
+    while i < len(content):
+        space = content.index(b" ", i)
+        nul = content.index(b"\0", space)
+        mode = content[i:space].decode()
+        name = content[space + 1 : nul].decode("utf-8", "surrogateescape")
+        sha = content[nul + 1 : nul + 21].hex()
+        entries.append((mode, name, sha))
+        i = nul + 21
+    return entries
+
+
+_ESCAPES = {
+    0x07: b"\\a",
+    0x08: b"\\b",
+    0x09: b"\\t",
+    0x0A: b"\\n",
+    0x0B: b"\\v",
+    0x0C: b"\\f",
+    0x0D: b"\\r",
+    0x22: b'\\"',
+    0x5C: b"\\\\",
+}
+
+
+def _quote_path(path: str) -> bytes:
+    # Same as git with core.quotePath=false, only special ASCII is escaped
+    raw = path.encode("utf-8", "surrogateescape")
+    if not any(byte < 0x20 or byte in (0x22, 0x5C, 0x7F) for byte in raw):
+        return raw
+    quoted = b"".join(
+        _ESCAPES.get(byte)
+        or (f"\\{byte:03o}".encode() if byte < 0x20 or byte == 0x7F else bytes([byte]))
+        for byte in raw
+    )
+    return b'"' + quoted + b'"'
+
+
+def _in_shard(line: bytes, index: int, count: int) -> bool:
+    # Same as SHARD_FILTER
+    hash_ = 0
+    for byte in line.split(b"\t", 2)[1]:
+        hash_ = (hash_ * 31 + byte) % 4294967296
+    return hash_ % count == index
+
+
+def _hash_object(content: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+@dataclass(frozen=True, slots=True)
+class Key:
+    """A cache key and what it was made from
+
+    Attributes:
+        value: The key, None if the job is forced to run
+        parts: Label and value of everything hashed into the key
+        missing_paths: Paths not in the commit, so the commit is hashed instead
+    """
+
+    value: str | None
+    parts: list[tuple[str, str]]
+    missing_paths: list[str]
+
+
+def get_keys(
+    git: GitObjects, commit: str, jobs: Mapping[str, JobDetails]
+) -> dict[str, Key]:
+    """Returns the same keys as the init job would for the commit"""
+    keys = dict[str, Key]()
+
+    def add_job(name: str):
+        if name in keys:
+            return
+        job = jobs[name]
+        for need in job.needs:
+            add_job(need)
+
+        if is_implicitly_force(name, jobs):
+            keys[name] = Key(value=None, parts=[], missing_paths=[])
+            for i in range(len(job.cached_steps)):
+                keys[step_key_name(name, i)] = keys[name]
+            return
+
+        paths = job.paths
+        if job.shard is not None:
+            paths = [path for path in paths if path not in job.shard.paths]
+
+        after_paths = list[tuple[str, str]]()
+        for need in job.needs:
+            need_key = keys[need].value
+            assert need_key is not None
+            after_paths.append((f"needs {need}", need_key))
+        after_paths.extend(key_strings(job))
+        if job.shard is not None:
+            lines = git.ls_tree(commit, job.shard.paths)
+            shard_lines = [
+                line + b"\n"
+                for line in lines
+                if _in_shard(line, job.shard.index, job.shard.count)
+            ]
+            after_paths.append(("shard files", _hash_object(b"".join(shard_lines))))
+
+        add_key(name, paths, after_paths)
+
+        for i, cached_step in enumerate(job.cached_steps.values()):
+            step_name = step_key_name(name, i)
+            add_key(step_name, cached_step.paths, after_paths)
+            value = keys[step_name].value
+            assert value is not None
+            after_paths = [("previous step", value)]
+
+    def add_key(name: str, paths: list[str], after_paths: list[tuple[str, str]]):
+        parts, missing_paths = _get_path_parts(git, commit, paths)
+        parts.extend(after_paths)
+        keys[name] = Key(
+            value=f"{name}-{_hash_parts(parts)}",
+            parts=parts,
+            missing_paths=missing_paths,
+        )
+
+    for name in jobs:
+        add_job(name)
+
+    return keys
+
+
+def get_cache_keys(
+    git: GitObjects, commit: str, caches: Mapping[str, CacheDetails]
+) -> dict[str, Key]:
+    """Returns the same tool and dependency cache keys as the init job would"""
+    keys = dict[str, Key]()
+    for id_, cache in caches.items():
+        parts, missing_paths = _get_path_parts(git, commit, cache.key_files)
+        keys[id_] = Key(
+            # A rolling key is new each run
+            value=cache_key_prefix(cache)
+            + (_hash_parts(parts) if cache.key_files else "<run>"),
+            parts=parts,
+            missing_paths=missing_paths,
+        )
+    return keys
+
+
+def _get_path_parts(
+    git: GitObjects, commit: str, paths: list[str]
+) -> tuple[list[tuple[str, str]], list[str]]:
+    parts = list[tuple[str, str]]()
+    missing_paths = list[str]()
+    for path in paths:
+        name = f"{commit}:{git_path(path)}"
+        obj = git.read(name)
+        if obj is None:
+            # `git rev-parse` prints the name it couldn't resolve
+            missing_paths.append(path)
+            parts.append((f"path {path}", " ".join(name.split())))
+        else:
+            parts.append((f"path {path}", obj.sha))
+    return parts, missing_paths
+
+
+def _hash_parts(parts: list[tuple[str, str]]) -> str:
+    return _hash_object("".join(value for _, value in parts).encode())
+
+
+def format_prediction(
+    keys: Mapping[str, Key],
+    existing_keys: set[str] | None,
+    base_keys: Mapping[str, Key] | None = None,
+) -> str:
+    """Return a human readable report of which jobs would hit the cache and why
+
+    Args:
+        keys: The keys of each job
+        existing_keys: The keys in the cache, None if not known
+        base_keys: The keys of each job at a base revision to explain changes
+    """
+    width = max((len(name) for name in keys), default=0)
+    lines = list[str]()
+    for name, key in keys.items():
+        if key.value is None:
+            lines.append(f"{name:<{width}}  rebuild  forced by itself or a need")
+            continue
+        if existing_keys is None:
+            status = "key"
+        elif key.value in existing_keys:
+            status = "hit"
+        else:
+            status = "rebuild"
+        lines.append(f"{name:<{width}}  {status:<7}  {key.value}")
+        if status == "hit":
+            continue
+
+        reasons = list[str]()
+        if key.missing_paths:
+            reasons.append(
+                "not in the commit so the key changes every commit: "
+                + ", ".join(key.missing_paths)
+            )
+        base_key = base_keys.get(name) if base_keys is not None else None
+        if base_key is not None and base_key.value != key.value:
+            base_parts = dict(base_key.parts)
+            parts = dict(key.parts)
+            reasons.extend(
+                f"{label} changed"
+                for label in dict.fromkeys([*parts, *base_parts])
+                if parts.get(label) != base_parts.get(label)
+            )
+        elif base_key is not None:
+            reasons.append("unchanged from base")
+        if status == "rebuild" and not reasons:
+            reasons.append("no cache entry for the key")
+        lines.extend(f"{'':<{width}}  - {reason}" for reason in reasons)
+    return "\n".join(lines)
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import tempfile
+from pathlib import Path
+from urllib.parse import unquote
+
+from ._cache_client import SUFFIX, DirectoryBackend, archive, entry_name, extract
+from ._cas import ContentAddressedStore
+
+
+class LocalCache:
+    """A directory of cache entries, one `<quoted key>.tar` per key
+
+    Stands in for the actions cache when running workflows locally. Paths in
+    the home directory are stored relative to it so entries can be restored
+    into a different home directory, like on another runner. If content
+    addressed, entries are manifests of files stored once each instead.
+    """
+
+    def __init__(self, directory: Path, content_addressed: bool = False):
+        self.directory = directory
+        self.store = ContentAddressedStore(directory) if content_addressed else None
+
+    def path(self, key: str) -> Path:
+        """Returns the file of the entry for the key"""
+        if self.store is not None:
+            return self.store.manifest(key)
+        return self.directory / entry_name(key)
+
+    def keys(self) -> set[str]:
+        """Returns the keys of all entries"""
+        if self.store is not None:
+            return self.store.keys()
+        if not self.directory.is_dir():
+            return set()
+        return {
+            unquote(path.name.removesuffix(SUFFIX))
+            for path in self.directory.iterdir()
+            if path.name.endswith(SUFFIX)
+        }
+
+    def find(self, key: str, restore_keys: list[str] | None = None) -> str | None:
+        """Returns the key of the entry to restore like actions/cache
+
+        The key must match exactly, each restore key is a prefix where the newest
+        matching entry is used.
+        """
+        if self.path(key).is_file():
+            return key
+        keys = self.keys()
+        for prefix in restore_keys or []:
+            matches = [existing for existing in keys if existing.startswith(prefix)]
+            if matches:
+                return max(matches, key=lambda match: self.path(match).stat().st_mtime)
+        return None
+
+    def save(self, key: str, paths: list[str], workspace: Path, home: Path) -> bool:
+        """Archive the paths under the key unless it already exists
+
+        Args:
+            key: The key of the entry
+            paths: Paths or glob patterns, relative to the workspace or `~/`
+            workspace: The directory relative paths are in
+            home: The directory `~` refers to
+
+        Returns:
+            Whether the entry was saved
+
+        Raises:
+            ValueError: if a path is outside the workspace and home directory
+        """
+        if self.store is not None:
+            return self.store.save(key, paths, workspace, home)
+        if self.path(key).exists():
+            return False
+
+        with tempfile.TemporaryFile() as file:
+            archive(paths, workspace, home, file)
+            file.seek(0)
+            DirectoryBackend(self.directory).upload(key, file)
+        return True
+
+    def restore(self, key: str, workspace: Path, home: Path):
+        """Extract an entry into the workspace and home directory
+
+        Raises:
+            ValueError: if the entry has a path outside those directories
+        """
+        if self.store is not None:
+            self.store.restore(key, workspace, home)
+            return
+        with open(self.path(key), "rb") as file:
+            extract(file, workspace, home, key)
@@ -0,0 +1,603 @@
+from __future__ import annotations
+
+import json
+import re
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO
+from urllib.parse import unquote, urlparse
+
+from ._expressions import get_full_expression_or_none, replace_identifiers
+from ._reuseable_workflow import (
+    expand_cixx_uses,
+    replace_jobs_references,
+    replace_outputs_references,
+)
+from ._schema import InvalidWorkflowError, Problem, get_mark, get_uses, load, validate
+from ._validation import Json, is_json_array, is_json_object
+
+_EXPRESSION = re.compile(r"\$\{\{.*?\}\}")
+_REFERENCE = re.compile(r"\b(?:jobs|needs)\.([\w-]+)(?:\.outputs\.([\w-]+))?")
+
+# JSON-RPC error codes
+_INVALID_REQUEST = -32600
+_METHOD_NOT_FOUND = -32601
+_INVALID_PARAMS = -32602
+_INTERNAL_ERROR = -32603
+
+
+class _ResponseError(Exception):
+    """Answers a request with a JSON-RPC error instead of a result"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+@dataclass(frozen=True, slots=True)
+class Location:
+    """A 0-based position in a file, like the LSP"""
+
+    file: Path
+    line: int
+    column: int
+
+
+@dataclass(slots=True)
+class Document:
+    """A CI++ file parsed and validated once per change"""
+
+    text: str
+    # None if it isn't valid YAML
+    data: Json
+    problems: list[Problem]
+    # The file each cixx-uses job uses
+    uses: dict[str, Path]
+    # Of the file when it was read from disk, None if it's open
+    mtime: int | None = None
+
+
+@dataclass(slots=True)
+class _Expansion:
+    workflow: dict[str, Json] | None
+    job_outputs: dict[str, Json]
+    problems: list[Problem] = field(default_factory=list)
+
+
+class Workspace:
+    """The CI++ files being edited, and the files they cixx-uses
+
+    Each file is parsed and validated when it changes, others are kept. Files
+    that aren't open are read from disk again once their modification time
+    changes. Expansions of cixx-uses are kept until a file in their include
+    graph changes.
+    """
+
+    def __init__(self):
+        self._open = dict[Path, str]()
+        self._documents = dict[Path, Document]()
+        self._expansions = dict[Path, _Expansion]()
+
+    def update(self, file: Path, text: str | None) -> set[Path]:
+        """Set the text of an open file, or close it with None
+
+        Returns:
+            The file and the files that cixx-uses it directly or not
+        """
+        file = file.resolve()
+        before = self.dependents(file)
+        if text is None:
+            self._open.pop(file, None)
+        else:
+            self._open[file] = text
+        self._documents.pop(file, None)
+        # The change can add or remove cixx-uses
+        affected = before | self.dependents(file)
+        for path in affected:
+            self._expansions.pop(path, None)
+        return affected
+
+    def reload(self, file: Path) -> set[Path]:
+        """Read a file that isn't open from disk again when it's next used
+
+        Returns:
+            The file and the files that cixx-uses it directly or not, none if it's
+            open
+        """
+        file = file.resolve()
+        if file in self._open:
+            return set()
+        # First, finding the dependents reloads other changed files
+        self._documents.pop(file, None)
+        affected = self.dependents(file)
+        for path in affected:
+            self._expansions.pop(path, None)
+        return affected
+
+    def is_open(self, file: Path) -> bool:
+        """Checks if the editor has the file open"""
+        return file.resolve() in self._open
+
+    def document(self, file: Path) -> Document:
+        """Returns the file as last edited, or as on disk if it isn't open"""
+        file = file.resolve()
+        self._reload_changed()
+        if file not in self._documents:
+            text = self._open.get(file)
+            mtime = None
+            if text is None:
+                mtime = _get_mtime(file)
+                try:
+                    text = file.read_text(encoding="utf-8")
+                except OSError as error:
+                    return Document(
+                        "",
+                        None,
+                        [Problem(str(file), None, None, "", error.strerror)],
+                        {},
+                    )
+            data, problems = load(text, str(file))
+            uses = dict[str, Path]()
+            if not problems:
+                problems = validate(data, str(file))
+                uses, uses_problems = get_uses(data, file)
+                problems.extend(uses_problems)
+            self._documents[file] = Document(text, data, problems, uses, mtime)
+        return self._documents[file]
+
+    def _reload_changed(self):
+        """Drops the files that aren't open that changed on disk since read"""
+        for path, document in list(self._documents.items()):
+            if document.mtime is not None and document.mtime != _get_mtime(path):
+                self.reload(path)
+
+    def dependents(self, file: Path) -> set[Path]:
+        """Returns the file and the known files that cixx-uses it, directly or not"""
+        file = file.resolve()
+        for path in self._open:
+            self.document(path)
+        users = dict[Path, set[Path]]()
+        for path, document in self._documents.items():
+            for used in document.uses.values():
+                users.setdefault(used.resolve(), set()).add(path)
+
+        found = {file}
+        pending = [file]
+        while pending:
+            for user in users.get(pending.pop(), set()) - found:
+                found.add(user)
+                pending.append(user)
+        return found
+
+    def diagnostics(self, file: Path) -> list[Problem]:
+        """Returns the problems of the file, as written and once expanded"""
+        document = self.document(file)
+        if document.problems or not is_json_object(document.data):
+            return document.problems
+        return [*_get_needs_problems(document.data, file), *self._expand(file).problems]
+
+    def definition(self, file: Path, line: int, column: int) -> Location | None:
+        """Returns where the job, output or file at a position is defined"""
+        document = self.document(file)
+        if not is_json_object(document.data):
+            return None
+        jobs = document.data.get("jobs")
+        if not is_json_object(jobs):
+            return None
+
+        match _find_scalar(document.data, line, column):
+            case (("jobs", str(job), "cixx-uses"), _) if job in document.uses:
+                return Location(document.uses[job].resolve(), 0, 0)
+            case (("jobs", _, "needs", int(), *rest), str(need)) if (
+                rest in ([], ["job"]) and need in jobs
+            ):
+                return _key_location(file, jobs, need)
+
+        reference = _reference_at(_line(document.text, line), column)
+        if reference is None:
+            return None
+        job, output = reference
+        if job not in jobs:
+            return None
+        if output is not None:
+            if job in document.uses:
+                used = document.uses[job].resolve()
+                outputs = _get(self.document(used).data, "on", "cixx_call", "outputs")
+            else:
+                outputs = _get(jobs, job, "outputs")
+            if is_json_object(outputs) and output in outputs:
+                return _key_location(
+                    document.uses[job].resolve() if job in document.uses else file,
+                    outputs,
+                    output,
+                )
+        return _key_location(file, jobs, job)
+
+    def hover(self, file: Path, line: int, column: int) -> str | None:
+        """Returns Markdown of what the expression or cixx-uses at a position is"""
+        document = self.document(file)
+        if document.problems or not is_json_object(document.data):
+            return None
+        expansion = self._expand(file)
+
+        scalar = _find_scalar(document.data, line, column)
+        if scalar is not None and expansion.workflow is not None:
+            match scalar:
+                case (("jobs", str(job), "cixx-uses"), _):
+                    own = [
+                        name
+                        for name in _get_jobs(expansion.workflow)
+                        if name.startswith(f"{job}-")
+                        and name not in _get_jobs(document.data)
+                    ]
+                    if not own:
+                        return "Shares the jobs of an identical cixx-uses"
+                    return "Expands to jobs:\n\n" + "\n".join(
+                        f"- `{name}`" for name in own
+                    )
+
+        line_text = _line(document.text, line)
+        for match in _EXPRESSION.finditer(line_text):
+            if match.start() <= column < match.end():
+                return _format_expansion(match.group(), expansion.job_outputs)
+        return None
+
+    def _expand(self, file: Path) -> _Expansion:
+        file = file.resolve()
+        if file not in self._expansions:
+            job_outputs = dict[str, Json]()
+            try:
+                workflow = replace_jobs_references(
+                    expand_cixx_uses(file, self._load, job_outputs)
+                )
+                expansion = _Expansion(workflow, job_outputs)
+            except InvalidWorkflowError as error:
+                # Reported in the used files themselves
+                files = sorted({problem.file for problem in error.problems})
+                expansion = _Expansion(
+                    None,
+                    job_outputs,
+                    [
+                        Problem(str(file), None, None, "", f"Problems in {used}")
+                        for used in files
+                    ],
+                )
+            except (TypeError, ValueError, KeyError) as error:
+                expansion = _Expansion(
+                    None, job_outputs, [Problem(str(file), None, None, "", str(error))]
+                )
+            self._expansions[file] = expansion
+        return self._expansions[file]
+
+    def _load(self, file: Path) -> Json:
+        document = self.document(file)
+        if document.problems:
+            raise InvalidWorkflowError(document.problems)
+        return document.data
+
+
+class LanguageServer:
+    """A language server for CI++ files over JSON-RPC, like on stdio
+
+    It publishes the problems of open files and the files using them on each
+    change, and answers go-to-definition and hover requests.
+    """
+
+    def __init__(self, reader: BinaryIO, writer: BinaryIO):
+        self.reader = reader
+        self.writer = writer
+        self.workspace = Workspace()
+        self._shutdown = False
+
+    def serve(self) -> int:
+        """Handle messages until exit, returns the exit code"""
+        while (message := self._read()) is not None:
+            if is_json_object(message) and message.get("method") == "exit":
+                break
+            self._handle(message)
+        return 0 if self._shutdown else 1
+
+    def _handle(self, message: Json):
+        if not is_json_object(message) or not isinstance(message.get("method"), str):
+            id_ = message.get("id") if is_json_object(message) else None
+            self._respond(id_, error=(_INVALID_REQUEST, "Expected a method"))
+            return
+        try:
+            result = self._dispatch(
+                str(message["method"]), _get_object(message, "params", {})
+            )
+        except _ResponseError as error:
+            if "id" in message:
+                self._respond(message["id"], error=(error.code, str(error)))
+            return
+        except Exception as error:  # pylint: disable=broad-except
+            if "id" in message:
+                self._respond(message["id"], error=(_INTERNAL_ERROR, str(error)))
+            return
+        if "id" in message:
+            self._respond(message["id"], result)
+
+    def _dispatch(self, method: str, params: dict[str, Json]) -> Json:
+        match method:
+            case "initialize":
+                return {
+                    "capabilities": {
+                        "textDocumentSync": {"openClose": True, "change": 1},
+                        "definitionProvider": True,
+                        "hoverProvider": True,
+                    },
+                    "serverInfo": {"name": "ci++"},
+                }
+            case "initialized" | "textDocument/didSave" | "$/cancelRequest":
+                return None
+            case "shutdown":
+                self._shutdown = True
+                return None
+            case "textDocument/didOpen":
+                document = _get_object(params, "textDocument")
+                self._changed(_document_path(params), _get_string(document, "text"))
+                return None
+            case "textDocument/didChange":
+                changes = params.get("contentChanges")
+                # Full sync, so the last change has the whole text
+                change = changes[-1] if is_json_array(changes) and changes else None
+                if not is_json_object(change):
+                    raise _ResponseError(
+                        _INVALID_PARAMS, "Expected a change at 'contentChanges'"
+                    )
+                self._changed(_document_path(params), _get_string(change, "text"))
+                return None
+            case "workspace/didChangeWatchedFiles":
+                changes = params.get("changes")
+                affected = set[Path]()
+                for change in changes if is_json_array(changes) else []:
+                    if not is_json_object(change):
+                        raise _ResponseError(
+                            _INVALID_PARAMS, "Expected an object at 'changes'"
+                        )
+                    affected |= self.workspace.reload(
+                        _to_path(_get_string(change, "uri"))
+                    )
+                self._publish_open(affected)
+                return None
+            case "textDocument/didClose":
+                file = _document_path(params)
+                self._changed(file, None)
+                self._publish(file, [])
+                return None
+            case "textDocument/definition":
+                location = self.workspace.definition(
+                    _document_path(params), *_position(params)
+                )
+                if location is None:
+                    return None
+                position = {"line": location.line, "character": location.column}
+                return {
+                    "uri": location.file.as_uri(),
+                    "range": {"start": position, "end": position},
+                }
+            case "textDocument/hover":
+                hover = self.workspace.hover(_document_path(params), *_position(params))
+                if hover is None:
+                    return None
+                return {"contents": {"kind": "markdown", "value": hover}}
+        raise _ResponseError(_METHOD_NOT_FOUND, f"Unknown method {method}")
+
+    def _changed(self, file: Path, text: str | None):
+        self._publish_open(self.workspace.update(file, text))
+
+    def _publish_open(self, files: set[Path]):
+        for path in sorted(files):
+            if self.workspace.is_open(path):
+                self._publish(path, self.workspace.diagnostics(path))
+
+    def _publish(self, file: Path, problems: list[Problem]):
+        text = self.workspace.document(file).text if problems else ""
+        self._send(
+            {
+                "jsonrpc": "2.0",
+                "method": "textDocument/publishDiagnostics",
+                "params": {
+                    "uri": file.as_uri(),
+                    "diagnostics": [
+                        _to_diagnostic(problem, text)
+                        for problem in problems
+                        if Path(problem.file) == file
+                    ],
+                },
+            }
+        )
+
+    def _respond(
+        self, id_: Json, result: Json = None, error: tuple[int, str] | None = None
+    ):
+        response: dict[str, Json] = {"jsonrpc": "2.0", "id": id_}
+        if error is None:
+            response["result"] = result
+        else:
+            response["error"] = {"code": error[0], "message": error[1]}
+        self._send(response)
+
+    def _read(self) -> Json:
+        length = None
+        while True:
+            header = self.reader.readline()
+            if not header:
+                return None
+            header = header.strip()
+            if not header:
+                break
+            name, _, value = header.decode("ascii").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        if length is None:
+            return None
+        return json.loads(self.reader.read(length))
+
+    def _send(self, message: dict[str, Json]):
+        body = json.dumps(message).encode()
+        self.writer.write(f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        self.writer.flush()
+
+
+def _format_expansion(expression: str, job_outputs: dict[str, Json]) -> str:
+    """Returns Markdown of what an expression is after cixx-uses are expanded"""
+    expanded = replace_outputs_references(expression, job_outputs)
+    if isinstance(expanded, str):
+        full_expression = get_full_expression_or_none(expanded)
+        if full_expression is not None and re.fullmatch(
+            r"jobs\.[\w-]+", full_expression
+        ):
+            return f"The job `{full_expression[5:]}`"
+        expanded = replace_identifiers(expanded, [("jobs", "needs")])
+        return f"```\n{expanded}\n```"
+    return f"```json\n{json.dumps(expanded, indent=2)}\n```"
+
+
+def _get_needs_problems(workflow: dict[str, Json], file: Path) -> list[Problem]:
+    """Returns a problem for each need of a job that isn't in the file"""
+    jobs = _get_jobs(workflow)
+    problems = list[Problem]()
+    for key, job in jobs.items():
+        needs = job.get("needs", []) if is_json_object(job) else []
+        for i, need in enumerate(needs if is_json_array(needs) else []):
+            name = need.get("job") if is_json_object(need) else need
+            if not isinstance(name, str) or name in jobs:
+                continue
+            if get_full_expression_or_none(name) is not None:
+                continue
+            line, column = get_mark(needs, "item", i) or (None, None)
+            problems.append(
+                Problem(
+                    str(file),
+                    None if line is None else line + 1,
+                    None if column is None else column + 1,
+                    f"jobs.{key}.needs[{i}]",
+                    f"Unknown job {name} at 'jobs.{key}.needs[{i}]'",
+                )
+            )
+    return problems
+
+
+def _find_scalar(
+    data: Json, line: int, column: int
+) -> tuple[tuple[str | int, ...], Json] | None:
+    """Returns the path and value of the scalar starting last before a position"""
+    found = None
+    found_column = -1
+    for path, value, mark in _walk_scalars(data, ()):
+        if mark[0] == line and found_column < mark[1] <= column:
+            found = (path, value)
+            found_column = mark[1]
+    return found
+
+
+def _walk_scalars(
+    data: Json, path: tuple[str | int, ...]
+) -> Iterator[tuple[tuple[str | int, ...], Json, tuple[int, int]]]:
+    if is_json_object(data):
+        for key, value in data.items():
+            if is_json_object(value) or is_json_array(value):
+                yield from _walk_scalars(value, (*path, key))
+            elif (mark := get_mark(data, "value", key)) is not None:
+                yield (*path, key), value, mark
+    elif is_json_array(data):
+        for i, value in enumerate(data):
+            if is_json_object(value) or is_json_array(value):
+                yield from _walk_scalars(value, (*path, i))
+            elif (mark := get_mark(data, "item", i)) is not None:
+                yield (*path, i), value, mark
+
+
+def _reference_at(line_text: str, column: int) -> tuple[str, str | None] | None:
+    """Returns the job and output referenced in an expression at a column"""
+    for expression in _EXPRESSION.finditer(line_text):
+        if not expression.start() <= column < expression.end():
+            continue
+        for reference in _REFERENCE.finditer(expression.group()):
+            start = expression.start() + reference.start()
+            if start <= column < expression.start() + reference.end():
+                return reference.group(1), reference.group(2)
+    return None
+
+
+def _key_location(file: Path, mapping: dict[str, Json], key: str) -> Location:
+    line, column = get_mark(mapping, "key", key) or (0, 0)
+    return Location(file, line, column)
+
+
+def _get(obj: Json, *keys: str) -> Json:
+    for key in keys:
+        if not is_json_object(obj):
+            return None
+        obj = obj.get(key)
+    return obj
+
+
+def _get_jobs(workflow: Json) -> dict[str, Json]:
+    jobs = _get(workflow, "jobs")
+    return jobs if is_json_object(jobs) else {}
+
+
+def _line(text: str, line: int) -> str:
+    lines = text.splitlines()
+    return lines[line] if 0 <= line < len(lines) else ""
+
+
+def _to_diagnostic(problem: Problem, text: str) -> Json:
+    line = (problem.line or 1) - 1
+    start = (problem.column or 1) - 1
+    # To the end of the line, or the first character if it's empty
+    end = max(len(_line(text, line).rstrip()), start + 1)
+    return {
+        "range": {
+            "start": {"line": line, "character": start},
+            "end": {"line": line, "character": end},
+        },
+        "severity": 1,
+        "source": "ci++",
+        "message": problem.message,
+    }
+
+
+def _to_path(uri: Json) -> Path:
+    return Path(unquote(urlparse(str(uri)).path)).resolve()
+
+
+def _get_mtime(file: Path) -> int | None:
+    try:
+        return file.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _document_path(params: dict[str, Json]) -> Path:
+    return _to_path(_get_string(_get_object(params, "textDocument"), "uri"))
+
+
+def _position(params: dict[str, Json]) -> tuple[int, int]:
+    position = _get_object(params, "position")
+    line, character = position.get("line"), position.get("character")
+    if not isinstance(line, int) or not isinstance(character, int):
+        raise _ResponseError(_INVALID_PARAMS, "Expected line and character integers")
+    return line, character
+
+
+def _get_object(
+    params: dict[str, Json], key: str, default: dict[str, Json] | None = None
+) -> dict[str, Json]:
+    """Returns a parameter that must be an object, or the default if it's missing"""
+    value = params.get(key)
+    if value is None and default is not None:
+        return default
+    if not is_json_object(value):
+        raise _ResponseError(_INVALID_PARAMS, f"Expected an object at '{key}'")
+    return value
+
+
+def _get_string(params: dict[str, Json], key: str) -> str:
+    value = params.get(key)
+    if not isinstance(value, str):
+        raise _ResponseError(_INVALID_PARAMS, f"Expected a string at '{key}'")
+    return value
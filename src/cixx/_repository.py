@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import subprocess
+from pathlib import Path, PurePosixPath
+
+
+def find_root(path: Path) -> Path:
+    """Return the root of the repository checkout containing a path
+
+    Falls back to the current directory if it isn't in a git repository.
+    """
+    result = subprocess.run(
+        ["git", "rev-parse", "--show-toplevel"],
+        cwd=path,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if result.returncode != 0:
+        return Path.cwd()
+    return Path(result.stdout.strip())
+
+
+def glob_directories(root: Path, pattern: str) -> list[str]:
+    """Return the directories matching a glob as sorted paths relative to root
+
+    Like a shell, hidden directories only match if the pattern says so.
+    """
+    include_hidden = any(part.startswith(".") for part in PurePosixPath(pattern).parts)
+    directories = list[str]()
+    for path in root.glob(pattern):
+        relative = path.relative_to(root)
+        if not path.is_dir():
+            continue
+        if not include_hidden and any(part.startswith(".") for part in relative.parts):
+            continue
+        directories.append(relative.as_posix())
+    return sorted(directories)
+
+
+def read_submodules(root: Path) -> dict[str, str]:
+    """Return the path of each submodule in .gitmodules by name"""
+    if not (root / ".gitmodules").is_file():
+        return {}
+    result = subprocess.run(
+        [
+            "git",
+            "config",
+            "--file",
+            str(root / ".gitmodules"),
+            "--null",
+            "--get-regexp",
+            r"^submodule\..*\.path$",
+        ],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    submodules = dict[str, str]()
+    for entry in result.stdout.split("\0"):
+        if entry:
+            key, path = entry.split("\n", 1)
+            submodules[key.removeprefix("submodule.").removesuffix(".path")] = path
+    return submodules
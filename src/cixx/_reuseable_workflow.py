@@ -1,31 +1,80 @@
+import json
+from collections.abc import Callable, Mapping
 from pathlib import Path
-from typing import Callable, TypeVar
+from typing import cast
 
 import ruamel.yaml
 
 from ._expressions import (
+    get_expression_replacements,
     get_full_expression_or_none,
+    get_full_expression_replacements,
     replace_full_expressions,
     replace_identifiers,
-    to_expression,
+    substitute_context,
 )
-from ._validation import Json, to_json_array_of_strings, to_json_object, to_string
+from ._schema import InvalidWorkflowError, validate
+from ._validation import Json, is_json_object, to_json_array, to_json_object, to_string
 
 
-# pylint: disable-next=too-many-locals  # should refactor this at some stage
-def expand_cixx_uses(input_file: Path) -> dict[str, Json]:
+def load_workflow(input_file: Path) -> Json:
+    """Return a CI++ file, loaded with the marks of its lines
+
+    Raises:
+        InvalidWorkflowError: if it doesn't match the schema
+    """
+    workflow: Json = ruamel.yaml.YAML().load(input_file)  # type: ignore
+    # Checked as written, while the marks of the YAML give the lines
+    if problems := validate(workflow, str(input_file)):
+        raise InvalidWorkflowError(problems)
+    return workflow
+
+
+def expand_cixx_uses(
+    input_file: Path,
+    load: Callable[[Path], Json] = load_workflow,
+    job_outputs: dict[str, Json] | None = None,
+) -> dict[str, Json]:
     """Return the workflow with any cixx-uses expanded.
 
-    Nested steps are useful when using YAML references
+    Uses of the same file with the same inputs share one set of jobs.
+
+    Args:
+        input_file: The workflow file
+        load: Returns a valid workflow file, e.g. one being edited
+        job_outputs: Filled with the outputs of each cixx-uses job of the file
     """
-    yaml = ruamel.yaml.YAML()
+    return _expand_cixx_uses(input_file, "", None, {}, load, job_outputs)
+
 
-    input_object: Json = yaml.load(input_file)  # type: ignore
-    input_ = to_json_object(input_object, f"{input_file}")
+# pylint: disable-next=too-many-locals  # should refactor this at some stage
+def _expand_cixx_uses(
+    input_file: Path,
+    prefix: str,
+    inputs: Json,
+    instances: dict[tuple[Path, str], Json],
+    load: Callable[[Path], Json],
+    job_outputs: dict[str, Json] | None = None,
+) -> dict[str, Json]:
+    """Return the workflow with any cixx-uses expanded.
+
+    Args:
+        input_file: The workflow file
+        prefix: Added to the job names, empty for the top level workflow
+        inputs: The with of the cixx-uses
+        instances: The outputs of each file and inputs already expanded
+        load: Returns a valid workflow file
+        job_outputs: Filled with the outputs of each cixx-uses job
+    """
+    input_ = cast(dict[str, Json], load(input_file))
+    if prefix:
+        # Before expanding further so nested uses get the final job names and inputs
+        input_ = substitute_context(_add_job_prefix(input_, prefix), "inputs", inputs)
 
     jobs = to_json_object(input_["jobs"], f"{input_file}:jobs")
     new_jobs = dict[str, Json]()
-    job_outputs = dict[str, Json]()
+    if job_outputs is None:
+        job_outputs = {}
 
     for job_key in jobs:
         job = to_json_object(jobs[job_key], f"{input_file}:jobs.{job_key}")
@@ -34,39 +83,48 @@ def expand_cixx_uses(input_file: Path) -> dict[str, Json]:
             new_jobs[job_key] = job
         else:
             cixx_uses = to_string(cixx_uses, f"{input_file}:jobs.{job_key}.cixx-uses")
-            inputs = job.get("with")
+            child_inputs = job.get("with")
 
             # IDEA: support URLs, absolute paths, etc
-            child = expand_cixx_uses(input_file.parent / cixx_uses)
-
-            prefix = f"{job_key}-"
-            while any(key.startswith(prefix) for key in jobs):
-                prefix += "-"  # Make sure it's impossible to conflict
-
-            child_fixed: dict[str, Json] = replace_identifiers(
-                replace_full_expressions(
-                    _add_job_prefix(child, prefix),
-                    _get_full_expression_replacements("inputs", inputs),
-                ),
-                _get_expression_replacements("inputs", inputs),
+            child_file = input_file.parent / cixx_uses
+            instance = (child_file.resolve(), json.dumps(child_inputs, sort_keys=True))
+            if instance in instances:
+                # The jobs are identical so the first ones are used
+                job_outputs[job_key] = instances[instance]
+                continue
+
+            child_prefix = f"{job_key}-"
+            while any(key.startswith(child_prefix) for key in jobs):
+                child_prefix += "-"  # Make sure it's impossible to conflict
+
+            child = _expand_cixx_uses(
+                child_file, child_prefix, child_inputs, instances, load
             )
 
-            # pylint: disable-next=unsubscriptable-object  # but it is
-            new_jobs.update(to_json_object(child_fixed["jobs"], f"{child}:jobs"))
+            new_jobs.update(to_json_object(child["jobs"], f"{child_file}:jobs"))
             on = to_json_object(  # pylint: disable=invalid-name
-                # pylint: disable-next=unsubscriptable-object  # but it is
-                child_fixed["on"],
-                f"{child}:on",
+                child["on"],
+                f"{child_file}:on",
             )
-            cixx_call = to_json_object(on["cixx_call"], f"{child}:on:cixx_call")
+            cixx_call = to_json_object(on["cixx_call"], f"{child_file}:on:cixx_call")
+
+            job_outputs[job_key] = instances[instance] = cixx_call.get("outputs")
+
+    with_new_jobs = _distribute_workflow_cache({**input_, "jobs": new_jobs})
+    return cast(dict[str, Json], replace_outputs_references(with_new_jobs, job_outputs))
 
-            job_outputs[job_key] = cixx_call.get("outputs")
 
+def replace_outputs_references(obj: Json, job_outputs: Mapping[str, Json]) -> Json:
+    """Return the object with references to outputs of cixx-uses jobs replaced
+
+    A full expression of an output is replaced by its value, other references
+    by an equivalent expression.
+    """
     outputs_full_replacements = [
         replacement
         for job, outputs in job_outputs.items()
         for context in ("needs", "jobs")
-        for replacement in _get_full_expression_replacements(
+        for replacement in get_full_expression_replacements(
             f"{context}.{job}.outputs", outputs
         )
     ]
@@ -74,17 +132,35 @@ def expand_cixx_uses(input_file: Path) -> dict[str, Json]:
         replacement
         for job, outputs in job_outputs.items()
         for context in ("needs", "jobs")
-        for replacement in _get_expression_replacements(
+        for replacement in get_expression_replacements(
             f"{context}.{job}.outputs", outputs
         )
     ]
-    with_new_jobs: dict[str, Json] = {**input_, "jobs": new_jobs}
-    with_full_outputs_replacements: dict[str, Json] = replace_full_expressions(
-        with_new_jobs, outputs_full_replacements
+    with_full_outputs_replacements = replace_full_expressions(
+        obj, outputs_full_replacements  # type: ignore
     )
     return replace_identifiers(with_full_outputs_replacements, outputs_replacements)
 
 
+def _distribute_workflow_cache(workflow: dict[str, Json]) -> dict[str, Json]:
+    """Return the workflow with a top level cache added to each of its jobs"""
+    if "cache" not in workflow:
+        return workflow
+
+    workflow = dict(workflow)
+    caches = to_json_array(workflow.pop("cache"), "cache")
+    jobs = to_json_object(workflow["jobs"], "jobs")
+    new_jobs = dict[str, Json]()
+    for job_key, job in jobs.items():
+        job = to_json_object(job, f"jobs.{job_key}")
+        if "steps" in job:
+            job_caches = to_json_array(job.get("cache", []), f"jobs.{job_key}.cache")
+            job = {**job, "cache": [*caches, *job_caches]}
+        new_jobs[job_key] = job
+
+    return {**workflow, "jobs": new_jobs}
+
+
 def _add_job_prefix(workflow: Json, prefix: str) -> dict[str, Json]:
     input_ = to_json_object(workflow, "top level")
 
@@ -100,54 +176,6 @@ def _add_job_prefix(workflow: Json, prefix: str) -> dict[str, Json]:
     return replace_identifiers(with_new_jobs, replacements)
 
 
-_TJson1 = TypeVar("_TJson1", bound=Json)
-_TJson2 = TypeVar("_TJson2", bound=Json)
-
-
-def _get_replacements(
-    name: str, obj: Json, replacer: Callable[[_TJson2], _TJson1]
-) -> list[tuple[str, _TJson1]]:
-    """Return the replacements with as much as can be expanded first"""
-    replacements = list[tuple[str, _TJson1]]()
-    match obj:
-        case str():
-            pass
-        case float() | int() | bool() | None:
-            pass
-        case list():
-            replacements.extend(
-                (
-                    replacement
-                    for i, value in enumerate(obj)
-                    for replacement in _get_replacements(
-                        f"{name}[{i}]", value, replacer
-                    )
-                )
-            )
-        case dict():
-            replacements.extend(
-                (
-                    replacement
-                    for key, value in obj.items()
-                    for replacement in _get_replacements(
-                        f"{name}.{key}", value, replacer
-                    )
-                )
-            )
-
-    replacement = replacer(obj)
-    replacements.append((name, replacement))
-    return replacements
-
-
-def _get_expression_replacements(name: str, obj: Json) -> list[tuple[str, str]]:
-    return _get_replacements(name, obj, to_expression)
-
-
-def _get_full_expression_replacements(name: str, obj: Json) -> list[tuple[str, Json]]:
-    return _get_replacements(name, obj, lambda x: x)
-
-
 def replace_jobs_references(input_: dict[str, Json]) -> dict[str, Json]:
     """Return the workflow with any jobs refenrences replace with needs.
 
@@ -158,8 +186,13 @@ def replace_jobs_references(input_: dict[str, Json]) -> dict[str, Json]:
     for job_key in jobs:
         job = to_json_object(jobs[job_key], f"jobs.{job_key}")
 
-        needs = to_json_array_of_strings(job.get("needs", []), f"jobs.{job_key}.needs")
-        new_needs: list[Json] = [_replace_job_reference(need) for need in needs]
+        needs = to_json_array(job.get("needs", []), f"jobs.{job_key}.needs")
+        new_needs: list[Json] = [
+            {**need, "job": _replace_job_reference(to_string(need["job"], "job"))}
+            if is_json_object(need)
+            else _replace_job_reference(to_string(need, f"jobs.{job_key}.needs"))
+            for need in needs
+        ]
 
         new_job = replace_identifiers(job, [("jobs", "needs")])
 
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import json
+from collections.abc import Mapping
+from dataclasses import dataclass
+from pathlib import Path
+
+from ._common import INIT_JOB_ID, JobDetails, format_seconds
+from ._validation import Json, to_json_object
+
+# Below this is rounding error rather than a job that can be delayed
+_EPSILON = 1e-6
+
+
+@dataclass(frozen=True, slots=True)
+class Schedule:
+    """When each job runs if every job starts as soon as its needs are done"""
+
+    start: dict[str, float]
+    finish: dict[str, float]
+    slack: dict[str, float]
+    critical_path: list[str]
+
+    @property
+    def wall_time(self) -> float:
+        """The expected time for the whole workflow"""
+        return max(self.finish.values(), default=0.0)
+
+    def is_critical(self, job_name: str) -> bool:
+        """Returns whether delaying this job would delay the workflow"""
+        return self.slack[job_name] < _EPSILON
+
+
+def load_durations(path: Path) -> dict[str, float]:
+    """Load a JSON object of job name to duration in seconds"""
+    with path.open() as file:
+        durations: Json = json.load(file)
+    durations = to_json_object(durations, f"{path}")
+
+    result = dict[str, float]()
+    for job_name, duration in durations.items():
+        if not isinstance(duration, (int, float)) or isinstance(duration, bool):
+            raise TypeError(f"Expected a number at '{path}:{job_name}'")
+        result[job_name] = float(duration)
+    return result
+
+
+def schedule(
+    jobs: Mapping[str, JobDetails], durations: Mapping[str, float]
+) -> Schedule:
+    """Return the schedule of the jobs after the init job
+
+    Jobs without a duration are assumed to take no time.
+    """
+    order = _topological_order(jobs)
+    needs = {
+        INIT_JOB_ID: list[str](),
+        **{name: [*_get_needs(jobs, name), INIT_JOB_ID] for name in order},
+    }
+    order = [INIT_JOB_ID, *order]
+
+    start = dict[str, float]()
+    finish = dict[str, float]()
+    for name in order:
+        start[name] = max((finish[need] for need in needs[name]), default=0.0)
+        finish[name] = start[name] + durations.get(name, 0.0)
+
+    wall_time = max(finish.values())
+    latest_finish = {name: wall_time for name in order}
+    for name in reversed(order):
+        latest_start = latest_finish[name] - durations.get(name, 0.0)
+        for need in needs[name]:
+            latest_finish[need] = min(latest_finish[need], latest_start)
+
+    slack = {name: latest_finish[name] - finish[name] for name in order}
+
+    # Walk back from the last job through the needs that finish just in time
+    critical_path = list[str]()
+    current: str | None = max(order, key=lambda name: (finish[name], order.index(name)))
+    while current is not None:
+        critical_path.append(current)
+        current = next(
+            (
+                need
+                for need in needs[current]
+                if abs(finish[need] - start[current]) < _EPSILON
+                and slack[need] < _EPSILON
+            ),
+            None,
+        )
+    critical_path.reverse()
+
+    return Schedule(
+        start=start, finish=finish, slack=slack, critical_path=critical_path
+    )
+
+
+def _topological_order(jobs: Mapping[str, JobDetails]) -> list[str]:
+    order = list[str]()
+    visiting = set[str]()
+
+    def add(name: str):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"needs has a cycle through {name}")
+        visiting.add(name)
+        for need in _get_needs(jobs, name):
+            add(need)
+        order.append(name)
+
+    for name in jobs:
+        add(name)
+
+    return order
+
+
+def _get_needs(jobs: Mapping[str, JobDetails], name: str) -> list[str]:
+    # Jobs without steps take no time so only the normal jobs matter
+    return [need for need in jobs[name].needs if need in jobs]
+
+
+def format_schedule(schedule_: Schedule) -> str:
+    """Return a human readable report of the critical path and slack"""
+    width = max(len(name) for name in schedule_.start)
+    lines = [
+        f"Expected wall time: {format_seconds(schedule_.wall_time)}",
+        "",
+        "Critical path:",
+        *(
+            f"  {name:<{width}}  {format_seconds(schedule_.start[name])}"
+            f" -> {format_seconds(schedule_.finish[name])}"
+            for name in schedule_.critical_path
+        ),
+        "",
+        "Slack:",
+        *(
+            f"  {name:<{width}}  {format_seconds(slack)}"
+            for name, slack in sorted(
+                schedule_.slack.items(), key=lambda item: (item[1], item[0])
+            )
+            if name not in schedule_.critical_path
+        ),
+    ]
+    return "\n".join(lines)
@@ -0,0 +1,476 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from collections.abc import Mapping
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+
+import ruamel.yaml
+
+from ._expressions import get_full_expression_or_none
+from ._validation import Json
+
+
+@dataclass(frozen=True, slots=True)
+class Problem:
+    """Something wrong in a CI++ file, at a 1-based line and column if known"""
+
+    file: str
+    line: int | None
+    column: int | None
+    location: str
+    message: str
+
+    def __str__(self) -> str:
+        if self.line is None:
+            return f"{self.file}: {self.message}"
+        return f"{self.file}:{self.line}:{self.column}: {self.message}"
+
+
+class InvalidWorkflowError(ValueError):
+    """Raised with every problem found in a CI++ file"""
+
+    def __init__(self, problems: list[Problem]):
+        super().__init__("\n".join(str(problem) for problem in problems))
+        self.problems = problems
+
+
+@dataclass(slots=True)
+class _Context:
+    file: str
+    # Once cixx-uses, for-each and matrices are substituted, expressions are left
+    # only where GitHub Actions evaluates them
+    expanded: bool = False
+    problems: list[Problem] = field(default_factory=list)
+
+    def add(self, mark: tuple[int, int] | None, location: str, message: str):
+        if self.expanded:
+            # Substituted values keep the marks of the file they came from
+            mark = None
+        line, column = (mark[0] + 1, mark[1] + 1) if mark is not None else (None, None)
+        self.problems.append(Problem(self.file, line, column, location, message))
+
+    def allows_expression(self, value: Json, runtime: bool = False) -> bool:
+        """Checks if an expression stands for a value that isn't known yet
+
+        Args:
+            value: The value instead of the expected one
+            runtime: If GitHub Actions evaluates it, rather than the compiler
+        """
+        return _is_expression(value) and (runtime or not self.expanded)
+
+
+class _Schema(ABC):
+    # The Python types of the values this accepts, to choose between _OneOf options
+    kinds: tuple[type, ...]
+
+    @abstractmethod
+    def describe(self) -> str:
+        """Returns what the value should be, e.g. a string"""
+
+    @abstractmethod
+    def check(
+        self,
+        value: Json,
+        location: str,
+        mark: tuple[int, int] | None,
+        context: _Context,
+    ):
+        """Adds the problems of the value at location to the context"""
+
+
+@dataclass(frozen=True, slots=True)
+class _Any(_Schema):
+    kinds: tuple[type, ...] = (object,)
+
+    def describe(self) -> str:
+        return "anything"
+
+    def check(self, value, location, mark, context):
+        pass
+
+
+@dataclass(frozen=True, slots=True)
+class _Scalar(_Schema):
+    kinds: tuple[type, ...]
+    name: str
+    choices: tuple[str, ...] = ()
+    minimum: int | None = None
+    runtime: bool = False
+
+    def describe(self) -> str:
+        return self.name
+
+    def check(self, value, location, mark, context):
+        if not _is_kind(value, self.kinds):
+            if not context.allows_expression(value, self.runtime):
+                context.add(mark, location, _expected(self, value, location))
+        elif self.choices and value not in self.choices:
+            context.add(
+                mark,
+                location,
+                f"Expected one of {', '.join(self.choices)} at '{location}'"
+                f" but found {value}",
+            )
+        elif self.minimum is not None and value < self.minimum:  # type: ignore
+            context.add(
+                mark,
+                location,
+                f"Expected at least {self.minimum} at '{location}' but found {value}",
+            )
+
+
+@dataclass(frozen=True, slots=True)
+class _Array(_Schema):
+    items: _Schema
+    # Arrays in the array are flattened, like steps from YAML references
+    nested: bool = False
+    kinds: tuple[type, ...] = (list,)
+
+    def describe(self) -> str:
+        return "an array"
+
+    def check(self, value, location, mark, context):
+        if not isinstance(value, list):
+            if not context.allows_expression(value):
+                context.add(mark, location, _expected(self, value, location))
+            return
+        for i, item in enumerate(value):
+            item_location = f"{location}[{i}]"
+            item_mark = _item_mark(value, i, mark)
+            if self.nested and isinstance(item, list):
+                self.check(item, item_location, item_mark, context)
+            else:
+                self.items.check(item, item_location, item_mark, context)
+
+
+@dataclass(frozen=True, slots=True)
+class _Object(_Schema):
+    properties: Mapping[str, _Schema]
+    required: tuple[str, ...] = ()
+    # The required properties aren't if this one is there
+    required_unless: str | None = None
+    # Nor if there are only these, e.g. the needs of a pseudo job
+    required_unless_only: tuple[str, ...] = ()
+    # At least one of these is required
+    required_any: tuple[str, ...] = ()
+    # The schema of properties not listed, or None if they aren't allowed
+    additional: _Schema | None = None
+    # Prefixes of properties that are allowed and not checked
+    ignored_prefixes: tuple[str, ...] = ()
+    runtime: bool = False
+    kinds: tuple[type, ...] = (dict,)
+
+    def describe(self) -> str:
+        return "an object"
+
+    def check(self, value, location, mark, context):
+        if not isinstance(value, dict):
+            if not context.allows_expression(value, self.runtime):
+                context.add(mark, location, _expected(self, value, location))
+            return
+        prefix = f"{location}." if location else ""
+        for key, item in value.items():
+            key_location = f"{prefix}{key}"
+            schema = self.properties.get(key, self.additional)
+            if schema is None:
+                if not (
+                    self.ignored_prefixes and str(key).startswith(self.ignored_prefixes)
+                ):
+                    context.add(
+                        _key_mark(value, key, mark),
+                        key_location,
+                        f"Unknown property '{key_location}'",
+                    )
+                continue
+            schema.check(item, key_location, _value_mark(value, key, mark), context)
+        required = self.required
+        if self.required_unless in value or (
+            self.required_unless_only
+            and all(key in self.required_unless_only for key in value)
+        ):
+            required = ()
+        for key in required:
+            if key not in value:
+                context.add(mark, location, f"Missing property '{prefix}{key}'")
+        if self.required_any and not any(key in value for key in self.required_any):
+            context.add(
+                mark,
+                location,
+                f"Expected {' or '.join(self.required_any)}"
+                f" at '{location or 'top level'}'",
+            )
+
+
+@dataclass(frozen=True, slots=True)
+class _OneOf(_Schema):
+    options: tuple[_Schema, ...]
+
+    @property
+    def kinds(self) -> tuple[type, ...]:  # type: ignore
+        return tuple(kind for option in self.options for kind in option.kinds)
+
+    def describe(self) -> str:
+        return " or ".join(option.describe() for option in self.options)
+
+    def check(self, value, location, mark, context):
+        for option in self.options:
+            if _is_kind(value, option.kinds):
+                option.check(value, location, mark, context)
+                return
+        if not context.allows_expression(value):
+            context.add(mark, location, _expected(self, value, location))
+
+
+_STRING = _Scalar((str,), "a string")
+_BOOLEAN = _Scalar((bool,), "a boolean")
+_POSITIVE_INTEGER = _Scalar((int,), "an integer", minimum=1)
+_NUMBER = _Scalar((int, float), "a number")
+_STRINGS = _Array(_STRING)
+_MAP = _Object({}, additional=_Any())
+# Evaluated by GitHub Actions, so still an expression once expanded
+_RUNTIME_MAP = _Object({}, additional=_Any(), runtime=True)
+_CONDITION = _OneOf((_STRING, _BOOLEAN))
+
+_CACHE = _Object({"paths": _STRINGS, "key-files": _STRINGS}, required=("paths",))
+
+_STEP = _Object(
+    {
+        "id": _STRING,
+        "name": _STRING,
+        "if": _CONDITION,
+        "uses": _STRING,
+        "run": _STRING,
+        "shell": _STRING,
+        "with": _RUNTIME_MAP,
+        "env": _RUNTIME_MAP,
+        "working-directory": _STRING,
+        "continue-on-error": _Scalar((bool,), "a boolean", runtime=True),
+        "timeout-minutes": _Scalar((int, float), "a number", runtime=True),
+        # Step caching
+        "paths": _STRINGS,
+        "output-paths": _STRINGS,
+    },
+    required_any=("run", "uses"),
+)
+
+_NEED = _OneOf(
+    (_STRING, _Object({"job": _STRING, "paths": _STRINGS}, required=("job",)))
+)
+
+_MATRIX = _Object(
+    {"include": _Array(_MAP), "exclude": _Array(_MAP)},
+    additional=_Array(_Any()),
+)
+
+_JOB = _Object(
+    {
+        "runs-on": _STRING,
+        "critical-runs-on": _STRING,
+        "needs": _Array(_NEED),
+        "if": _CONDITION,
+        # Steps can be run strings and nested arrays of steps
+        "steps": _Array(_OneOf((_STRING, _STEP)), nested=True),
+        "outputs": _MAP,
+        "paths": _STRINGS,
+        "output-paths": _OneOf((_STRINGS, _Object({}, additional=_STRINGS))),
+        "incremental-paths": _STRINGS,
+        "extra-key": _STRING,
+        "force": _BOOLEAN,
+        "coalesce": _BOOLEAN,
+        "lfs": _BOOLEAN,
+        "submodules": _OneOf((_BOOLEAN, _STRINGS)),
+        "sparse-checkout": _Scalar((str,), "a string", choices=("cone", "precise")),
+        "cache": _Array(_CACHE),
+        "cache-failures": _BOOLEAN,
+        "failure-log": _BOOLEAN,
+        "restore-concurrency": _POSITIVE_INTEGER,
+        "strategy": _Object({"matrix": _MATRIX}, required=("matrix",)),
+        "for-each": _OneOf((_STRING, _STRINGS)),
+        "shards": _POSITIVE_INTEGER,
+        "shard-paths": _STRINGS,
+        "cixx-uses": _STRING,
+        "with": _MAP,
+    },
+    required=("runs-on", "steps"),
+    required_unless="cixx-uses",
+    # Jobs with only needs are pseudo jobs, without steps of their own
+    required_unless_only=("needs",),
+)
+
+_WORKFLOW = _Object(
+    {
+        "on": _Object(
+            {"cixx_call": _Object({"inputs": _MAP, "outputs": _MAP})},
+            additional=_Any(),
+        ),
+        "jobs": _Object({}, additional=_JOB),
+        "cache": _Array(_CACHE),
+        "cache-backend": _Object(
+            {"directory": _STRING, "url": _STRING, "token": _STRING},
+            required_any=("directory", "url"),
+        ),
+        "concurrency": _Any(),
+    },
+    required=("on", "jobs"),
+    # YAML references
+    ignored_prefixes=("x-",),
+)
+
+# Each cell of a strategy.matrix is a job with the cell as its matrix
+_EXPANDED_JOB = replace(_JOB, properties={**_JOB.properties, "matrix": _MAP})
+_EXPANDED_WORKFLOW = replace(
+    _WORKFLOW,
+    properties={**_WORKFLOW.properties, "jobs": _Object({}, additional=_EXPANDED_JOB)},
+)
+
+
+def validate(workflow: Json, file: str, expanded: bool = False) -> list[Problem]:
+    """Returns the problems of a CI++ file in one pass over it
+
+    As written, a `${{ }}` expression is accepted for any value, since the
+    inputs of cixx-uses, the each of for-each or the matrix of strategy can put
+    a value of any type in its place. So the workflow is checked again once
+    those are substituted, after which only the values the compiler adds itself
+    need checking.
+
+    Args:
+        workflow: The file as loaded by ruamel.yaml, its marks give the lines
+        file: The name of the file for the problems
+        expanded: If cixx-uses, for-each and matrices are expanded
+    """
+    context = _Context(file, expanded)
+    (_EXPANDED_WORKFLOW if expanded else _WORKFLOW).check(workflow, "", None, context)
+    return context.problems
+
+
+def load(text: str, file: str) -> tuple[Json, list[Problem]]:
+    """Returns a CI++ file loaded with its marks, or the problem if it isn't YAML"""
+    try:
+        return ruamel.yaml.YAML().load(text), []
+    except ruamel.yaml.YAMLError as error:
+        problem_mark = getattr(error, "problem_mark", None)
+        mark = (problem_mark.line, problem_mark.column) if problem_mark else None
+        context = _Context(file)
+        context.add(mark, "", str(getattr(error, "problem", None) or error))
+        return None, context.problems
+
+
+def check(input_file: Path) -> list[Problem]:
+    """Returns the problems of a CI++ file and the files it cixx-uses"""
+    problems = list[Problem]()
+    pending = [input_file]
+    seen = set[Path]()
+    while pending:
+        file = pending.pop(0)
+        if file.resolve() in seen:
+            continue
+        seen.add(file.resolve())
+
+        try:
+            text = file.read_text(encoding="utf-8")
+        except OSError as error:
+            problems.append(Problem(str(file), None, None, "", error.strerror))
+            continue
+        workflow, load_problems = load(text, str(file))
+        if load_problems:
+            problems.extend(load_problems)
+            continue
+
+        problems.extend(validate(workflow, str(file)))
+        uses, uses_problems = get_uses(workflow, file)
+        problems.extend(uses_problems)
+        pending.extend(uses.values())
+    return problems
+
+
+def get_uses(workflow: Json, file: Path) -> tuple[dict[str, Path], list[Problem]]:
+    """Returns the file each job of a CI++ file cixx-uses, and any missing files"""
+    uses = dict[str, Path]()
+    context = _Context(str(file))
+    jobs = workflow.get("jobs") if isinstance(workflow, dict) else None
+    for key, job in jobs.items() if isinstance(jobs, dict) else []:
+        used = job.get("cixx-uses") if isinstance(job, dict) else None
+        if not isinstance(used, str) or _is_expression(used):
+            continue
+        if (file.parent / used).is_file():
+            uses[key] = file.parent / used
+        else:
+            context.add(
+                _value_mark(job, "cixx-uses", None),  # type: ignore
+                f"jobs.{key}.cixx-uses",
+                f"No such file {used} at 'jobs.{key}.cixx-uses'",
+            )
+    return uses, context.problems
+
+
+def _is_kind(value: Json, kinds: tuple[type, ...]) -> bool:
+    # bool is an int in Python but not in YAML
+    if isinstance(value, bool) and bool not in kinds and object not in kinds:
+        return False
+    return isinstance(value, kinds)
+
+
+def _is_expression(value: Json) -> bool:
+    """Checks if a value is a whole `${{ }}` expression"""
+    return isinstance(value, str) and get_full_expression_or_none(value) is not None
+
+
+def _expected(schema: _Schema, value: Json, location: str) -> str:
+    return (
+        f"Expected {schema.describe()} at '{location or 'top level'}'"
+        f" but found {_describe_value(value)}"
+    )
+
+
+def _describe_value(value: Json) -> str:
+    match value:
+        case None:
+            return "null"
+        case bool():
+            return "a boolean"
+        case int() | float():
+            return "a number"
+        case str():
+            return "a string"
+        case list():
+            return "an array"
+        case _:
+            return "an object"
+
+
+def _key_mark(
+    mapping: dict[str, Json], key: str, default: tuple[int, int] | None
+) -> tuple[int, int] | None:
+    return get_mark(mapping, "key", key) or default
+
+
+def _value_mark(
+    mapping: dict[str, Json], key: str, default: tuple[int, int] | None
+) -> tuple[int, int] | None:
+    return get_mark(mapping, "value", key) or default
+
+
+def _item_mark(
+    sequence: list[Json], index: int, default: tuple[int, int] | None
+) -> tuple[int, int] | None:
+    return get_mark(sequence, "item", index) or default
+
+
+def get_mark(node: object, kind: str, key: str | int) -> tuple[int, int] | None:
+    """Returns the 0-based line and column ruamel.yaml kept for a key or item
+
+    Args:
+        node: A mapping or sequence as loaded
+        kind: key or value of a mapping, item of a sequence
+        key: The key or index
+
+    Returns:
+        The mark, or None for nodes created after loading and keys from `<<`
+        merges
+    """
+    try:
+        line, column = getattr(node.lc, kind)(key)  # type: ignore
+        return line, column
+    except (AttributeError, KeyError, IndexError, TypeError):
+        return None
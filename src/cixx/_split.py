@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import json
+import re
+from collections import Counter
+from collections.abc import Mapping
+from pathlib import PurePosixPath
+from typing import cast
+
+from . import _github_actions as gh
+from ._common import FORCE_RERUN_INPUT, INIT_JOB_ID, Helpers, helper_id
+from ._expressions import (
+    fold_condition,
+    get_full_expression_or_none,
+    replace_identiers_in_template_str,
+)
+from ._validation import Json, is_json_object
+from ._yaml import dumps
+
+# Shorter scripts aren't worth a step of the composite action
+_HELPER_MIN_BYTES = 256
+
+# Child workflows get the outputs of the init job as one JSON input
+_INIT_REPLACEMENTS = [
+    (f"needs.{INIT_JOB_ID}.outputs", f"fromJSON(inputs.{INIT_JOB_ID})"),
+    # The caller only runs if the init job succeeded
+    (f"needs.{INIT_JOB_ID}.result", "'success'"),
+]
+
+
+def find_helpers(workflow: gh.Workflow) -> dict[str, gh.Step]:
+    """Returns the scripts run by several steps, by helper_id
+
+    Scripts with expressions are left in the jobs because a composite action
+    can't see the contexts of the job.
+    """
+    counts = Counter[str]()
+    helpers = dict[str, gh.Step]()
+    for job in workflow["jobs"].values():
+        for step in job.get("steps", []):
+            if (
+                "run" not in step
+                or "shell" not in step
+                or "working-directory" in step
+                or "${{" in step["run"]
+                or len(step["run"].encode()) < _HELPER_MIN_BYTES
+            ):
+                continue
+            id_ = helper_id(step)
+            counts[id_] += 1
+            helpers[id_] = {"shell": step["shell"], "run": step["run"]}
+    return {id_: step for id_, step in helpers.items() if counts[id_] > 1}
+
+
+def get_helpers_action(
+    workflows: Mapping[str, gh.Workflow], helpers: Helpers, workflow_name: str
+) -> dict[str, Json] | None:
+    """Returns the composite action running the helpers the workflows use
+
+    Args:
+        workflows: The workflow and any child workflows
+        helpers: The helpers the workflows were compiled with
+        workflow_name: The file name of the workflow, for the description
+
+    Returns:
+        The action, or None if no step uses it
+    """
+    used = dict[str, None]()
+    outputs = dict[str, set[str]]()
+    for workflow in workflows.values():
+        for job in workflow["jobs"].values():
+            step_helpers = {
+                step["id"]: step["with"]["helper"]
+                for step in job.get("steps", [])
+                if step.get("uses") == f"./{helpers.action}" and "id" in step
+            }
+            used.update(
+                (step["with"]["helper"], None)
+                for step in job.get("steps", [])
+                if step.get("uses") == f"./{helpers.action}"
+            )
+            for step_id, output in re.findall(
+                r"steps\.([\w-]+)\.outputs\.([\w-]+)", json.dumps(job)
+            ):
+                if step_id in step_helpers:
+                    outputs.setdefault(output, set()).add(step_helpers[step_id])
+    if not used:
+        return None
+
+    action: dict[str, Json] = {
+        "name": f"CI++ helpers of {workflow_name}",
+        "description": f"Steps shared by the jobs of {workflow_name}, generated by CI++",
+        "inputs": {
+            "helper": {"description": "The ID of the step to run", "required": True}
+        },
+    }
+    if outputs:
+        action["outputs"] = {
+            output: {
+                "description": f"The {output} output of the step",
+                # Only the step of the chosen helper runs
+                "value": "${{ "
+                + " || ".join(f"steps.{id_}.outputs.{output}" for id_ in sorted(ids))
+                + " }}",
+            }
+            for output, ids in sorted(outputs.items())
+        }
+    action["runs"] = {
+        "using": "composite",
+        "steps": [
+            {"if": f"inputs.helper == '{id_}'", "id": id_, **helpers.steps[id_]}
+            for id_ in used
+        ],
+    }
+    return action
+
+
+def split(
+    workflow: gh.Workflow, workflow_name: str, max_bytes: int
+) -> dict[str, gh.Workflow]:
+    """Splits a workflow larger than max_bytes into child workflows it calls
+
+    The jobs are split along the weakly connected parts of the graph of their
+    needs, apart from the init job that stays in the workflow. Parts are packed
+    into as few child workflows of at most max_bytes as fit, a part that is
+    larger on its own is still kept in one child workflow.
+
+    Args:
+        workflow: The compiled workflow
+        workflow_name: Its file name, the children are `<stem>-<n>.yml` next to it
+        max_bytes: The most bytes of YAML in each file
+
+    Returns:
+        The workflow and its children by file name
+    """
+    if len(dumps(workflow).encode()) <= max_bytes:
+        return {workflow_name: workflow}
+
+    jobs = {name: job for name, job in workflow["jobs"].items() if name != INIT_JOB_ID}
+    job_bytes = {
+        name: len(dumps({"jobs": {name: job}}).encode()) - len("jobs:\n")
+        for name, job in jobs.items()
+    }
+    budget = max_bytes - len(dumps(_get_child_workflow({})).encode())
+
+    # First fit decreasing, a new part when none has room
+    parts = list[list[str]]()
+    free = list[int]()
+    components = _get_components(jobs)
+    for component in sorted(
+        components, key=lambda names: -sum(job_bytes[name] for name in names)
+    ):
+        size = sum(job_bytes[name] for name in component)
+        for i, room in enumerate(free):
+            if size <= room:
+                parts[i].extend(component)
+                free[i] -= size
+                break
+        else:
+            parts.append(list(component))
+            free.append(budget - size)
+
+    order = list(jobs)
+    parts = sorted(
+        (sorted(part, key=order.index) for part in parts),
+        key=lambda part: order.index(part[0]),
+    )
+
+    path = PurePosixPath(workflow_name)
+    out = dict[str, gh.Workflow]()
+    callers = dict[str, gh.Job]()
+    for i, part in enumerate(parts, 1):
+        child_name = f"{path.stem}-{i}{path.suffix}"
+        child_jobs = {name: _get_child_job(jobs[name]) for name in part}
+        with_ = {INIT_JOB_ID: "${{ " f"toJSON(needs.{INIT_JOB_ID}.outputs)" " }}"}
+        # Passed on from the workflow_dispatch input, false for other events
+        forwarded = f"inputs.{FORCE_RERUN_INPUT}" in json.dumps(child_jobs)
+        if forwarded:
+            with_[FORCE_RERUN_INPUT] = (
+                "${{ " f"inputs.{FORCE_RERUN_INPUT} == true" " }}"
+            )
+        out[child_name] = _get_child_workflow(child_jobs, forwarded)
+        callers[f"cixx-part-{i}"] = {
+            "needs": [INIT_JOB_ID],
+            "uses": f"./.github/workflows/{child_name}",
+            "with": with_,
+            "secrets": "inherit",
+        }
+    return {
+        workflow_name: {
+            **workflow,
+            "jobs": {INIT_JOB_ID: workflow["jobs"][INIT_JOB_ID], **callers},
+        },
+        **out,
+    }
+
+
+def get_children(workflow: Json, workflow_name: str) -> list[str]:
+    """Returns the file names of the child workflows a split workflow calls"""
+    path = PurePosixPath(workflow_name)
+    child = re.compile(
+        rf"\./\.github/workflows/({re.escape(path.stem)}-\d+{re.escape(path.suffix)})"
+    )
+    jobs = workflow.get("jobs") if is_json_object(workflow) else None
+    return [
+        match[1]
+        for job in (jobs.values() if is_json_object(jobs) else [])
+        if is_json_object(job)
+        and isinstance(uses := job.get("uses"), str)
+        and (match := child.fullmatch(uses))
+    ]
+
+
+def format_sizes(files: Mapping[str, Json]) -> str:
+    """Returns the size of each emitted file, and its number of jobs"""
+    width = max(len(name) for name in files)
+    lines = list[str]()
+    for name, data in files.items():
+        line = f"{name:<{width}}  {len(dumps(data).encode()):>8} bytes"
+        if isinstance(data, dict) and isinstance(data.get("jobs"), dict):
+            count = len(data["jobs"])  # type: ignore
+            line += f"  {count} job{'' if count == 1 else 's'}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _get_components(jobs: Mapping[str, gh.Job]) -> list[list[str]]:
+    """Returns the sets of jobs connected by needs, ignoring their direction"""
+    neighbours = {name: set[str]() for name in jobs}
+    for name, job in jobs.items():
+        for need in job.get("needs", []):
+            if need in neighbours:
+                neighbours[name].add(need)
+                neighbours[need].add(name)
+
+    components = list[list[str]]()
+    seen = set[str]()
+    for name in jobs:
+        if name in seen:
+            continue
+        component = list[str]()
+        pending = [name]
+        seen.add(name)
+        while pending:
+            current = pending.pop()
+            component.append(current)
+            for neighbour in sorted(neighbours[current] - seen):
+                seen.add(neighbour)
+                pending.append(neighbour)
+        components.append(component)
+    return components
+
+
+def _get_child_workflow(
+    jobs: dict[str, gh.Job], force_rerun_input: bool = False
+) -> gh.Workflow:
+    inputs: dict[str, Json] = {INIT_JOB_ID: {"type": "string", "required": True}}
+    if force_rerun_input:
+        inputs[FORCE_RERUN_INPUT] = {"type": "boolean", "default": False}
+    return {"on": {"workflow_call": {"inputs": inputs}}, "jobs": jobs}
+
+
+def _get_child_job(job: gh.Job) -> gh.Job:
+    """Returns the job reading the init job's outputs from the workflow input"""
+    child = cast(gh.Job, _replace_init_references(job))  # type: ignore
+    needs = [need for need in child.get("needs", []) if need != INIT_JOB_ID]
+    if needs:
+        child["needs"] = needs
+    else:
+        child.pop("needs", None)
+    return child
+
+
+def _replace_init_references(obj: Json) -> Json:
+    match obj:
+        case str():
+            replaced = replace_identiers_in_template_str(obj, _INIT_REPLACEMENTS)
+            # Keeps multiline strings literal
+            return obj if replaced is obj else type(obj)(replaced)
+        case dict():
+            new = dict[str, Json]()
+            for key, value in obj.items():
+                if key == "if" and isinstance(value, str):
+                    expression = get_full_expression_or_none(value) or value
+                    replaced = replace_identiers_in_template_str(
+                        f"${{{{ {expression} }}}}", _INIT_REPLACEMENTS
+                    )
+                    condition = fold_condition(replaced)
+                    if condition is not True:
+                        new[key] = condition
+                else:
+                    new[key] = _replace_init_references(value)
+            return new
+        case list():
+            return [_replace_init_references(element) for element in obj]
+        case _:
+            return obj
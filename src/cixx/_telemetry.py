@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import json
+import shlex
+from collections import defaultdict
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from . import _github_actions as gh
+from ._common import INIT_JOB_ID, format_seconds
+from ._expressions import to_json_template
+from ._validation import Json, to_json_object
+from ._yaml import multiline
+
+VERSION = 1
+
+# Each line is `<mark> <unix time> <kilobytes or ->`, appended by the mark steps
+_MARKS_FILE = '"$RUNNER_TEMP/cixx-telemetry-marks"'
+
+START_MARK = "start"
+CLONED_MARK = "cloned"
+RESTORED_MARK = "restored"
+END_MARK = "end"
+
+
+def ran_mark(job_name: str) -> str:
+    """Returns the mark after a job's own steps, before committing it"""
+    return f"ran-{job_name}"
+
+
+def saved_mark(job_name: str) -> str:
+    """Returns the mark after a job is committed"""
+    return f"saved-{job_name}"
+
+
+def record_file(github_job: str) -> str:
+    """Returns the filename of the telemetry record of a GitHub job"""
+    return f"cixx-telemetry-{github_job}.json"
+
+
+def get_mark_step(mark: str, paths: Sequence[str] = ()) -> gh.Step:
+    """Returns a step recording the time, and the size of the paths if any
+
+    Marks run even after a failure so the record shows how far the job got.
+    """
+    if paths:
+        size = f"$(du -skc -- {' '.join(_shell_path(path) for path in paths)}"
+        size += " 2>/dev/null | tail -n 1 | cut -f 1)"
+    else:
+        size = "-"
+    return {
+        "if": "always()",
+        "name": f"Mark {mark}",
+        "shell": "bash",
+        "run": f'echo "{mark} $(date +%s) {size}" >> {_MARKS_FILE}',
+    }
+
+
+def _shell_path(path: str) -> str:
+    """Quotes a path for bash, leaving globs and `~/` to be expanded"""
+    if path.startswith("~/"):
+        return f'"$HOME"/{_shell_path(path[2:])}' if path[2:] else '"$HOME"'
+    if any(char in path for char in "*?["):
+        return path
+    return shlex.quote(path)
+
+
+def get_record_steps(github_job: str, record: Mapping[str, Json]) -> list[gh.Step]:
+    """Returns steps writing the job's record to the summary and an artifact
+
+    Args:
+        github_job: The ID of the GitHub job
+        record: Fields of the record, template strings are evaluated by GitHub
+
+    Returns:
+        The steps, they run even after a failure
+    """
+    fields = to_json_template(
+        {
+            "version": VERSION,
+            "job": github_job,
+            "run_id": "${{ github.run_id }}",
+            "run_attempt": "${{ github.run_attempt }}",
+            "sha": "${{ github.sha }}",
+            "status": "${{ job.status }}",
+            **record,
+        }
+    )
+    file = f'"$RUNNER_TEMP/cixx-telemetry/{record_file(github_job)}"'
+    return [
+        {
+            "if": "always()",
+            "name": "Record telemetry",
+            "shell": "bash",
+            "run": multiline(
+                f"""\
+echo "{END_MARK} $(date +%s) -" >> {_MARKS_FILE}
+mkdir -p "$RUNNER_TEMP/cixx-telemetry"
+{{
+    echo -n '{{"marks":['
+    awk '{{
+        printf "%s{{\\"name\\":\\"%s\\",\\"time\\":%s,\\"kilobytes\\":%s}}", \\
+            (NR > 1 ? "," : ""), $1, $2, ($3 == "-" ? "null" : $3)
+    }}' {_MARKS_FILE}
+    echo -n '],'
+    cat <<'EOF'
+{fields[1:]}
+EOF
+}} > {file}
+{{
+    echo '### CI++ telemetry'
+    echo '```json'
+    cat {file}
+    echo '```'
+}} >> "$GITHUB_STEP_SUMMARY"
+"""
+            ),
+        },
+        {
+            "if": "always()",
+            "name": "Upload telemetry",
+            "uses": "actions/upload-artifact@v4",
+            "with": {
+                "name": record_file(github_job).removesuffix(".json"),
+                "path": "${{ runner.temp }}/cixx-telemetry/" + record_file(github_job),
+            },
+        },
+    ]
+
+
+@dataclass(slots=True)
+class _JobStats:
+    checks: int = 0
+    hits: int = 0
+    builds: list[float] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class _RunStats:
+    checks: int = 0
+    hits: int = 0
+    seconds: float = 0
+
+
+def load_records(directory: Path) -> list[dict[str, Json]]:
+    """Returns the telemetry records in a directory, e.g. downloaded artifacts
+
+    Raises:
+        ValueError: if a record is from a newer version of CI++
+    """
+    records = list[dict[str, Json]]()
+    for path in sorted(directory.rglob("cixx-telemetry-*.json")):
+        record = to_json_object(json.loads(path.read_text()), str(path))
+        if not isinstance(record.get("version"), int) or record["version"] > VERSION:
+            raise ValueError(f"{path}: unsupported version {record.get('version')}")
+        records.append(record)
+    return records
+
+
+def format_report(records: Sequence[Mapping[str, Json]], last_runs: int = 10) -> str:
+    """Returns hit rates, time saved, the most invalidated jobs and recent runs
+
+    The time a hit saved is estimated by the mean duration of the job in the
+    runs where it was built.
+    """
+    jobs = defaultdict[str, _JobStats](_JobStats)
+    runs = defaultdict[tuple[int, int], _RunStats](_RunStats)
+    phases = dict.fromkeys(["clone", "restore", "build", "save"], 0.0)
+    restored_kilobytes = saved_kilobytes = 0
+
+    for record in records:
+        run = runs[(int(str(record["run_id"])), int(str(record["run_attempt"])))]
+        marks = _get_marks(record)
+        times = {name: time for name, time, _ in marks}
+        if END_MARK in times and START_MARK in times:
+            run.seconds += times[END_MARK] - times[START_MARK]
+
+        if record["job"] == INIT_JOB_ID:
+            for name, check in to_json_object(record["checks"], "checks").items():
+                hit = to_json_object(check, f"checks.{name}")["hit"] is True
+                jobs[name].checks += 1
+                jobs[name].hits += hit
+                run.checks += 1
+                run.hits += hit
+            continue
+
+        for name, _, kilobytes in marks:
+            if name == RESTORED_MARK:
+                restored_kilobytes += kilobytes or 0
+            elif name.startswith(saved_mark("")):
+                saved_kilobytes += kilobytes or 0
+        if CLONED_MARK in times and START_MARK in times:
+            phases["clone"] += times[CLONED_MARK] - times[START_MARK]
+        if RESTORED_MARK in times and CLONED_MARK in times:
+            phases["restore"] += times[RESTORED_MARK] - times[CLONED_MARK]
+
+        job_names = list(to_json_object(record["jobs"], "jobs"))
+        overhead = times.get(RESTORED_MARK, 0) - times.get(START_MARK, 0)
+        names = [name for name, _, _ in marks]
+        for name in job_names:
+            if ran_mark(name) not in names:
+                continue  # Skipped
+            index = names.index(ran_mark(name))
+            ran = marks[index][1]
+            # From the previous mark, the restore or the previous job's commit
+            build = ran - marks[max(index - 1, 0)][1]
+            save = times.get(saved_mark(name), ran) - ran
+            phases["build"] += build
+            phases["save"] += save
+            jobs[name].builds.append(build + save + overhead / len(job_names))
+
+    checks = sum(stats.checks for stats in jobs.values())
+    hits = sum(stats.hits for stats in jobs.values())
+    saved_seconds = sum(
+        stats.hits * _mean(stats.builds) for stats in jobs.values() if stats.builds
+    )
+    lines = [
+        f"Runs: {len(runs)}, job checks: {checks}, hits: {hits}"
+        f" ({_percent(hits, checks)})",
+        f"Estimated time saved by hits: {format_seconds(saved_seconds)}",
+        "Time spent: "
+        + ", ".join(f"{phase} {format_seconds(s)}" for phase, s in phases.items()),
+        f"Restored {_format_kilobytes(restored_kilobytes)},"
+        f" committed {_format_kilobytes(saved_kilobytes)}",
+    ]
+
+    invalidated = sorted(
+        (
+            (stats.checks - stats.hits) * _mean(stats.builds),
+            name,
+            stats,
+        )
+        for name, stats in jobs.items()
+        if stats.checks > stats.hits
+    )[::-1]
+    if invalidated:
+        width = max(len(name) for _, name, _ in invalidated)
+        lines.extend(["", "Most invalidated jobs (misses x mean duration):"])
+        lines.extend(
+            f"  {name:<{width}}  missed {stats.checks - stats.hits}/{stats.checks}"
+            f"  mean {format_seconds(_mean(stats.builds))}"
+            f"  rebuilt {format_seconds(seconds)}"
+            for seconds, name, stats in invalidated[:10]
+        )
+
+    if runs:
+        lines.extend(["", "Recent runs:"])
+        lines.extend(
+            f"  {run_id}.{attempt}  hits {_percent(run.hits, run.checks):>6}"
+            f"  job time {format_seconds(run.seconds)}"
+            for (run_id, attempt), run in sorted(runs.items())[-last_runs:]
+        )
+    return "\n".join(lines)
+
+
+def _get_marks(record: Mapping[str, Json]) -> list[tuple[str, float, int | None]]:
+    marks = list[tuple[str, float, int | None]]()
+    for mark in record.get("marks") or []:
+        mark = to_json_object(mark, "marks")
+        kilobytes = mark.get("kilobytes")
+        marks.append(
+            (
+                str(mark["name"]),
+                float(mark["time"]),  # type: ignore
+                kilobytes if isinstance(kilobytes, int) else None,
+            )
+        )
+    return marks
+
+
+def _mean(values: Sequence[float]) -> float:
+    return sum(values) / len(values) if values else 0
+
+
+def _percent(part: int, whole: int) -> str:
+    return f"{part / whole:.0%}" if whole else "-"
+
+
+def _format_kilobytes(kilobytes: int) -> str:
+    if kilobytes < 1024:
+        return f"{kilobytes} KB"
+    if kilobytes < 1024**2:
+        return f"{kilobytes / 1024:.1f} MB"
+    return f"{kilobytes / 1024**2:.1f} GB"
@@ -1,4 +1,20 @@
-from ._validation import Json, is_json_array, to_json_array, to_json_object
+import itertools
+import json
+import re
+from pathlib import Path, PurePosixPath
+from posixpath import normpath
+
+from ._expressions import fold_condition, replace_identifiers, substitute_context
+from ._repository import glob_directories, read_submodules
+from ._validation import (
+    Json,
+    is_json_array,
+    is_json_object,
+    to_json_array,
+    to_json_array_of_strings,
+    to_json_object,
+    to_string,
+)
 
 
 def remove_x_properties(workflow: Json) -> dict[str, Json]:
@@ -45,3 +61,370 @@ def _flatten_array(array: list[Json]) -> list[Json]:
         for element in array
         for f in (_flatten_array(element) if is_json_array(element) else [element])
     ]
+
+
+def expand_matrices(workflow: Json) -> dict[str, Json]:
+    """Return the workflow with a job for each cell of any strategy.matrix
+
+    Every cell gets its own cache key, so only the cells whose inputs changed run.
+    The cell is kept as the job's matrix property and needs on the original job
+    are replaced with needs on all of its cells.
+    """
+    input_ = to_json_object(workflow, "top level")
+
+    jobs = to_json_object(input_["jobs"], "jobs")
+    new_jobs = dict[str, Json]()
+    fanned_out = dict[str, list[str]]()
+
+    for job_key in jobs:
+        job = to_json_object(jobs[job_key], f"jobs.{job_key}")
+        if "strategy" not in job:
+            new_jobs[job_key] = job
+            continue
+
+        strategy = to_json_object(job["strategy"], f"jobs.{job_key}.strategy")
+        if unsupported := set(strategy) - {"matrix"}:
+            raise ValueError(
+                f"jobs.{job_key}.strategy: unsupported {sorted(unsupported)},"
+                " each cell is a separate job"
+            )
+        cells = _get_matrix_cells(
+            to_json_object(strategy["matrix"], f"jobs.{job_key}.strategy.matrix"),
+            f"jobs.{job_key}.strategy.matrix",
+        )
+
+        job = {k: v for k, v in job.items() if k != "strategy"}
+        # Keys only in some cells are null in the others, like GitHub Actions
+        missing: dict[str, Json] = {key: None for cell in cells for key in cell}
+        names = list[str]()
+        for cell in cells:
+            name = _get_cell_job_name(job_key, cell, jobs, new_jobs)
+            names.append(name)
+            context: Json = {**missing, **cell}
+            new_jobs[name] = {
+                **substitute_context(job, "matrix", context),
+                "matrix": cell,
+            }
+        fanned_out[job_key] = names
+
+    return {**input_, "jobs": replace_fanned_out_needs(new_jobs, fanned_out)}
+
+
+def expand_for_each(workflow: Json, root: Path) -> dict[str, Json]:
+    """Return the workflow with a job for each directory matching a for-each glob
+
+    The each context has the path of the directory relative to root and its name.
+    paths defaults to the directory so each job has its own sparse checkout and
+    cache key. needs on the original job are replaced with needs on all of them.
+    """
+    input_ = to_json_object(workflow, "top level")
+
+    jobs = to_json_object(input_["jobs"], "jobs")
+    new_jobs = dict[str, Json]()
+    fanned_out = dict[str, list[str]]()
+
+    for job_key in jobs:
+        job = to_json_object(jobs[job_key], f"jobs.{job_key}")
+        if "for-each" not in job:
+            new_jobs[job_key] = job
+            continue
+
+        patterns = job["for-each"]
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        directories = [
+            directory
+            for pattern in to_json_array_of_strings(
+                patterns, f"jobs.{job_key}.for-each"
+            )
+            for directory in glob_directories(root, pattern)
+        ]
+        if not directories:
+            raise ValueError(f"jobs.{job_key}.for-each matches no directories")
+
+        job = {"paths": ["${{ each.path }}/"], **job}
+        del job["for-each"]
+        names = list[str]()
+        for directory in dict.fromkeys(directories):
+            each_name = PurePosixPath(directory).name
+            each: Json = {"path": directory, "name": each_name}
+            name = _get_unique_job_name(
+                f"{job_key}-{_to_job_name_part(each_name)}", jobs, new_jobs
+            )
+            names.append(name)
+            new_jobs[name] = substitute_context(job, "each", each)
+        fanned_out[job_key] = names
+
+    return {**input_, "jobs": replace_fanned_out_needs(new_jobs, fanned_out)}
+
+
+def expand_shards(workflow: Json) -> dict[str, Json]:
+    """Return the workflow with a job for each shard of any job with shards
+
+    The shard is kept as the job's shard property and needs on the original job
+    are replaced with needs on all of its shards.
+    """
+    input_ = to_json_object(workflow, "top level")
+
+    jobs = to_json_object(input_["jobs"], "jobs")
+    new_jobs = dict[str, Json]()
+    fanned_out = dict[str, list[str]]()
+
+    for job_key in jobs:
+        job = to_json_object(jobs[job_key], f"jobs.{job_key}")
+        if "shards" not in job:
+            new_jobs[job_key] = job
+            continue
+
+        count = job["shards"]
+        if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+            raise TypeError(f"Expected a positive integer at 'jobs.{job_key}.shards'")
+        if "outputs" in job:
+            raise ValueError(f"jobs.{job_key}: sharded jobs can't have outputs")
+
+        job = {k: v for k, v in job.items() if k != "shards"}
+        names = [f"{job_key}-shard-{index}" for index in range(count)]
+        for index, name in enumerate(names):
+            if name in jobs:
+                raise ValueError(f"jobs.{job_key}: shard {name} already exists")
+            new_jobs[name] = {**job, "shard": {"index": index, "count": count}}
+        fanned_out[job_key] = names
+
+    return {**input_, "jobs": replace_fanned_out_needs(new_jobs, fanned_out)}
+
+
+def expand_submodules(workflow: Json, root: Path) -> dict[str, Json]:
+    """Return the workflow with the submodules of each job listed from .gitmodules
+
+    `submodules: true` becomes the submodules under the job's paths, a list of
+    paths becomes those submodules, which are added to the paths. Each is an
+    object with the name and path of the submodule.
+    """
+    input_ = to_json_object(workflow, "top level")
+
+    jobs = to_json_object(input_["jobs"], "jobs")
+    new_jobs = dict[str, Json]()
+    submodules = None
+
+    for job_key in jobs:
+        job = to_json_object(jobs[job_key], f"jobs.{job_key}")
+        if "submodules" not in job:
+            new_jobs[job_key] = job
+            continue
+        if submodules is None:
+            submodules = {
+                normpath(path): name for name, path in read_submodules(root).items()
+            }
+
+        selected = job["submodules"]
+        paths = to_json_array_of_strings(
+            job.get("paths", ["./"]), f"jobs.{job_key}.paths"
+        )
+        if selected is True:
+            selected_paths = [
+                path
+                for path in submodules
+                if any(_is_under(path, job_path) for job_path in paths)
+            ]
+        elif selected is False:
+            selected_paths = []
+        else:
+            selected_paths = [
+                normpath(path)
+                for path in to_json_array_of_strings(
+                    selected, f"jobs.{job_key}.submodules"
+                )
+            ]
+            if unknown := [path for path in selected_paths if path not in submodules]:
+                raise ValueError(
+                    f"jobs.{job_key}.submodules aren't in .gitmodules: {unknown}"
+                )
+            # Like cached step paths, the job must also rerun if they change
+            paths = [
+                *paths,
+                *(
+                    path
+                    for path in selected_paths
+                    if not any(_is_under(path, job_path) for job_path in paths)
+                ),
+            ]
+
+        new_jobs[job_key] = {
+            **job,
+            "paths": paths,
+            "submodules": [
+                {"name": submodules[path], "path": path} for path in selected_paths
+            ],
+        }
+
+    return {**input_, "jobs": new_jobs}
+
+
+def _is_under(path: str, job_path: str) -> bool:
+    job_path = normpath(job_path)
+    return job_path == "." or path == job_path or path.startswith(f"{job_path}/")
+
+
+def fold_conditions(workflow: Json) -> dict[str, Json]:
+    """Return the workflow with if conditions of jobs and steps folded
+
+    Jobs and steps whose condition is statically false are removed, along with
+    needs on the removed jobs. Conditions that are statically true are removed.
+    """
+    input_ = to_json_object(workflow, "top level")
+
+    jobs = to_json_object(input_["jobs"], "jobs")
+    new_jobs = dict[str, Json]()
+    dropped = dict[str, list[str]]()
+
+    for job_key in jobs:
+        job = to_json_object(jobs[job_key], f"jobs.{job_key}")
+        if "if" in job:
+            condition = fold_condition(job["if"])
+            if condition is False:
+                dropped[job_key] = []
+                continue
+            job = _with_condition(job, condition)
+
+        if "steps" in job:
+            new_steps = list[Json]()
+            for i, step in enumerate(
+                to_json_array(job["steps"], f"jobs.{job_key}.steps")
+            ):
+                step = to_json_object(step, f"jobs.{job_key}.steps[{i}]")
+                if "if" in step:
+                    condition = fold_condition(step["if"])
+                    if condition is False:
+                        continue
+                    step = _with_condition(step, condition)
+                new_steps.append(step)
+            job = {**job, "steps": new_steps}
+
+        new_jobs[job_key] = job
+
+    return {**input_, "jobs": replace_fanned_out_needs(new_jobs, dropped)}
+
+
+def _with_condition(obj: dict[str, Json], condition: bool | str) -> dict[str, Json]:
+    if condition is True:
+        return {k: v for k, v in obj.items() if k != "if"}
+    return {**obj, "if": condition}
+
+
+def _get_matrix_cells(matrix: dict[str, Json], location: str) -> list[dict[str, Json]]:
+    """Return the combinations in the same way as GitHub Actions"""
+    include = to_json_array(matrix.get("include", []), f"{location}.include")
+    exclude = to_json_array(matrix.get("exclude", []), f"{location}.exclude")
+    dimensions = {
+        key: to_json_array(value, f"{location}.{key}")
+        for key, value in matrix.items()
+        if key not in ("include", "exclude")
+    }
+
+    cells: list[dict[str, Json]] = [
+        dict(zip(dimensions, values))
+        for values in itertools.product(*dimensions.values())
+    ]
+    if not dimensions:
+        cells = []
+
+    for i, exclusion in enumerate(exclude):
+        exclusion = to_json_object(exclusion, f"{location}.exclude[{i}]")
+        cells = [
+            cell
+            for cell in cells
+            if any(cell.get(key) != value for key, value in exclusion.items())
+        ]
+
+    # Includes extend every cell they don't overwrite an original value of,
+    # otherwise they are a new cell
+    originals = [dict(cell) for cell in cells]
+    for i, inclusion in enumerate(include):
+        inclusion = to_json_object(inclusion, f"{location}.include[{i}]")
+        extended = False
+        for original, cell in zip(originals, cells):
+            if all(
+                original[key] == value
+                for key, value in inclusion.items()
+                if key in original
+            ):
+                cell.update(inclusion)
+                extended = True
+        if not extended:
+            cells.append(dict(inclusion))
+
+    if not cells:
+        raise ValueError(f"{location} has no combinations")
+
+    return cells
+
+
+def _get_cell_job_name(
+    job_key: str, cell: dict[str, Json], *taken: dict[str, Json]
+) -> str:
+    parts = [
+        _to_job_name_part(value if isinstance(value, str) else json.dumps(value))
+        for value in cell.values()
+        if not is_json_array(value) and not is_json_object(value)
+    ]
+    return _get_unique_job_name("-".join([job_key, *parts]), *taken)
+
+
+def _to_job_name_part(string: str) -> str:
+    return re.sub(r"[^\w-]", "_", string)
+
+
+def _get_unique_job_name(name: str, *taken: dict[str, Json]) -> str:
+    unique_name = name
+    i = 1
+    while any(unique_name in jobs for jobs in taken):
+        unique_name = f"{name}-{i}"
+        i += 1
+    return unique_name
+
+
+def replace_fanned_out_needs(
+    jobs: dict[str, Json], fanned_out: dict[str, list[str]]
+) -> dict[str, Json]:
+    """Return the jobs with needs on a fanned out job replaced with all its jobs
+
+    References to the needs context of a job that became a single job are renamed,
+    references to one that became several or none are rejected as GitHub Actions
+    would only have the outputs of one of them.
+    """
+    if not fanned_out:
+        return jobs
+
+    new_jobs = dict[str, Json]()
+    for job_key, job in jobs.items():
+        job = to_json_object(job, f"jobs.{job_key}")
+        if "needs" not in job:
+            new_jobs[job_key] = job
+            continue
+
+        new_needs = list[Json]()
+        renames = list[tuple[str, str]]()
+        for i, need in enumerate(to_json_array(job["needs"], f"jobs.{job_key}.needs")):
+            if is_json_object(need):
+                name = to_string(need["job"], f"jobs.{job_key}.needs[{i}].job")
+                new_needs.extend(
+                    {**need, "job": new_name}
+                    for new_name in fanned_out.get(name, [name])
+                )
+            else:
+                name = to_string(need, f"jobs.{job_key}.needs[{i}]")
+                new_needs.extend(fanned_out.get(name, [name]))
+            if name not in fanned_out:
+                continue
+            names = fanned_out[name]
+            if len(names) == 1:
+                renames.append((f"needs.{name}", f"needs.{names[0]}"))
+            elif replace_identifiers(job, [(f"needs.{name}", "")]) is not job:
+                raise ValueError(
+                    f"jobs.{job_key} uses needs.{name}, but {name} became the jobs"
+                    f" {names}, so it would be the one that happened to finish last"
+                )
+        job = replace_identifiers(job, renames)
+        new_jobs[job_key] = {**job, "needs": new_needs}
+
+    return new_jobs
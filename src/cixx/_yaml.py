@@ -1,8 +1,36 @@
+from io import StringIO
 from textwrap import dedent
+from typing import TextIO
 
+import ruamel.yaml
+from ruamel.yaml.representer import RoundTripRepresenter
 from ruamel.yaml.scalarstring import LiteralScalarString
 
 
 def multiline(string: str) -> str:
     """Dedents and converts to a multiline string"""
     return LiteralScalarString(dedent(string))
+
+
+class _NonAliasingRTRepresenter(RoundTripRepresenter):
+    """Removes aliases because they're not supported by github"""
+
+    def ignore_aliases(self, data: object):
+        return True
+
+    def represent_scalar(self, tag, value, style=None, anchor=None):  # type: ignore
+        return super().represent_scalar(tag, value, style)  # type: ignore
+
+
+def dump(data: object, stream: TextIO):
+    """Writes data as YAML that GitHub accepts"""
+    yaml = ruamel.yaml.YAML()
+    yaml.Representer = _NonAliasingRTRepresenter
+    yaml.dump(data, stream)  # type: ignore
+
+
+def dumps(data: object) -> str:
+    """Returns data as YAML that GitHub accepts"""
+    stream = StringIO()
+    dump(data, stream)
+    return stream.getvalue()
@@ -0,0 +1,72 @@
+import subprocess
+from collections.abc import Callable
+from dataclasses import replace
+from pathlib import Path
+
+import pytest
+
+from cixx._common import JobDetails
+
+_JOB = JobDetails(
+    paths=["./"],
+    output_paths=[],
+    extra_key="",
+    needs=[],
+    force=False,
+    outputs=None,
+    incremental_paths=[],
+    caches=[],
+    output_groups={},
+    need_paths={},
+    matrix=None,
+    shard=None,
+    coalesce=False,
+    condition=None,
+    cached_steps={},
+    restore_concurrency=None,
+    lfs=False,
+    submodules={},
+    sparse_checkout="cone",
+    cache_failures=False,
+    failure_log=False,
+)
+
+
+@pytest.fixture
+def make_job() -> Callable[..., JobDetails]:
+    """Returns a factory of the details of a job with the defaults of _process_job"""
+    return lambda **changes: replace(_JOB, **changes)
+
+
+def _commit_files(repository: Path, files: dict[str, str]):
+    for name, content in files.items():
+        (repository / name).parent.mkdir(parents=True, exist_ok=True)
+        (repository / name).write_text(content)
+    if not (repository / ".git").exists():
+        subprocess.run(["git", "init", "-q"], cwd=repository, check=True)
+    subprocess.run(["git", "add", "."], cwd=repository, check=True)
+    subprocess.run(
+        ["git", "-c", "user.name=x", "-c", "user.email=x", "commit", "-qm", "x"],
+        cwd=repository,
+        check=True,
+    )
+
+
+@pytest.fixture
+def commit_files() -> Callable[[Path, dict[str, str]], None]:
+    """Returns a function to write files to a repository and commit them"""
+    return _commit_files
+
+
+@pytest.fixture
+def workspace(tmp_path: Path) -> Callable[[str, dict[str, str]], Path]:
+    """Returns a function to write files to a new directory in tmp_path"""
+
+    def create(name: str, files: dict[str, str]) -> Path:
+        directory = tmp_path / name
+        for file, content in files.items():
+            (directory / file).parent.mkdir(parents=True, exist_ok=True)
+            (directory / file).write_text(content)
+        return directory
+
+    return create
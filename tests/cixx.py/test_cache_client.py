@@ -0,0 +1,142 @@
+import http.server
+import io
+import tarfile
+import threading
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+
+from cixx._cache_client import (
+    DirectoryBackend,
+    HttpBackend,
+    entry_name,
+    extract,
+    restore_all,
+    save_all,
+)
+
+
+def test_restore_all_reports_each_entry(tmp_path: Path, workspace: Callable[..., Path]):
+    backend = DirectoryBackend(tmp_path / "cache")
+    source = workspace("source", {"a/1.txt": "1", "b/2.txt": "2"})
+    save_all(backend, {"key-a": ["a/"], "key-b": ["b/"]}, source, tmp_path / "home")
+    (tmp_path / "cache" / entry_name("key-corrupt")).write_text("not a tar")
+
+    target = tmp_path / "target"
+    results = restore_all(
+        backend,
+        {
+            "a": "key-a",
+            "b": "key-b",
+            "missing": "key-missing",
+            "corrupt": "key-corrupt",
+        },
+        target,
+        tmp_path / "home",
+        concurrency=2,
+    )
+
+    assert results["a"] is None and results["b"] is None
+    assert results["missing"] == "not found"
+    assert results["corrupt"] is not None and results["corrupt"].startswith("error: ")
+    assert (target / "a/1.txt").read_text() == "1"
+    assert (target / "b/2.txt").read_text() == "2"
+
+
+def _tar(*members: tuple[str, bytes, str]) -> io.BytesIO:
+    """A tar of (name, type, link name) members"""
+    file = io.BytesIO()
+    with tarfile.open(fileobj=file, mode="w") as tar:
+        for name, type_, linkname in members:
+            member = tarfile.TarInfo(name)
+            member.type = type_
+            member.linkname = linkname
+            tar.addfile(member, io.BytesIO())
+    file.seek(0)
+    return file
+
+
+def test_extract_keeps_links_inside(tmp_path: Path):
+    workspace, home = tmp_path / "workspace", tmp_path / "home"
+
+    extract(
+        _tar(
+            ("out/a.txt", tarfile.REGTYPE, ""),
+            ("out/link", tarfile.SYMTYPE, "a.txt"),
+            ("out/hard", tarfile.LNKTYPE, "out/a.txt"),
+        ),
+        workspace,
+        home,
+        "key",
+    )
+
+    assert (workspace / "out/link").readlink() == Path("a.txt")
+    assert (workspace / "out/hard").is_file()
+
+
+@pytest.mark.parametrize(
+    "members",
+    [
+        [("out/link", tarfile.SYMTYPE, "../../outside")],
+        [("out/link", tarfile.SYMTYPE, "/etc/passwd")],
+        [("out/hard", tarfile.LNKTYPE, "../outside")],
+        [("out/hard", tarfile.LNKTYPE, "~/.bashrc")],
+        # Each link is inside but together they lead outside
+        [
+            ("out/up", tarfile.SYMTYPE, ".."),
+            ("out/up/up", tarfile.SYMTYPE, ".."),
+            ("out/up/up/file", tarfile.REGTYPE, ""),
+        ],
+    ],
+)
+def test_extract_rejects_links_outside(
+    tmp_path: Path, members: list[tuple[str, bytes, str]]
+):
+    with pytest.raises(ValueError, match="Unsafe"):
+        extract(_tar(*members), tmp_path / "workspace", tmp_path / "home", "key")
+    assert not (tmp_path / "file").exists()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    directory: Path
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        path = self.directory / self.path.lstrip("/")
+        if not path.is_file():
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(path.read_bytes())
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        length = int(self.headers["Content-Length"])
+        (self.directory / self.path.lstrip("/")).write_bytes(self.rfile.read(length))
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, *_):  # pylint: disable=arguments-differ
+        pass
+
+
+def test_http_backend(tmp_path: Path, workspace: Callable[..., Path]):
+    (tmp_path / "server").mkdir()
+    handler = type("Handler", (_Handler,), {"directory": tmp_path / "server"})
+    with http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        backend = HttpBackend(f"http://127.0.0.1:{server.server_port}/")
+        source = workspace("source", {"out/a.txt": "a"})
+        save_all(backend, {"job-1": ["out/"]}, source, tmp_path / "home")
+
+        results = restore_all(
+            backend,
+            {"job": "job-1", "other": "other-1"},
+            tmp_path / "target",
+            tmp_path / "home",
+            concurrency=4,
+        )
+        server.shutdown()
+
+    assert results == {"job": None, "other": "not found"}
+    assert (tmp_path / "target/out/a.txt").read_text() == "a"
@@ -0,0 +1,73 @@
+import json
+import os
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+
+from cixx._cas import ContentAddressedStore
+
+
+def test_identical_files_are_stored_once(
+    tmp_path: Path, workspace: Callable[..., Path]
+):
+    store = ContentAddressedStore(tmp_path / "cache", workers=2)
+    home = workspace("home", {".cache/tool/x": "tool"})
+    first = workspace("first", {"dist/a.whl": "a", "dist/b.whl": "b"})
+    second = workspace("second", {"dist/a.whl": "a", "dist/b.whl": "b2"})
+    (first / "dist/bin").mkdir()
+    (first / "dist/bin/run").write_text("#!/bin/sh\n")
+    (first / "dist/bin/run").chmod(0o755)
+    os.symlink("a.whl", first / "dist/latest.whl")
+
+    assert store.save("first", ["dist/", "~/.cache/tool"], first, home)
+    assert not store.save("first", ["dist/"], first, home)
+    assert store.save("second", ["dist/"], second, home)
+
+    assert store.keys() == {"first", "second"}
+    # a, b, run and x from the first, only b2 from the second
+    assert len(list((tmp_path / "cache" / "blobs").rglob("*.zst"))) == 5
+    assert store.stats.reused == 1
+
+    target = tmp_path / "target"
+    target_home = tmp_path / "target-home"
+    store.restore("first", target, target_home)
+    assert (target / "dist/a.whl").read_text() == "a"
+    assert (target / "dist/bin/run").stat().st_mode & 0o777 == 0o755
+    assert os.readlink(target / "dist/latest.whl") == "a.whl"
+    assert (target_home / ".cache/tool/x").read_text() == "tool"
+
+
+def test_restore_fetches_only_blobs_missing_locally(
+    tmp_path: Path, workspace: Callable[..., Path]
+):
+    source = workspace("source", {"a.txt": "a" * 1000, "b.txt": "b"})
+    ContentAddressedStore(tmp_path / "cache").save(
+        "first", ["a.txt", "b.txt"], source, tmp_path / "home"
+    )
+    (source / "b.txt").write_text("changed")
+    ContentAddressedStore(tmp_path / "cache").save(
+        "second", ["a.txt", "b.txt"], source, tmp_path / "home"
+    )
+
+    store = ContentAddressedStore(tmp_path / "cache", local=tmp_path / "local")
+    store.restore("first", tmp_path / "one", tmp_path / "home")
+    fetched = store.stats.fetched
+    store.restore("second", tmp_path / "two", tmp_path / "home")
+
+    assert store.stats.reused == 1
+    assert 0 < store.stats.fetched - fetched < fetched
+    assert (tmp_path / "two/b.txt").read_text() == "changed"
+
+
+def test_restore_rejects_paths_outside_the_workspace(tmp_path: Path):
+    store = ContentAddressedStore(tmp_path / "cache")
+    store.manifest("bad").parent.mkdir(parents=True)
+    store.manifest("bad").write_text(
+        json.dumps(
+            {"version": 1, "directories": ["../escape"], "symlinks": {}, "files": {}}
+        )
+    )
+
+    with pytest.raises(ValueError, match="Unsafe path"):
+        store.restore("bad", tmp_path / "workspace", tmp_path / "home")
@@ -1,7 +1,14 @@
 import pytest
 from pytest import param
 
-from cixx._expressions import replace_identiers_in_template_str
+from cixx._expressions import (
+    evaluate,
+    fold_condition,
+    fold_expression,
+    replace_identiers_in_template_str,
+    to_expression,
+)
+from cixx._validation import Json
 
 params = [
     param("", [], "", id="empty with no replacements"),
@@ -52,3 +59,84 @@ def test_replace_identifiers_in_templace_str_returns_correct_result(
     result = replace_identiers_in_template_str(template_str, replacements)
 
     assert result == expected_result
+
+
+_CONTEXTS: dict[str, Json] = {
+    "needs": {"cixx-init": {"result": "success", "outputs": {"a": "true"}}},
+    "runner": {"os": "Linux"},
+    "labels": [{"name": "a"}, {"name": "b"}, {}],
+}
+
+evaluate_params = [
+    param("null", None, id="null"),
+    param("0x1F", 31, id="hex number"),
+    param("'it''s'", "it's", id="escaped quote"),
+    param("needs.cixx-init.outputs.a == 'true'", True, id="dashed property"),
+    param("runner.OS == 'linux'", True, id="case insensitive"),
+    param("needs.missing.result", None, id="missing property"),
+    param("1 == '1' && true == 1", True, id="coerced to number"),
+    param("'' || 'b'", "b", id="or returns operand"),
+    param("!(1 < 2)", False, id="not comparison"),
+    param("format('{0}-{{x}}', 1.0)", "1-{x}", id="format"),
+    param("fromJSON('[1, 2]')[1]", 2, id="index"),
+    param("contains(fromJSON('[1, 2]'), '2')", True, id="contains array"),
+    param("always() && !failure()", True, id="status functions"),
+    param("labels.*.name", ["a", "b"], id="object filter"),
+    param("contains(labels.*.name, 'b')", True, id="contains object filter"),
+]
+
+
+@pytest.mark.parametrize("expression, expected_result", evaluate_params)
+def test_evaluate_returns_correct_result(expression: str, expected_result: Json):
+    assert evaluate(expression, _CONTEXTS) == expected_result
+
+
+@pytest.mark.parametrize("expression", ["a ==", "a.'b'", "(a", "unknown()"])
+def test_evaluate_raises_on_invalid(expression: str):
+    with pytest.raises(ValueError):
+        evaluate(expression, _CONTEXTS)
+
+
+fold_params = [
+    param("github.ref == 'x'", "github.ref == 'x'", id="nothing to fold"),
+    param("format('{0}-{1}', 'a', 1)", "'a-1'", id="format"),
+    param("fromJSON('{\"a\": [1]}').a[0] == 1", "true", id="fromJSON"),
+    param("'a' == 'b' || github.ref", "github.ref", id="or"),
+    param(
+        "github.x && fromJSON('[1, 2]')", "github.x && fromJSON('[1,2]')", id="array"
+    ),
+    param("!(github.x || 1 == 2)", "!github.x", id="not"),
+    param("github.x.*.y && true", "github.x.*.y && true", id="object filter"),
+]
+
+
+@pytest.mark.parametrize("expression, expected_result", fold_params)
+def test_fold_expression_returns_correct_result(expression: str, expected_result: str):
+    assert fold_expression(expression) == expected_result
+
+
+fold_condition_params = [
+    param("${{ 'a' == 'b' }}", False, id="false"),
+    param("'a' == 'a'", True, id="true"),
+    param(False, False, id="not a string"),
+    param("github.ref && true", "github.ref", id="truth of right side"),
+    param("always() && false", False, id="status function false"),
+    param("failure() || true", "always()", id="status function true"),
+    param("success() && github.x", "success() && github.x", id="status function kept"),
+    param("${{ a.*.b && true }}", "a.*.b", id="object filter"),
+    param("${{ a == }}", "a ==", id="unparseable"),
+]
+
+
+@pytest.mark.parametrize("condition, expected_result", fold_condition_params)
+def test_fold_condition_returns_correct_result(
+    condition: Json, expected_result: bool | str
+):
+    assert fold_condition(condition) == expected_result
+
+
+def test_to_expression_folds_constants():
+    assert to_expression("a-${{ 'b' }}-${{ github.ref }}") == (
+        "format('a-b-{0}', github.ref)"
+    )
+    assert to_expression({"a": "${{ 1 }}"}) == "fromJSON('{\"a\":1}')"
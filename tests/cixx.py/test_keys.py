@@ -0,0 +1,95 @@
+import re
+import subprocess
+from collections.abc import Callable
+from pathlib import Path
+
+from cixx._common import (
+    CacheDetails,
+    CachedStepDetails,
+    JobDetails,
+    ShardDetails,
+    get_caches,
+)
+from cixx._init_job import create
+from cixx._keys import GitObjects, get_cache_keys, get_keys
+
+
+def _git(repository: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", *args], cwd=repository, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def test_keys_match_init_job(tmp_path: Path, make_job: Callable[..., JobDetails]):
+    files = {
+        "src/a.py": "a",
+        "src/sub/b.py": "b",
+        "src/with space.py": "c",
+        'src/quote"d\tname.py': "d",
+        "src/ünïcode.py": "e",
+        "docs/index.md": "f",
+        "poetry.lock": "g",
+    }
+    for name, content in files.items():
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text(content)
+    _git(tmp_path, "init", "-q")
+    _git(tmp_path, "add", ".")
+    _git(tmp_path, "-c", "user.name=x", "-c", "user.email=x", "commit", "-qm", "x")
+    commit = _git(tmp_path, "rev-parse", "HEAD")
+
+    jobs = {
+        "root": make_job(
+            caches=[CacheDetails(paths=["~/.cache"], key_files=["poetry.lock"])]
+        ),
+        "docs": make_job(paths=["docs/", "missing/"], needs=["root"]),
+        "cell": make_job(
+            paths=["src/a.py"],
+            needs=["docs"],
+            extra_key="it's $HOME",
+            matrix={"python": "3.10", "os": None},
+            cached_steps={
+                0: CachedStepDetails(paths=["docs/"], output_paths=["a"]),
+                2: CachedStepDetails(paths=["src/sub/"], output_paths=["b"]),
+            },
+        ),
+        **{
+            f"shard-{i}": make_job(
+                paths=["docs", "src/"],
+                needs=["root"],
+                shard=ShardDetails(index=i, count=3, paths=["src/"]),
+            )
+            for i in range(3)
+        },
+        "forced": make_job(
+            force=True,
+            cached_steps={0: CachedStepDetails(paths=[], output_paths=["a"])},
+        ),
+    }
+
+    script = create(None, jobs, None)["steps"][1]["run"]
+    result = subprocess.run(
+        ["bash", "-e", "-c", script],
+        cwd=tmp_path,
+        env={"GITHUB_SHA": commit, "PATH": "/usr/bin:/bin"},
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    outputs = dict(re.findall(r"::set-output name=(.*?)::(.*)", result.stdout))
+
+    with GitObjects(tmp_path) as git:
+        keys = get_keys(git, commit, jobs)
+        cache_keys = get_cache_keys(git, commit, get_caches(jobs))
+
+    assert keys["forced"].value is None
+    assert keys["docs"].missing_paths == ["missing/"]
+    assert {
+        name: key.value
+        for name, key in [*keys.items(), *cache_keys.items()]
+        if key.value is not None
+    } == {
+        name: value for name, value in outputs.items() if not name.startswith("forced")
+    }
+    assert "cell-step-1" in outputs
+    assert len({keys[f"shard-{i}"].parts[-1] for i in range(3)}) == 3
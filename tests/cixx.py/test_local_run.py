@@ -0,0 +1,287 @@
+import re
+import subprocess
+import sys
+from collections.abc import Callable
+from pathlib import Path
+
+_WORKFLOW = """\
+on:
+  push:
+
+jobs:
+  build:
+    runs-on: ubuntu-20.04
+    paths:
+      - src/
+    output-paths:
+      - out/
+    outputs:
+      size: ${{ steps.size.outputs.size }}
+    steps:
+      - mkdir -p out && cp src/a.txt out/b.txt
+      - id: size
+        run: echo "size=$(wc -c < out/b.txt)" >> "$GITHUB_OUTPUT"
+
+  use:
+    runs-on: ubuntu-20.04
+    paths: []
+    needs:
+      - build
+    steps:
+      - test "$(cat out/b.txt)" = hello
+      - test "${{ needs.build.outputs.size }}" = 6
+"""
+
+
+_STEPS_WORKFLOW = """\
+on:
+  push:
+
+jobs:
+  build:
+    runs-on: ubuntu-20.04
+    paths: []
+    steps:
+      - paths:
+          - deps.txt
+        output-paths:
+          - deps/
+        run: mkdir -p deps && cp deps.txt deps/ && echo ran-deps
+      - paths:
+          - src/
+        output-paths:
+          - out/
+        run: mkdir -p out && cat deps/deps.txt src/a.txt > out/all && echo ran-build
+      - grep -q deps out/all
+"""
+
+
+_FAN_IN_WORKFLOW = """\
+on:
+  push:
+
+jobs:
+  a:
+    runs-on: ubuntu-20.04
+    paths: []
+    output-paths:
+      - out/a.txt
+    steps:
+      - mkdir -p out && echo a > out/a.txt
+
+  b:
+    runs-on: ubuntu-20.04
+    paths: []
+    output-paths:
+      - out/b.txt
+    steps:
+      - mkdir -p out && echo b > out/b.txt
+
+  all:
+    runs-on: ubuntu-20.04
+    paths: []
+    restore-concurrency: 2
+    needs:
+      - a
+      - b
+    steps:
+      - test "$(cat out/a.txt out/b.txt)" = "$(printf 'a\\nb')"
+"""
+
+
+_SUBMODULE_WORKFLOW = """\
+on:
+  push:
+
+jobs:
+  build:
+    runs-on: ubuntu-20.04
+    paths:
+      - vendor/
+    submodules: true
+    steps:
+      - test "$(cat vendor/lib/file.txt)" = vendored
+"""
+
+
+_OUTPUTS_WORKFLOW = """\
+on:
+  push:
+
+jobs:
+  build:
+    runs-on: ubuntu-20.04
+    paths:
+      - src/
+    output-paths:
+      - out/
+    outputs:
+      size: ${{ steps.size.outputs.size }}
+    steps:
+      - mkdir -p out && cp src/a.txt out/b.txt
+      - id: size
+        run: echo "size=$(wc -c < out/b.txt)" >> "$GITHUB_OUTPUT"
+
+  use:
+    runs-on: ubuntu-20.04
+    paths:
+      - use.txt
+    needs:
+      - job: build
+        paths: []
+    steps:
+      - test "${{ needs.build.outputs.size }}" = 6
+      - test ! -e out/b.txt
+"""
+
+
+_FAILURE_WORKFLOW = """\
+on:
+  push:
+
+jobs:
+  build:
+    runs-on: ubuntu-20.04
+    paths:
+      - src/
+    cache-failures: true
+    failure-log: true
+    steps:
+      - echo compiling && echo "error $(cat src/a.txt)" && exit 1
+"""
+
+
+def _run(repository: Path, cache: Path) -> list[list[str]]:
+    return [line.split()[:2] for line in _run_logged(repository, cache)[0][:-1]]
+
+
+def _run_logged(
+    repository: Path, cache: Path, check: bool = True
+) -> tuple[list[str], str]:
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "cixx",
+            "run",
+            str(repository / "main.yml"),
+            "--cache-dir",
+            str(cache),
+        ],
+        check=check,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.splitlines(), result.stderr
+
+
+def test_run_twice_hits_cache(tmp_path: Path, commit_files: Callable[..., None]):
+    repository = tmp_path / "repository"
+    commit_files(repository, {"src/a.txt": "hello\n", "main.yml": _WORKFLOW})
+
+    assert _run(repository, tmp_path / "cache") == [
+        ["cixx-init", "success"],
+        ["build", "success"],
+        ["use", "success"],
+    ]
+    assert _run(repository, tmp_path / "cache") == [
+        ["cixx-init", "success"],
+        ["build", "skipped"],
+        ["use", "skipped"],
+    ]
+
+
+def test_run_resumes_from_first_changed_step(
+    tmp_path: Path, commit_files: Callable[..., None]
+):
+    repository = tmp_path / "repository"
+    commit_files(
+        repository,
+        {"src/a.txt": "hi\n", "deps.txt": "deps\n", "main.yml": _STEPS_WORKFLOW},
+    )
+    _, log = _run_logged(repository, tmp_path / "cache")
+    assert "ran-deps" in log and "ran-build" in log
+
+    commit_files(repository, {"src/a.txt": "hello\n"})
+    _, log = _run_logged(repository, tmp_path / "cache")
+    assert "ran-deps" not in log and "ran-build" in log
+
+
+def test_run_restores_needs_at_once(tmp_path: Path, commit_files: Callable[..., None]):
+    repository = tmp_path / "repository"
+    commit_files(repository, {"main.yml": _FAN_IN_WORKFLOW})
+
+    results, log = _run_logged(repository, tmp_path / "cache")
+
+    assert [line.split()[:2] for line in results[:-1]][-1] == ["all", "success"]
+    assert "[all] a: restored" in log and "[all] b: restored" in log
+    assert "[all] Step: Restore a" not in log
+
+
+def test_run_checks_out_submodules(tmp_path: Path, commit_files: Callable[..., None]):
+    submodule = tmp_path / "submodule"
+    commit_files(submodule, {"file.txt": "vendored\n"})
+    repository = tmp_path / "repository"
+    commit_files(repository, {"main.yml": _SUBMODULE_WORKFLOW})
+    subprocess.run(
+        ["git", "-c", "protocol.file.allow=always", "submodule", "add", "-q"]
+        + [str(submodule), "vendor/lib"],
+        cwd=repository,
+        check=True,
+    )
+    commit_files(repository, {})
+
+    results, log = _run_logged(repository, tmp_path / "cache")
+
+    assert results[1].split()[:2] == ["build", "success"], log
+    commit = subprocess.run(
+        ["git", "rev-parse", "HEAD"],
+        cwd=submodule,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    assert f"Saved cixx-submodule-vendor/lib-{commit}" in log
+
+
+def test_run_passes_outputs_without_the_output_paths(
+    tmp_path: Path, commit_files: Callable[..., None]
+):
+    repository = tmp_path / "repository"
+    commit_files(
+        repository,
+        {"src/a.txt": "hello\n", "use.txt": "1", "main.yml": _OUTPUTS_WORKFLOW},
+    )
+    results, log = _run_logged(repository, tmp_path / "cache")
+    assert [line.split()[1] for line in results[:-1]] == ["success"] * 3
+    # From the GitHub job outputs
+    assert "[use] Restoring" not in log
+
+    commit_files(repository, {"use.txt": "2"})
+    results, log = _run_logged(repository, tmp_path / "cache")
+    assert [line.split()[:2] for line in results[:-1]] == [
+        ["cixx-init", "success"],
+        ["build", "skipped"],
+        ["use", "success"],
+    ]
+    assert re.search(r"\[use\] Restoring build-\w+\.cixx-outputs\n", log)
+
+
+def test_run_fails_fast_with_the_cached_failure(
+    tmp_path: Path, commit_files: Callable[..., None]
+):
+    repository = tmp_path / "repository"
+    commit_files(repository, {"src/a.txt": "broken", "main.yml": _FAILURE_WORKFLOW})
+    results, log = _run_logged(repository, tmp_path / "cache", check=False)
+    assert results[1].split()[:2] == ["build", "failure"]
+    assert re.search(r"\[build\] Saved build-\w+\.cixx-failure\n", log)
+
+    results, log = _run_logged(repository, tmp_path / "cache", check=False)
+    assert results[1].split()[:2] == ["build", "failure"]
+    assert "[build] Step: Fail like before" in log
+    assert "[build] error broken" in log  # From the cached log
+    assert "Step: Run echo compiling" not in log
+
+    commit_files(repository, {"src/a.txt": "still broken"})
+    _, log = _run_logged(repository, tmp_path / "cache", check=False)
+    assert "Step: Run echo compiling" in log
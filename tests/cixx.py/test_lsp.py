@@ -0,0 +1,215 @@
+import io
+import json
+import os
+from pathlib import Path
+
+from cixx._lsp import LanguageServer, Location, Workspace
+
+_SHARED = """\
+on:
+  cixx_call:
+    outputs:
+      build: ${{ jobs.build }}
+jobs:
+  build:
+    runs-on: ubuntu-20.04
+    outputs:
+      version: "1"
+    steps:
+      - make
+"""
+
+_MAIN = """\
+on:
+  push:
+jobs:
+  shared:
+    cixx-uses: ./shared.yml
+  check:
+    runs-on: ubuntu-20.04
+    needs:
+      - ${{ jobs.shared.outputs.build }}
+    steps:
+      - echo ${{ jobs.shared.outputs.build.outputs.version }}
+"""
+
+
+def test_edits_update_the_files_using_them(tmp_path: Path):
+    (tmp_path / "shared.yml").write_text(_SHARED)
+    main = tmp_path / "main.yml"
+    workspace = Workspace()
+
+    assert workspace.update(main, _MAIN) == {main}
+    assert not workspace.diagnostics(main)
+
+    affected = workspace.update(
+        tmp_path / "shared.yml",
+        _SHARED.replace(
+            "outputs:\n      version", "force: 1\n    outputs:\n      version"
+        ),
+    )
+
+    assert affected == {main, tmp_path / "shared.yml"}
+    assert [str(problem) for problem in workspace.diagnostics(main)] == [
+        f"{main}: Problems in {tmp_path / 'shared.yml'}"
+    ]
+    assert [
+        str(problem) for problem in workspace.diagnostics(tmp_path / "shared.yml")
+    ] == [
+        f"{tmp_path / 'shared.yml'}:8:12: Expected a boolean"
+        " at 'jobs.build.force' but found a number"
+    ]
+
+
+def test_files_changed_on_disk_are_read_again(tmp_path: Path):
+    shared = tmp_path / "shared.yml"
+    shared.write_text(_SHARED)
+    main = tmp_path / "main.yml"
+    workspace = Workspace()
+    workspace.update(main, _MAIN)
+    assert not workspace.diagnostics(main)
+
+    shared.write_text(
+        _SHARED.replace(
+            "outputs:\n      version", "force: 1\n    outputs:\n      version"
+        )
+    )
+    # Writes in the same clock tick would keep the time
+    os.utime(shared, ns=(0, shared.stat().st_mtime_ns + 1_000_000_000))
+
+    assert [str(problem) for problem in workspace.diagnostics(main)] == [
+        f"{main}: Problems in {shared}"
+    ]
+
+
+def test_definition_and_hover_follow_cixx_uses(tmp_path: Path):
+    (tmp_path / "shared.yml").write_text(_SHARED)
+    main = tmp_path / "main.yml"
+    workspace = Workspace()
+    workspace.update(main, _MAIN)
+
+    # ./shared.yml
+    assert workspace.definition(main, 4, 20) == Location(tmp_path / "shared.yml", 0, 0)
+    assert workspace.hover(main, 4, 20) == "Expands to jobs:\n\n- `shared-build`"
+    # ${{ jobs.shared.outputs.build }}
+    assert workspace.definition(main, 8, 20) == Location(tmp_path / "shared.yml", 3, 6)
+    assert workspace.hover(main, 8, 20) == "The job `shared-build`"
+    # ${{ jobs.shared.outputs.build.outputs.version }}
+    assert workspace.hover(main, 10, 20) == (
+        "```\n${{ needs.shared-build.outputs.version }}\n```"
+    )
+
+
+def _message(message: dict) -> bytes:
+    body = json.dumps(message).encode()
+    return f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+
+
+def _messages(output: bytes) -> list[dict]:
+    messages = list[dict]()
+    while output:
+        header, _, output = output.partition(b"\r\n\r\n")
+        length = int(header.split(b":")[1])
+        messages.append(json.loads(output[:length]))
+        output = output[length:]
+    return messages
+
+
+def test_language_server_publishes_diagnostics(tmp_path: Path):
+    uri = (tmp_path / "main.yml").as_uri()
+    text = (
+        "on:\n  push:\njobs:\n  a:\n    runs-on: ubuntu-20.04\n    needs:\n"
+        "      - b\n    steps:\n      - make\n"
+    )
+    requests = [
+        {"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {}},
+        {
+            "jsonrpc": "2.0",
+            "method": "textDocument/didOpen",
+            "params": {"textDocument": {"uri": uri, "version": 1, "text": text}},
+        },
+        {"jsonrpc": "2.0", "id": 2, "method": "textDocument/formatting"},
+        {"jsonrpc": "2.0", "id": 3, "method": "shutdown"},
+        {"jsonrpc": "2.0", "method": "exit"},
+    ]
+    output = io.BytesIO()
+    server = LanguageServer(
+        io.BytesIO(b"".join(_message(request) for request in requests)), output
+    )
+
+    assert server.serve() == 0
+
+    initialize, diagnostics, formatting, shutdown = _messages(output.getvalue())
+    assert initialize["result"]["capabilities"]["hoverProvider"]
+    assert diagnostics["params"] == {
+        "uri": uri,
+        "diagnostics": [
+            {
+                "range": {
+                    "start": {"line": 6, "character": 8},
+                    "end": {"line": 6, "character": 9},
+                },
+                "severity": 1,
+                "source": "ci++",
+                "message": "Unknown job b at 'jobs.a.needs[0]'",
+            }
+        ],
+    }
+    assert formatting["error"]["code"] == -32601
+    assert shutdown == {"jsonrpc": "2.0", "id": 3, "result": None}
+
+
+def test_language_server_rejects_invalid_requests():
+    requests = [
+        {"jsonrpc": "2.0", "id": 1, "method": "textDocument/hover", "params": {}},
+        {"jsonrpc": "2.0", "id": 2, "params": {}},
+        {"jsonrpc": "2.0", "id": 3, "method": "shutdown"},
+        {"jsonrpc": "2.0", "method": "exit"},
+    ]
+    output = io.BytesIO()
+    server = LanguageServer(
+        io.BytesIO(b"".join(_message(request) for request in requests)), output
+    )
+
+    assert server.serve() == 0
+
+    hover, missing_method, shutdown = _messages(output.getvalue())
+    assert hover["error"] == {
+        "code": -32602,
+        "message": "Expected an object at 'textDocument'",
+    }
+    assert missing_method["error"]["code"] == -32600
+    assert shutdown["result"] is None
+
+
+def test_language_server_republishes_on_watched_file_changes(tmp_path: Path):
+    shared = tmp_path / "shared.yml"
+    shared.write_text(_SHARED)
+    main = tmp_path / "main.yml"
+    requests = [
+        {
+            "jsonrpc": "2.0",
+            "method": "textDocument/didOpen",
+            "params": {"textDocument": {"uri": main.as_uri(), "text": _MAIN}},
+        },
+        {
+            "jsonrpc": "2.0",
+            "method": "workspace/didChangeWatchedFiles",
+            "params": {"changes": [{"uri": shared.as_uri(), "type": 2}]},
+        },
+    ]
+    server = LanguageServer(
+        io.BytesIO(b"".join(_message(request) for request in requests)), io.BytesIO()
+    )
+    server.serve()
+    shared.write_text("jobs: []\n")
+    output = io.BytesIO()
+    server.reader, server.writer = io.BytesIO(_message(requests[1])), output
+
+    server.serve()
+
+    (diagnostics,) = _messages(output.getvalue())
+    assert diagnostics["params"]["uri"] == main.as_uri()
+    assert diagnostics["params"]["diagnostics"][0]["message"] == (
+        f"Problems in {shared}"
+    )
@@ -0,0 +1,357 @@
+import pytest
+
+from cixx import _github_actions as gh
+from cixx.__main__ import _process
+from cixx._expressions import (
+    evaluate,
+    evaluate_template,
+    get_full_expression_or_none,
+    is_truthy,
+)
+from cixx._validation import Json, to_json_object
+
+
+def _steps(**job: Json) -> dict[str, gh.Step]:
+    workflow = _process(
+        {
+            "on": {"push": None},
+            "jobs": {
+                "build": {
+                    "runs-on": "ubuntu-20.04",
+                    "steps": [{"name": "Make", "run": "make"}],
+                    **job,
+                }
+            },
+        }
+    )
+    return {step["name"]: step for step in workflow["jobs"]["build"]["steps"]}
+
+
+def test_lfs_pulls_only_the_job_paths():
+    steps = _steps(paths=["assets/", "README.md"], lfs=True)
+
+    include = "--include='assets/**,README.md'"
+    assert include in steps["Hash LFS pointers"]["run"]
+    assert steps["Hash LFS pointers"]["run"].endswith(' >> "$GITHUB_OUTPUT"')
+    assert f"git lfs pull {include}" in steps["Git LFS pull"]["run"]
+    assert steps["Restore LFS objects"]["with"]["restore-keys"] == "cixx-lfs-"
+    assert "Git LFS pull" not in _steps(paths=["assets/"])
+
+
+def test_precise_sparse_checkout_fetches_only_the_paths():
+    run = _steps(paths=["a/b.txt", "c/", "d[1].txt"], **{"sparse-checkout": "precise"})[
+        "Git clone"
+    ]["run"]
+
+    assert "git sparse-checkout init --no-cone" in run
+    assert "\n/a/b.txt\n/c/\n/d\\[1].txt\nEOF\n" in run
+    assert "fetch --no-tags --depth=1 --filter=blob:none origin" in run
+    assert "--filter" not in _steps(paths=["a/b.txt"])["Git clone"]["run"]
+
+
+def test_claim_skips_the_build_if_another_run_committed_it():
+    steps = _steps(**{"output-paths": ["dist/"]})
+
+    claim = steps["Claim build"]
+    assert claim["with"] == {
+        "path": "dist/\n__cixx_outputs_build.json",
+        "key": "${{ needs.cixx-init.outputs.key-build }}",
+    }
+    # Before the setup, so it's skipped too
+    assert list(steps)[0] == "Claim build"
+    assert steps["Make"]["if"] == "steps.cixx-claim.outputs.cache-hit != 'true'"
+    assert steps["Git clone"]["if"] == steps["Make"]["if"]
+    assert steps["Read outputs"]["if"] == steps["Make"]["if"]
+    assert steps["Commit build"]["if"] == steps["Make"]["if"]
+    assert "Claim build" not in _steps(force=True)
+
+
+def test_concurrency_cancels_superseded_runs_unless_overridden():
+    def concurrency(**input_: Json) -> Json:
+        workflow = _process(
+            {
+                "on": {"push": None},
+                "jobs": {"build": {"runs-on": "ubuntu-20.04", "steps": []}},
+                **input_,
+            }
+        )
+        return workflow.get("concurrency")
+
+    default = concurrency()
+    assert isinstance(default, dict) and default["cancel-in-progress"] is True
+
+    def group(ref: str) -> Json:
+        github = {
+            "workflow": "ci",
+            "ref": ref,
+            "run_id": "7",
+            "event": {"repository": {"default_branch": "main"}},
+        }
+        return evaluate_template(default["group"], {"github": github})
+
+    assert group("refs/heads/topic") == "ci-refs/heads/topic"
+    # Runs of the default branch are never cancelled
+    assert group("refs/heads/main") == "ci-7"
+    assert concurrency(concurrency="deploy") == "deploy"
+    assert concurrency(concurrency=None) is None
+
+
+def test_incremental_state_falls_back_to_the_newest_entry_of_the_job():
+    steps = _steps(**{"incremental-paths": [".cache/build"]})
+
+    restore = steps["Restore incremental state"]
+    assert restore["with"]["path"] == ".cache/build"
+    assert restore["with"]["restore-keys"] == "cixx-incremental.build."
+    assert restore["with"]["key"] == (
+        "cixx-incremental.build.${{ needs.cixx-init.outputs.key-build }}"
+    )
+    save = steps["Save incremental state"]
+    assert save["with"] == {"path": ".cache/build", "key": restore["with"]["key"]}
+    assert f"steps.{restore['id']}.outputs.cache-hit != 'true'" in save["if"]
+
+
+def test_incremental_paths_cant_overlap_output_paths():
+    with pytest.raises(ValueError, match="overlaps output-paths: \\['dist/'\\]"):
+        _steps(**{"incremental-paths": ["dist/"], "output-paths": ["dist/"]})
+
+
+def test_caches_without_key_files_roll_over_each_run():
+    workflow = _process(
+        {
+            "on": {"push": None},
+            "jobs": {
+                "build": {
+                    "runs-on": "ubuntu-20.04",
+                    "steps": [{"run": "make"}],
+                    "cache": [
+                        {"paths": ["~/.npm"]},
+                        {"paths": ["~/.cache/pip"], "key-files": ["poetry.lock"]},
+                    ],
+                }
+            },
+        }
+    )
+
+    npm, pip = (
+        step
+        for step in workflow["jobs"]["build"]["steps"]
+        if step.get("name", "").startswith("Restore ~")
+    )
+    script = workflow["jobs"]["cixx-init"]["steps"][1]["run"]
+    prefix = npm["with"]["restore-keys"].removeprefix("${{ runner.os }}-")
+    assert prefix.endswith("-rolling-")
+    assert f"{prefix}${{GITHUB_RUN_ID}}-${{GITHUB_RUN_ATTEMPT}}" in script
+    assert "restore-keys" not in pip["with"]
+
+
+def _restore_steps(need: Json) -> list[str]:
+    workflow = _process(
+        {
+            "on": {"push": None},
+            "jobs": {
+                "build": {
+                    "runs-on": "ubuntu-20.04",
+                    "output-paths": {"bin": ["out/bin/"], "docs": ["out/docs/"]},
+                    "steps": [{"run": "make"}],
+                },
+                "test": {
+                    "runs-on": "ubuntu-20.04",
+                    "needs": [need],
+                    "steps": [{"run": "make test"}],
+                },
+            },
+        }
+    )
+    return [
+        step["name"]
+        for step in workflow["jobs"]["test"]["steps"]
+        if step.get("name", "").startswith("Restore build")
+    ]
+
+
+def test_needs_restore_the_output_paths_in_or_containing_their_paths():
+    assert _restore_steps({"job": "build", "paths": ["out/bin/tool"]}) == [
+        "Restore build bin"
+    ]
+    assert _restore_steps({"job": "build", "paths": ["out/"]}) == [
+        "Restore build bin",
+        "Restore build docs",
+    ]
+    assert _restore_steps({"job": "build"}) == [
+        "Restore build bin",
+        "Restore build docs",
+    ]
+
+
+def test_needs_cant_ask_for_paths_that_arent_output_paths():
+    with pytest.raises(ValueError, match="has no output-paths \\['src/'\\]"):
+        _restore_steps({"job": "build", "paths": ["src/"]})
+
+
+def _fan_in(**workflow: Json) -> gh.Workflow:
+    return _process(
+        {
+            "on": {"push": None},
+            "jobs": {
+                "build": {
+                    "runs-on": "ubuntu-20.04",
+                    "output-paths": ["dist/"],
+                    "steps": [{"run": "make"}],
+                },
+                "test": {
+                    "runs-on": "ubuntu-20.04",
+                    "needs": ["build"],
+                    "restore-concurrency": 4,
+                    "steps": [{"run": "make test"}],
+                },
+            },
+            **workflow,
+        },
+        telemetry=True,
+    )
+
+
+def test_cache_backend_restores_needs_at_once():
+    workflow = _fan_in(**{"cache-backend": {"url": "${{ vars.CACHE_URL }}"}})
+
+    steps = {step.get("name"): step for step in workflow["jobs"]["test"]["steps"]}
+    assert steps["Restore needs"]["env"]["CIXX_CACHE_URL"] == "${{ vars.CACHE_URL }}"
+    assert "dist/" in steps["Mark restored"]["run"]
+    assert any(
+        step.get("name") == "Commit build to the CI++ cache"
+        for step in workflow["jobs"]["build"]["steps"]
+    )
+
+
+def test_needs_are_restored_one_at_a_time_without_a_cache_backend():
+    workflow = _fan_in()
+
+    assert [
+        step["name"]
+        for step in workflow["jobs"]["test"]["steps"]
+        if step.get("name", "").startswith("Restore")
+    ] == ["Restore build"]
+    assert not any(
+        step.get("name") == "Commit build to the CI++ cache"
+        for step in workflow["jobs"]["build"]["steps"]
+    )
+
+
+def _coalesced(**jobs: Json) -> gh.Workflow:
+    return _process(
+        {
+            "on": {"push": None},
+            "jobs": {
+                name: {
+                    "runs-on": "ubuntu-20.04",
+                    "coalesce": True,
+                    "steps": [{"run": f"make {name}"}],
+                    **to_json_object(job, name),
+                }
+                for name, job in jobs.items()
+            },
+        }
+    )
+
+
+def test_coalesce_groups_jobs_with_the_same_runs_on_and_needs():
+    workflow = _coalesced(
+        a={},
+        b={},
+        c={"runs-on": "windows-2022"},
+        d={"needs": ["a"]},
+        e={"coalesce": False},
+    )
+
+    assert set(workflow["jobs"]) == {"cixx-init", "a-coalesced", "c", "d", "e"}
+    assert workflow["jobs"]["a-coalesced"]["name"] == "a, b"
+    assert workflow["jobs"]["d"]["needs"] == ["cixx-init", "a-coalesced"]
+
+
+def test_coalesced_steps_run_only_if_their_job_needs_building():
+    workflow = _coalesced(a={}, b={"if": "github.ref == 'refs/heads/main'"})
+
+    steps = {
+        step["run"]: step["if"]
+        for step in workflow["jobs"]["a-coalesced"]["steps"]
+        if step.get("run", "").startswith("make ")
+    }
+    assert "needs.cixx-init.outputs.needs-build-a == 'true'" in steps["make a"]
+    assert "github.ref" not in steps["make a"]
+    assert "needs.cixx-init.outputs.needs-build-b == 'true'" in steps["make b"]
+    assert "(github.ref == 'refs/heads/main')" in steps["make b"]
+
+
+def test_coalesce_rejects_clashing_step_ids():
+    with pytest.raises(ValueError, match=r"Can't coalesce a, b, step IDs clash"):
+        _coalesced(
+            a={"steps": [{"id": "make", "run": "make"}]},
+            b={"steps": [{"id": "make", "run": "make"}]},
+        )
+
+
+def test_coalesced_caches_are_saved_after_the_last_job():
+    cache = [{"paths": ["~/.npm"], "key-files": ["package-lock.json"]}]
+    workflow = _coalesced(a={"cache": cache}, b={"cache": cache})
+
+    names = [step.get("name") for step in workflow["jobs"]["a-coalesced"]["steps"]]
+    assert names.count("Restore ~/.npm") == 1
+    assert names.count("Save ~/.npm") == 1
+    assert names.index("Save ~/.npm") > max(
+        i
+        for i, step in enumerate(workflow["jobs"]["a-coalesced"]["steps"])
+        if step.get("run") == "make b"
+    )
+
+
+def test_cached_failures_fail_before_the_setup():
+    names = list(_steps(**{"cache-failures": True, "lfs": True}))
+
+    assert names.index("Fail like before") < names.index("Git clone")
+    assert names.index("Claim build") < names.index("Restore build failure")
+
+
+def test_only_jobs_with_failure_log_log_their_bash_steps():
+    steps = [
+        {"name": "Make", "run": "make"},
+        {"name": "Check", "shell": "pwsh", "run": "./check.ps1"},
+    ]
+
+    assert _steps(steps=steps, **{"cache-failures": True})["Make"]["run"] == "make"
+    logged = _steps(steps=steps, **{"cache-failures": True, "failure-log": True})
+    assert logged["Make"]["shell"] == "bash -e {0}"
+    assert logged["Make"]["run"].endswith(
+        '} 2>&1 | tee -a "$RUNNER_TEMP/cixx-log-build"\n'
+    )
+    assert logged["Check"]["run"] == "./check.ps1"
+
+
+def test_coalesced_jobs_only_cache_failures_of_their_own_steps():
+    workflow = _coalesced(
+        a={"cache-failures": True, "steps": [{"run": "exit 1"}]},
+        b={"cache-failures": True},
+    )
+    conditions = {
+        step["name"]: get_full_expression_or_none(step["if"]) or step["if"]
+        for step in workflow["jobs"]["a-coalesced"]["steps"]
+        if step.get("name", "").startswith("Record ")
+    }
+    needs = {
+        "cixx-init": {"outputs": {"needs-build-a": "true", "needs-build-b": "true"}}
+    }
+
+    def records(job: str, marks: list[str]) -> bool:
+        steps = {
+            f"cixx-failure-{job}-{mark}": {"outputs": {mark: "true"}} for mark in marks
+        }
+        contexts = {"needs": needs, "steps": steps}
+        return is_truthy(
+            evaluate(conditions[f"Record {job} failure"], contexts, "failure")
+        )
+
+    assert records("a", ["started"])
+    # Failed in the setup, or in the commit after its steps succeeded
+    assert not records("a", [])
+    assert not records("a", ["started", "finished"])
+    # a failed so b never ran
+    assert not records("b", [])
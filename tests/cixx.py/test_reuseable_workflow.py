@@ -0,0 +1,85 @@
+from pathlib import Path
+
+from cixx._reuseable_workflow import expand_cixx_uses, replace_jobs_references
+
+_SHARED = """\
+on:
+  cixx_call:
+    outputs:
+      build: ${{ jobs.build }}
+jobs:
+  build:
+    runs-on: ubuntu-20.04
+    steps:
+      - echo ${{ inputs.version }}
+"""
+
+_AGGREGATOR = """\
+on:
+  cixx_call:
+    outputs:
+      build: ${{ jobs.shared.outputs.build }}
+jobs:
+  shared:
+    cixx-uses: ./shared.yml
+    with:
+      version: ${{ inputs.version }}
+  check:
+    needs:
+      - ${{ jobs.shared.outputs.build }}
+    runs-on: ubuntu-20.04
+    steps:
+      - echo check
+"""
+
+_MAIN = """\
+on:
+  push:
+jobs:
+  a:
+    cixx-uses: ./aggregator.yml
+    with:
+      version: "1"
+  b:
+    cixx-uses: ./aggregator.yml
+    with:
+      version: "2"
+  c:
+    cixx-uses: ./shared.yml
+    with:
+      version: "1"
+  uses-c:
+    needs:
+      - ${{ jobs.c.outputs.build }}
+    runs-on: ubuntu-20.04
+    steps:
+      - echo uses c
+"""
+
+
+def test_expand_cixx_uses_shares_identical_instances(tmp_path: Path):
+    (tmp_path / "shared.yml").write_text(_SHARED)
+    (tmp_path / "aggregator.yml").write_text(_AGGREGATOR)
+    (tmp_path / "main.yml").write_text(_MAIN)
+
+    jobs = replace_jobs_references(expand_cixx_uses(tmp_path / "main.yml"))["jobs"]
+
+    assert jobs == {
+        "a-shared-build": {"runs-on": "ubuntu-20.04", "steps": ["echo 1"]},
+        "a-check": {
+            "needs": ["a-shared-build"],
+            "runs-on": "ubuntu-20.04",
+            "steps": ["echo check"],
+        },
+        "b-shared-build": {"runs-on": "ubuntu-20.04", "steps": ["echo 2"]},
+        "b-check": {
+            "needs": ["b-shared-build"],
+            "runs-on": "ubuntu-20.04",
+            "steps": ["echo check"],
+        },
+        "uses-c": {
+            "needs": ["a-shared-build"],
+            "runs-on": "ubuntu-20.04",
+            "steps": ["echo uses c"],
+        },
+    }
@@ -0,0 +1,37 @@
+from collections.abc import Callable
+
+import pytest
+
+from cixx._common import JobDetails
+from cixx._schedule import schedule
+
+
+def test_schedule(make_job: Callable[..., JobDetails]):
+    jobs = {
+        "a": make_job(),
+        "b": make_job(needs=["a"]),
+        "c": make_job(),
+        "d": make_job(needs=["b", "c"]),
+    }
+    durations = {"cixx-init": 10, "a": 60, "b": 30, "c": 50, "d": 5}
+
+    result = schedule(jobs, durations)
+
+    assert result.wall_time == 105
+    assert result.critical_path == ["cixx-init", "a", "b", "d"]
+    assert result.slack == {
+        "cixx-init": 0,
+        "a": 0,
+        "b": 0,
+        "c": 40,
+        "d": 0,
+    }
+    assert not result.is_critical("c")
+
+
+def test_schedule_unknown_duration_and_cycle(make_job: Callable[..., JobDetails]):
+    result = schedule({"a": make_job(), "b": make_job(needs=["a"])}, {"b": 10})
+    assert result.critical_path == ["cixx-init", "a", "b"]
+
+    with pytest.raises(ValueError):
+        schedule({"a": make_job(needs=["b"]), "b": make_job(needs=["a"])}, {})
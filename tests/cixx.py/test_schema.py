@@ -0,0 +1,120 @@
+from pathlib import Path
+
+import pytest
+import ruamel.yaml
+
+from cixx.__main__ import _preprocess, _process, main
+from cixx._reuseable_workflow import expand_cixx_uses
+from cixx._schema import InvalidWorkflowError, check, validate
+
+_INVALID = """\
+x-steps: &steps
+  - echo hi
+  - name: nothing to run
+on:
+  push:
+jobs:
+  a:
+    runs-on: ubuntu-20.04
+    force: "yes"
+    needs:
+      - job: b
+        pathz: []
+    steps:
+      - *steps
+      - run: make
+        timeout-minutes: ${{ inputs.timeout }}
+    sparse-checkout: full
+  b:
+    cixx-uses: ./missing.yml
+"""
+
+
+def test_validate_reports_every_problem_with_its_line():
+    workflow = ruamel.yaml.YAML().load(_INVALID)
+
+    assert [str(problem) for problem in validate(workflow, "main.yml")] == [
+        "main.yml:9:12: Expected a boolean at 'jobs.a.force' but found a string",
+        "main.yml:12:9: Unknown property 'jobs.a.needs[0].pathz'",
+        # Where the anchor is
+        "main.yml:3:5: Expected run or uses at 'jobs.a.steps[0][1]'",
+        "main.yml:17:22: Expected one of cone, precise"
+        " at 'jobs.a.sparse-checkout' but found full",
+    ]
+
+
+def test_check_follows_cixx_uses(tmp_path: Path):
+    (tmp_path / "shared.yml").write_text(
+        "on:\n  cixx_call: {}\njobs:\n  build:\n    shards: 0\n"
+    )
+    (tmp_path / "main.yml").write_text(
+        "on:\n  push:\njobs:\n"
+        "  a:\n    cixx-uses: ./shared.yml\n"
+        "  b:\n    cixx-uses: ./shared.yml\n"
+        "  c:\n    cixx-uses: ./missing.yml\n"
+    )
+
+    assert [str(problem) for problem in check(tmp_path / "main.yml")] == [
+        f"{tmp_path / 'main.yml'}:9:16: No such file ./missing.yml"
+        " at 'jobs.c.cixx-uses'",
+        f"{tmp_path / 'shared.yml'}:5:13: Expected at least 1"
+        " at 'jobs.build.shards' but found 0",
+        # Only jobs without cixx-uses need these
+        f"{tmp_path / 'shared.yml'}:5:5: Missing property 'jobs.build.runs-on'",
+        f"{tmp_path / 'shared.yml'}:5:5: Missing property 'jobs.build.steps'",
+    ]
+
+
+def test_expand_cixx_uses_raises_the_problems(tmp_path: Path):
+    (tmp_path / "main.yml").write_text(_INVALID)
+
+    with pytest.raises(InvalidWorkflowError) as error:
+        expand_cixx_uses(tmp_path / "main.yml")
+
+    assert len(error.value.problems) == 4
+    assert str(error.value).startswith(f"{tmp_path / 'main.yml'}:9:12: ")
+
+
+def test_jobs_with_only_needs_compile_as_pseudo_jobs(tmp_path: Path):
+    (tmp_path / "main.yml").write_text(
+        "on:\n  push:\njobs:\n"
+        "  a:\n    runs-on: ubuntu-20.04\n    steps:\n      - make\n"
+        "  checks:\n    needs: [a]\n"
+    )
+
+    assert not check(tmp_path / "main.yml")
+    assert list(_process(_preprocess(tmp_path / "main.yml"))["jobs"]) == [
+        "cixx-init",
+        "a",
+    ]
+
+
+def test_compile_prints_the_problems(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+):
+    (tmp_path / "main.yml").write_text(_INVALID)
+    monkeypatch.setattr("sys.argv", ["ci++", str(tmp_path / "main.yml")])
+
+    with pytest.raises(SystemExit) as exit_:
+        main()
+
+    assert exit_.value.code == 1
+    assert capsys.readouterr().err.startswith(f"{tmp_path / 'main.yml'}:9:12: ")
+
+
+def test_substituted_values_are_checked(tmp_path: Path):
+    (tmp_path / "main.yml").write_text(
+        "on:\n  push:\njobs:\n"
+        "  a:\n    runs-on: ubuntu-20.04\n    strategy:\n      matrix:\n"
+        "        force: [true, 'yes']\n    force: ${{ matrix.force }}\n"
+        "    steps:\n      - make\n"
+    )
+
+    assert not check(tmp_path / "main.yml")
+    with pytest.raises(InvalidWorkflowError) as error:
+        _preprocess(tmp_path / "main.yml")
+
+    assert [str(problem) for problem in error.value.problems] == [
+        f"{tmp_path / 'main.yml'}: Expected a boolean at 'jobs.a-yes.force'"
+        " but found a string"
+    ]
@@ -0,0 +1,149 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from cixx.__main__ import _process, main
+from cixx._common import INIT_JOB_ID, Helpers
+from cixx._split import find_helpers, get_helpers_action, split
+from cixx._validation import Json
+
+
+def _job(**job: Json) -> Json:
+    return {"runs-on": "ubuntu-20.04", "steps": [{"run": "make"}], **job}
+
+
+_INPUT = {
+    "on": {"push": None},
+    "jobs": {
+        "build": _job(),
+        "test": _job(needs=["build"], paths=["tests/"]),
+        "docs": _job(paths=["docs/"]),
+    },
+}
+
+
+def test_split_keeps_connected_jobs_together():
+    workflow = _process(_INPUT)
+
+    files = split(workflow, "main.yml", 2000)
+
+    assert list(files) == ["main.yml", "main-1.yml", "main-2.yml"]
+    assert list(files["main.yml"]["jobs"]) == [
+        INIT_JOB_ID,
+        "cixx-part-1",
+        "cixx-part-2",
+    ]
+    assert files["main.yml"]["jobs"]["cixx-part-1"] == {
+        "needs": [INIT_JOB_ID],
+        "uses": "./.github/workflows/main-1.yml",
+        "with": {INIT_JOB_ID: "${{ toJSON(needs.cixx-init.outputs) }}"},
+        "secrets": "inherit",
+    }
+    assert list(files["main-1.yml"]["jobs"]) == ["build", "test"]
+    assert list(files["main-2.yml"]["jobs"]) == ["docs"]
+
+    test = files["main-1.yml"]["jobs"]["test"]
+    assert test["needs"] == ["build"]
+    assert test["if"] == (
+        "always() && (needs.build.result == 'success'"
+        " || needs.build.result == 'skipped')"
+        " && fromJSON(inputs.cixx-init).needs-build-test == 'true'"
+    )
+    assert "needs" not in files["main-2.yml"]["jobs"]["docs"]
+    assert "cixx-init" not in str(files["main-2.yml"]["jobs"]).replace(
+        "inputs.cixx-init", ""
+    )
+
+
+def test_split_packs_parts_into_few_children():
+    workflow = _process(_INPUT)
+
+    assert list(split(workflow, "main.yml", 100_000)) == ["main.yml"]
+    assert list(split(workflow, "main.yml", 6000)) == ["main.yml", "main-1.yml"]
+
+
+def test_helpers_replace_repeated_scripts():
+    input_ = {
+        "on": {"push": None},
+        "jobs": {
+            "a": _job(**{"output-paths": ["a.txt"]}),
+            "b": _job(**{"output-paths": ["b.txt"]}),
+            "c": _job(needs=["a", "b"], paths=["src/"], **{"restore-concurrency": 2}),
+            "d": _job(needs=["a", "b"], **{"restore-concurrency": 2}),
+        },
+        "cache-backend": {"directory": "/mnt/cache"},
+    }
+    helper_steps = find_helpers(_process(input_))
+    assert len(helper_steps) == 2  # The restore and save of the cache client
+
+    helpers = Helpers(".github/actions/cixx-main", helper_steps)
+    workflow = _process(input_, helpers=helpers)
+
+    restore = next(
+        step
+        for step in workflow["jobs"]["c"]["steps"]
+        if step.get("id") == "cixx-restore"
+    )
+    assert restore["uses"] == "./.github/actions/cixx-main"
+    assert restore["with"]["helper"] in helper_steps
+    assert "CIXX_RESTORE_ENTRIES" in restore["env"]
+    # The action is cloned with the job's paths
+    clone = next(
+        step for step in workflow["jobs"]["c"]["steps"] if step["name"] == "Git clone"
+    )
+    assert "/.github/actions/cixx-main/" in clone["run"]
+    assert clone["if"] == "steps.cixx-claim.outputs.cache-hit != 'true'"
+
+    action = get_helpers_action({"main.yml": workflow}, helpers, "main.yml")
+    assert action is not None
+    assert action["outputs"] == {
+        "restored": {
+            "description": "The restored output of the step",
+            "value": "${{ steps." + restore["with"]["helper"] + ".outputs.restored }}",
+        }
+    }
+    assert [step["id"] for step in action["runs"]["steps"]] == list(helper_steps)
+
+
+def test_split_forwards_the_force_rerun_input():
+    workflow = _process(
+        {**_INPUT, "jobs": {**_INPUT["jobs"], "docs": _job(**{"cache-failures": True})}}
+    )
+
+    files = split(workflow, "main.yml", 2000)
+
+    assert "cixx-force-rerun" in files["main.yml"]["on"]["workflow_dispatch"]["inputs"]
+    assert "cixx-force-rerun" not in files["main.yml"]["jobs"]["cixx-part-1"]["with"]
+    assert files["main.yml"]["jobs"]["cixx-part-2"]["with"]["cixx-force-rerun"] == (
+        "${{ inputs.cixx-force-rerun == true }}"
+    )
+    assert files["main-2.yml"]["on"]["workflow_call"]["inputs"]["cixx-force-rerun"] == {
+        "type": "boolean",
+        "default": False,
+    }
+
+
+def test_compile_removes_children_it_no_longer_splits_into(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    (tmp_path / "main.yml").write_text(json.dumps(_INPUT))
+    workflows = tmp_path / ".github" / "workflows"
+    workflows.mkdir(parents=True)
+    # Not called by the workflow, so not written by ci++
+    (workflows / "main-9.yml").write_text("{}")
+
+    def compile_(max_bytes: int) -> list[str]:
+        monkeypatch.setattr(
+            "sys.argv",
+            ["ci++", str(tmp_path / "main.yml"), str(workflows / "main.yml")]
+            + ["--split-max-bytes", str(max_bytes)],
+        )
+        with pytest.raises(SystemExit) as exit_:
+            main()
+        assert not exit_.value.code
+        return sorted(path.name for path in workflows.iterdir())
+
+    assert compile_(2000) == ["main-1.yml", "main-2.yml", "main-9.yml", "main.yml"]
+    assert compile_(6000) == ["main-1.yml", "main-9.yml", "main.yml"]
+    assert compile_(100_000) == ["main-9.yml", "main.yml"]
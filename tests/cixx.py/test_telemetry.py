@@ -0,0 +1,119 @@
+import subprocess
+import sys
+from collections.abc import Callable
+from pathlib import Path
+
+from cixx._telemetry import format_report, load_records
+
+_WORKFLOW = """\
+on:
+  push:
+
+jobs:
+  build:
+    runs-on: ubuntu-20.04
+    paths:
+      - src/
+    output-paths:
+      - out/
+    steps:
+      - mkdir -p out && cp src/a.txt out/b.txt
+
+  use:
+    runs-on: ubuntu-20.04
+    paths: []
+    needs:
+      - build
+    steps:
+      - test "$(cat out/b.txt)" = hello
+"""
+
+
+def test_local_runs_record_telemetry(tmp_path: Path, commit_files: Callable[..., None]):
+    repository = tmp_path / "repository"
+    (repository / "src").mkdir(parents=True)
+    commit_files(repository, {"src/a.txt": "hello\n", "main.yml": _WORKFLOW})
+
+    for _ in range(2):
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "cixx",
+                "run",
+                str(repository / "main.yml"),
+                "--cache-dir",
+                str(tmp_path / "cache"),
+                "--telemetry-dir",
+                str(tmp_path / "telemetry"),
+            ],
+            check=True,
+            capture_output=True,
+        )
+
+    records = load_records(tmp_path / "telemetry")
+    assert sorted(record["job"] for record in records) == [
+        "build",
+        "cixx-init",
+        "cixx-init",
+        "use",
+    ]
+    build = next(record for record in records if record["job"] == "build")
+    assert build["status"] == "success"
+    assert [mark["name"] for mark in build["marks"]] == [
+        "start",
+        "cloned",
+        "restored",
+        "ran-build",
+        "saved-build",
+        "end",
+    ]
+    assert build["marks"][-2]["kilobytes"] > 0
+
+    report = format_report(records)
+    assert "Runs: 2, job checks: 4, hits: 2 (50%)" in report
+
+
+def _record(run_id: int, job: str, **fields) -> dict:
+    return {
+        "version": 1,
+        "job": job,
+        "run_id": str(run_id),
+        "run_attempt": "1",
+    } | fields
+
+
+def _marks(**times: float) -> list[dict]:
+    return [
+        {"name": name.replace("_", "-"), "time": time, "kilobytes": 1024}
+        for name, time in times.items()
+    ]
+
+
+def test_format_report():
+    records = [
+        _record(1, "cixx-init", checks={"a": {"key": "a-1", "hit": False}}),
+        _record(
+            1,
+            "a",
+            jobs={"a": {"key": "a-1"}},
+            marks=_marks(
+                start=0, cloned=10, restored=30, ran_a=90, saved_a=100, end=100
+            ),
+        ),
+        _record(2, "cixx-init", checks={"a": {"key": "a-1", "hit": True}}),
+    ]
+
+    assert format_report(records).splitlines() == [
+        "Runs: 2, job checks: 2, hits: 1 (50%)",
+        "Estimated time saved by hits: 1m40s",
+        "Time spent: clone 10s, restore 20s, build 1m00s, save 10s",
+        "Restored 1.0 MB, committed 1.0 MB",
+        "",
+        "Most invalidated jobs (misses x mean duration):",
+        "  a  missed 1/2  mean 1m40s  rebuilt 1m40s",
+        "",
+        "Recent runs:",
+        "  1.1  hits     0%  job time 1m40s",
+        "  2.1  hits   100%  job time 0s",
+    ]
@@ -0,0 +1,241 @@
+from pathlib import Path
+
+import pytest
+from pytest import param
+
+from cixx._transform import (
+    expand_for_each,
+    expand_matrices,
+    expand_shards,
+    expand_submodules,
+    fold_conditions,
+)
+from cixx._validation import Json
+
+params = [
+    param(
+        {"a": [1, 2], "b": ["x"]},
+        {"job-1-x": {"a": 1, "b": "x"}, "job-2-x": {"a": 2, "b": "x"}},
+        id="product",
+    ),
+    param(
+        {"a": [1, 2], "b": ["x", "y"], "exclude": [{"a": 1}, {"a": 2, "b": "y"}]},
+        {"job-2-x": {"a": 2, "b": "x"}},
+        id="exclude partial match",
+    ),
+    param(
+        {"a": [1, 2], "include": [{"a": 2, "c": True}, {"a": 3}]},
+        {"job-1": {"a": 1}, "job-2-true": {"a": 2, "c": True}, "job-3": {"a": 3}},
+        id="include extends or adds",
+    ),
+    param(
+        {"a": ["1.0", "1_0"]},
+        {"job-1_0": {"a": "1.0"}, "job-1_0-1": {"a": "1_0"}},
+        id="unique names",
+    ),
+]
+
+
+@pytest.mark.parametrize("matrix, expected_cells", params)
+def test_expand_matrices_returns_a_job_per_cell(
+    matrix: dict[str, Json], expected_cells: dict[str, Json]
+):
+    workflow: Json = {
+        "jobs": {
+            "job": {"strategy": {"matrix": matrix}, "steps": []},
+            "after": {"needs": ["job"], "steps": []},
+        }
+    }
+
+    result = expand_matrices(workflow)
+
+    jobs = result["jobs"]
+    assert isinstance(jobs, dict)
+    cells = {
+        k: v["matrix"] for k, v in jobs.items() if isinstance(v, dict) and k != "after"
+    }
+    assert cells == expected_cells
+    assert jobs["after"] == {"needs": list(expected_cells), "steps": []}
+
+
+def test_expand_matrices_substitutes_matrix_context():
+    workflow: Json = {
+        "jobs": {
+            "job": {
+                "strategy": {"matrix": {"a": [1], "include": [{"a": 2, "b": "x"}]}},
+                "runs-on": "${{ matrix.a }}",
+                "steps": [{"run": "echo ${{ matrix.b }}"}],
+            },
+        }
+    }
+
+    result = expand_matrices(workflow)
+
+    assert result["jobs"] == {
+        "job-1": {
+            "runs-on": 1,
+            "steps": [{"run": "echo ${{ null }}"}],
+            "matrix": {"a": 1},
+        },
+        "job-2-x": {
+            "runs-on": 2,
+            "steps": [{"run": "echo x"}],
+            "matrix": {"a": 2, "b": "x"},
+        },
+    }
+
+
+def test_expand_matrices_renames_needs_context_of_a_single_cell():
+    workflow: Json = {
+        "jobs": {
+            "job": {"strategy": {"matrix": {"a": ["x"]}}, "steps": []},
+            "after": {
+                "needs": ["job"],
+                "steps": [{"run": "echo ${{ needs.job.outputs.v }}"}],
+            },
+        }
+    }
+
+    result = expand_matrices(workflow)
+
+    assert result["jobs"]["after"] == {
+        "needs": ["job-x"],
+        "steps": [{"run": "echo ${{ needs.job-x.outputs.v }}"}],
+    }
+
+
+def test_expand_matrices_rejects_needs_context_of_several_cells():
+    workflow: Json = {
+        "jobs": {
+            "job": {"strategy": {"matrix": {"a": ["x", "y"]}}, "steps": []},
+            "after": {
+                "needs": ["job"],
+                "steps": [{"run": "echo ${{ needs.job.outputs.v }}"}],
+            },
+        }
+    }
+
+    with pytest.raises(ValueError, match=r"became the jobs \['job-x', 'job-y'\]"):
+        expand_matrices(workflow)
+
+
+def test_expand_shards_returns_a_job_per_shard():
+    workflow: Json = {
+        "jobs": {
+            "job": {"shards": 2, "steps": []},
+            "after": {"needs": [{"job": "job", "paths": ["dist/"]}], "steps": []},
+        }
+    }
+
+    result = expand_shards(workflow)
+
+    assert result["jobs"] == {
+        "job-shard-0": {"steps": [], "shard": {"index": 0, "count": 2}},
+        "job-shard-1": {"steps": [], "shard": {"index": 1, "count": 2}},
+        "after": {
+            "needs": [
+                {"job": "job-shard-0", "paths": ["dist/"]},
+                {"job": "job-shard-1", "paths": ["dist/"]},
+            ],
+            "steps": [],
+        },
+    }
+
+
+def test_expand_for_each_returns_a_job_per_directory(tmp_path: Path):
+    for directory in ["packages/a", "packages/b", "packages/.hidden", "other/c"]:
+        (tmp_path / directory).mkdir(parents=True)
+    (tmp_path / "packages/file").touch()
+    workflow: Json = {
+        "jobs": {
+            "lint": {
+                "for-each": "packages/*",
+                "steps": [{"run": "cd ${{ each.path }} && lint ${{ each.name }}"}],
+            },
+            "after": {"needs": ["lint"], "steps": []},
+        }
+    }
+
+    result = expand_for_each(workflow, tmp_path)
+
+    assert result["jobs"] == {
+        "lint-a": {
+            "paths": ["packages/a/"],
+            "steps": [{"run": "cd packages/a && lint a"}],
+        },
+        "lint-b": {
+            "paths": ["packages/b/"],
+            "steps": [{"run": "cd packages/b && lint b"}],
+        },
+        "after": {"needs": ["lint-a", "lint-b"], "steps": []},
+    }
+
+
+def test_expand_submodules_lists_those_under_the_paths(tmp_path: Path):
+    (tmp_path / ".gitmodules").write_text(
+        """\
+[submodule "lib"]
+\tpath = vendor/lib
+\turl = https://example.com/lib.git
+[submodule "tool"]
+\tpath = tools/tool
+\turl = https://example.com/tool.git
+"""
+    )
+    workflow: Json = {
+        "jobs": {
+            "all": {"paths": ["vendor/"], "submodules": True, "steps": []},
+            "some": {"paths": ["src/"], "submodules": ["tools/tool"], "steps": []},
+            "none": {"steps": []},
+        }
+    }
+
+    result = expand_submodules(workflow, tmp_path)
+
+    assert result["jobs"] == {
+        "all": {
+            "paths": ["vendor/"],
+            "submodules": [{"name": "lib", "path": "vendor/lib"}],
+            "steps": [],
+        },
+        "some": {
+            "paths": ["src/", "tools/tool"],
+            "submodules": [{"name": "tool", "path": "tools/tool"}],
+            "steps": [],
+        },
+        "none": {"steps": []},
+    }
+    with pytest.raises(ValueError):
+        expand_submodules(
+            {"jobs": {"job": {"submodules": ["other"], "steps": []}}}, tmp_path
+        )
+
+
+def test_fold_conditions():
+    workflow: Json = {
+        "jobs": {
+            "never": {"if": "${{ 'a' == 'b' }}", "steps": [{"run": "x"}]},
+            "always": {"if": "'a' == 'a'", "steps": [{"run": "x"}]},
+            "unparseable": {"if": "${{ github.x == }}", "steps": [{"run": "x"}]},
+            "dynamic": {
+                "if": "github.ref == 'main' && true",
+                "needs": ["never", {"job": "always"}],
+                "steps": [
+                    {"if": "false", "run": "skipped"},
+                    {"if": "github.x || 1 == 2", "run": "kept"},
+                ],
+            },
+        }
+    }
+
+    assert fold_conditions(workflow) == {
+        "jobs": {
+            "always": {"steps": [{"run": "x"}]},
+            "unparseable": {"if": "github.x ==", "steps": [{"run": "x"}]},
+            "dynamic": {
+                "if": "github.ref == 'main'",
+                "needs": [{"job": "always"}],
+                "steps": [{"if": "github.x", "run": "kept"}],
+            },
+        }
+    }